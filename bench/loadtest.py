@@ -0,0 +1,297 @@
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from json import dumps
+
+from bench.mock_upstream import MockUpstream, add_arguments, settings_from_args
+from server.config import ROOT_DIR, load_config
+
+
+ENTRY_POINTS = {
+    # api/index.py has no launcher of its own (Vercel imports `app`), so it
+    # is served by werkzeug's threaded server like `flask run` would
+    'api': lambda port: [
+        sys.executable, '-c',
+        'from api.index import app\n'
+        'from werkzeug.serving import run_simple\n'
+        f'run_simple("127.0.0.1", {port}, app, threaded=True)\n'
+    ],
+    'run': lambda port: [sys.executable, 'run.py'],
+}
+
+PAGES = ['/chat/', '/workspace/', '/onboarding/']
+ASSETS = [
+    '/assets/css/style.css',
+    '/assets/js/chat.js',
+    '/assets/js/highlight.min.js',
+    '/assets/img/nog_logo_no_text.png',
+]
+
+
+class Sample:
+    __slots__ = ('status', 'ttfb', 'gaps', 'events', 'bytes', 'error')
+
+    def __init__(self) -> None:
+        self.status = None
+        self.ttfb = None
+        self.gaps = []
+        self.events = 0
+        self.bytes = 0
+        self.error = None
+
+
+def percentile(values: list, pct: float):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Target did not start listening on port {port}")
+
+
+def rss_kb(pid: int):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def cpu_seconds(pid: int):
+    # utime + stime of the target process, in clock ticks
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def request(port: int, method: str, path: str, body: bytes = None, headers: dict = None) -> Sample:
+    sample = Sample()
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    started = time.perf_counter()
+    try:
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        sample.status = response.status
+        streaming = (response.getheader('Content-Type') or '').startswith('text/event-stream')
+        last = None
+        while True:
+            chunk = response.read1(65536)
+            if not chunk:
+                break
+            now = time.perf_counter()
+            if sample.ttfb is None:
+                sample.ttfb = now - started
+            sample.bytes += len(chunk)
+            if not streaming:
+                continue
+            if b'data: {"error"' in chunk or b'data: Error' in chunk:
+                sample.error = 'error event'
+            events = chunk.count(b'\n\n')
+            if events:
+                if last is not None:
+                    sample.gaps.append(now - last)
+                last = now
+                sample.events += events
+        if sample.status >= 400:
+            sample.error = f'HTTP {sample.status}'
+    except Exception as e:
+        sample.error = type(e).__name__
+    finally:
+        connection.close()
+    return sample
+
+
+def conversation(port: int, i: int, same_question: bool) -> Sample:
+    question = 'Quelle est la durée du préavis' if same_question else f'Question {i} sur le bail'
+    body = dumps({
+        'conversation_id': f'bench-{i}',
+        'action': '_ask',
+        'meta': {'id': str(i), 'content': {
+            'conversation': [], 'content_type': 'text',
+            'parts': [{'content': question, 'role': 'user'}],
+        }},
+    }).encode()
+    sample = request(port, 'POST', '/backend-api/v2/conversation', body, {
+        'Content-Type': 'application/json', 'Accept': 'text/event-stream',
+    })
+    if sample.error is None and sample.events == 0:
+        sample.error = 'empty stream'
+    return sample
+
+
+def run_scenario(name: str, task, total: int, concurrency: int, pid: int) -> dict:
+    peak = [rss_kb(pid) or 0]
+    stop = threading.Event()
+
+    def watch():
+        while not stop.wait(0.05):
+            peak[0] = max(peak[0], rss_kb(pid) or 0)
+
+    watcher = threading.Thread(target=watch, daemon=True)
+    watcher.start()
+    cpu_started = cpu_seconds(pid)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(task, range(total)))
+    elapsed = time.perf_counter() - started
+    cpu_finished = cpu_seconds(pid)
+    stop.set()
+    watcher.join()
+
+    ok = [s for s in samples if s.error is None]
+    ttfb = [s.ttfb for s in ok if s.ttfb is not None]
+    gaps = [g for s in ok for g in s.gaps]
+    errors = {}
+    for s in samples:
+        if s.error:
+            errors[s.error] = errors.get(s.error, 0) + 1
+
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    return {
+        'scenario': name,
+        'requests': total,
+        'concurrency': concurrency,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(total / elapsed, 1) if elapsed else None,
+        'events_per_second': round(sum(s.events for s in ok) / elapsed, 1) if elapsed else None,
+        'megabytes_per_second': round(sum(s.bytes for s in ok) / elapsed / 1e6, 3) if elapsed else None,
+        'ttfb_ms': {p: ms(percentile(ttfb, p)) for p in (50, 95, 99)},
+        'inter_event_ms': {p: ms(percentile(gaps, p)) for p in (50, 95, 99)},
+        'peak_rss_mb': round(peak[0] / 1024, 1) if peak[0] else None,
+        'cpu_ms_per_request': round((cpu_finished - cpu_started) * 1000 / total, 2)
+        if cpu_started is not None and cpu_finished is not None else None,
+    }
+
+
+def write_config(path: str, port: int, upstream_url: str, args) -> None:
+    config = dict(load_config())
+    config['site_config'] = {'host': '127.0.0.1', 'port': port, 'debug': False}
+    config['upstream'] = {**config.get('upstream', {}), 'backends': [{'name': 'mock', 'url': upstream_url}]}
+    config['proxy'] = {'enable': False}
+    config['asgi'] = {**config.get('asgi', {}), 'enable': False}
+    config['answer_cache'] = {**config.get('answer_cache', {}), 'enable': args.cache, 'path': None}
+    config['single_flight'] = {**config.get('single_flight', {}), 'enable': args.single_flight}
+    # Every request comes from one address: the per-client rate would turn
+    # most of them into 429s. Concurrency limits stay as configured
+    config['admission'] = {**config.get('admission', {}), 'rate': 0}
+    with open(path, 'w') as f:
+        f.write(dumps(config, indent=4))
+
+
+def bench_entry(entry: str, upstream_url: str, args) -> list:
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = os.path.join(tmp, 'config.json')
+        write_config(config_path, port, upstream_url, args)
+        env = {**os.environ, 'NOG_CONFIG': config_path, 'PYTHONUNBUFFERED': '1'}
+        process = subprocess.Popen(
+            ENTRY_POINTS[entry](port), cwd=ROOT_DIR, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_for_port(port)
+            scenarios = {
+                'conversation': lambda i: conversation(port, i, args.same_question),
+                'pages': lambda i: request(port, 'GET', PAGES[i % len(PAGES)]),
+                'assets': lambda i: request(port, 'GET', ASSETS[i % len(ASSETS)], headers={
+                    'Accept-Encoding': 'br, gzip',
+                }),
+            }
+            results = []
+            for name in args.scenario or list(scenarios):
+                result = run_scenario(name, scenarios[name], args.requests, args.concurrency, process.pid)
+                result['entry'] = entry
+                results.append(result)
+            return results
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+
+
+def print_report(results: list) -> None:
+    columns = ('entry', 'scenario', 'rps', 'ttfb p50/p95/p99 ms', 'gap p50/p95/p99 ms', 'MB/s', 'rss MB', 'cpu ms/req', 'errors')
+    rows = [columns]
+    for r in results:
+        rows.append((
+            r['entry'], r['scenario'], str(r['requests_per_second']),
+            '/'.join(str(r['ttfb_ms'][p]) for p in (50, 95, 99)),
+            '/'.join(str(r['inter_event_ms'][p]) for p in (50, 95, 99)),
+            str(r['megabytes_per_second']), str(r['peak_rss_mb']), str(r['cpu_ms_per_request']),
+            ', '.join(f'{k}={v}' for k, v in r['errors'].items()) or '-',
+        ))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    for row in rows:
+        print('  '.join(cell.ljust(widths[i]) for i, cell in enumerate(row)))
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description='Load test the N.O.G entry points against a mock upstream')
+    parser.add_argument('--entry', action='append', choices=list(ENTRY_POINTS),
+                        help='entry point to benchmark (repeatable, default: all)')
+    parser.add_argument('--scenario', action='append', choices=['conversation', 'pages', 'assets'],
+                        help='scenario to run (repeatable, default: all)')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--same-question', action='store_true',
+                        help='ask one question everywhere (exercises cache and single-flight)')
+    parser.add_argument('--cache', action='store_true', help='keep the answer cache enabled')
+    parser.add_argument('--single-flight', action='store_true', help='keep request coalescing enabled')
+    parser.add_argument('--upstream-url', help='benchmark against this upstream instead of the local mock')
+    parser.add_argument('--json', help='also write the results to this file')
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    mock = None
+    upstream_url = args.upstream_url
+    if upstream_url is None:
+        mock = MockUpstream(settings=settings_from_args(args)).start()
+        upstream_url = mock.url
+
+    try:
+        results = []
+        for entry in args.entry or list(ENTRY_POINTS):
+            results.extend(bench_entry(entry, upstream_url, args))
+    finally:
+        if mock is not None:
+            mock.stop()
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            f.write(dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import argparse
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps, loads
+
+
+class MockSettings:
+    def __init__(self,
+                 tokens: int = 50,
+                 token_interval: float = 0.01,
+                 payload_size: int = 16,
+                 latency: float = 0.1,
+                 error_rate: float = 0.0,
+                 status_error_rate: float = 0.0,
+                 links: int = 0,
+                 language: str = 'fr'
+                 ) -> None:
+        self.tokens = tokens
+        self.token_interval = token_interval
+        self.payload_size = payload_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.status_error_rate = status_error_rate
+        self.links = links
+        self.language = language
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    # Stand-in for the legal-chatbot /v1/assist/stream/ endpoint: answers
+    # every POST with a chunked SSE stream shaped like the real one
+    protocol_version = 'HTTP/1.1'
+    settings = MockSettings()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        settings = self.settings
+        length = int(self.headers.get('Content-Length', 0))
+        question = loads(self.rfile.read(length) or b'{}').get('question', '')
+
+        time.sleep(settings.latency)
+        if random.random() < settings.status_error_rate:
+            body = b'{"detail": "injected error"}'
+            self.send_response(500)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        links = [f'https://www.youtube.com/watch?v={i:011d}' for i in range(settings.links)]
+        word = (question.split() or ['token'])[0]
+        token = (word * (settings.payload_size // max(len(word), 1) + 1))[:settings.payload_size]
+        fail_at = random.randrange(settings.tokens) if random.random() < settings.error_rate else None
+
+        for i in range(settings.tokens):
+            if i == fail_at:
+                # Injected failure: drop the connection mid-answer
+                self.close_connection = True
+                return
+            event = {'response': f'{token} ', 'metadata': {'links': links, 'language': settings.language}}
+            self._chunk(f"data: {dumps(event)}\n\n".encode())
+            if settings.token_interval:
+                time.sleep(settings.token_interval)
+
+        self._chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _chunk(self, data: bytes) -> None:
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+
+class MockUpstream:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, settings: MockSettings = None) -> None:
+        handler = type('Handler', (MockHandler,), {'settings': settings or MockSettings()})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/v1/assist/stream/'
+
+    def start(self) -> 'MockUpstream':
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--tokens', type=int, default=50, help='events per answer')
+    parser.add_argument('--token-interval', type=float, default=0.01, help='seconds between events')
+    parser.add_argument('--payload-size', type=int, default=16, help='characters per event')
+    parser.add_argument('--latency', type=float, default=0.1, help='seconds before the first event')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of streams cut mid-answer')
+    parser.add_argument('--status-error-rate', type=float, default=0.0, help='share of requests answered with 500')
+    parser.add_argument('--links', type=int, default=0, help='metadata.links per event')
+
+
+def settings_from_args(args) -> MockSettings:
+    return MockSettings(
+        tokens=args.tokens,
+        token_interval=args.token_interval,
+        payload_size=args.payload_size,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        status_error_rate=args.status_error_rate,
+        links=args.links,
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local mock of the legal-chatbot streaming API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    mock = MockUpstream(args.host, args.port, settings_from_args(args))
+    print(f"Mock upstream listening on {mock.url}")
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
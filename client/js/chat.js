@@ -138,9 +138,9 @@ const spinner = box_conversations?.querySelector(".spinner");
 const stop_generating = document.querySelector(`.stop_generating`);
 const send_button = document.querySelector(`#send-button`);
 const get_sep = "|||";
-const copyButton = `<div class="copy-icon"> <img src="/assets/img/copy.png" height="14px" /> </div>`;
-const likeButton = `<div class="like-icon"> <img src="/assets/img/like.png" height="14px" /> </div>`;
-const dislikeButton = `<div class="dislike-icon"> <img src="/assets/img/dislike.png" height="14px" /> </div>`;
+const copyButton = `<div class="copy-icon"> <img src="/assets/img/copy.png?w=32" height="14px" /> </div>`;
+const likeButton = `<div class="like-icon"> <img src="/assets/img/like.png?w=32" height="14px" /> </div>`;
+const dislikeButton = `<div class="dislike-icon"> <img src="/assets/img/dislike.png?w=32" height="14px" /> </div>`;
 
 // Fonction pour générer l'avertissement dynamique
 const getDynamicWarning = () => {
@@ -159,6 +159,8 @@ const actionsButtons = `<div class="actions">
                               ${getDynamicWarning()}
                           </div>`;
 const loadingStream = `<span class="loading-stream"></span>`;
+// Character-by-character reveal of streamed answers (cosmetic, never holds text back)
+const STREAM_TYPING = false;
 let prompt_lock = false;
 
 // Messages de greeting mis à jour
@@ -181,7 +183,8 @@ message_input.addEventListener("blur", () => {
 });
 
 const delete_conversations = async () => {
-  localStorage.clear();
+  await store_request(``, { method: `DELETE` });
+  clear_local_storage();
   await new_conversation();
 };
 
@@ -272,6 +275,7 @@ function closeLinks() {
 }
 
 const ask_gpt = async (message) => {
+  let markdown_stream = null;
   try {
     message_input.value = ``;
     message_input.innerHTML = ``;
@@ -329,6 +333,7 @@ const ask_gpt = async (message) => {
       headers: {
         "content-type": `application/json`,
         accept: `text/event-stream`,
+        "X-Client-Id": client_id(),
       },
       body: JSON.stringify({
         conversation_id: window.conversation_id,
@@ -337,7 +342,7 @@ const ask_gpt = async (message) => {
         meta: {
           id: window.token,
           content: {
-            conversation: await get_conversation(window.conversation_id),
+            conversation: await recent_history(window.conversation_id),
             content_type: "text",
             parts: [
               {
@@ -354,39 +359,19 @@ const ask_gpt = async (message) => {
     const decoder = new TextDecoder();
     let buffer = "";
     let text = "";
-    let pendingText = "";
-    let isProcessing = false;
-    const TYPING_SPEED = 7;
-
-    const processPendingText = async (newText = "") => {
-      if (newText) {
-        pendingText += newText;
-      }
-
-      if (isProcessing) {
-        return;
-      }
-
-      isProcessing = true;
-      while (pendingText.length > 0) {
-        const chars = pendingText.split("");
-        pendingText = "";
-
-        for (const char of chars) {
-          text += char;
-          document.getElementById(`imanage_${window.token}`).innerHTML =
-            marked.parse(text);
-          document.getElementById(
-            `imanage_${window.token}`
-          ).lastElementChild.innerHTML += loadingStream;
+    markdown_stream = new MarkdownStream(
+      document.getElementById(`imanage_${window.token}`),
+      {
+        cursor: loadingStream,
+        typing: STREAM_TYPING,
+        onRender: () => {
           message_box.scrollTop = message_box.scrollHeight;
-          await new Promise((resolve) => setTimeout(resolve, TYPING_SPEED));
-        }
+        },
       }
-      isProcessing = false;
-    };
+    );
 
     let links = [];
+    let titles = [];
     language = "fr";
     while (true) {
       const { value, done } = await reader.read();
@@ -404,18 +389,20 @@ const ask_gpt = async (message) => {
         if (line.startsWith("data: ")) {
           const eventData = line.slice(6).trim();
           if (eventData === "[DONE]") {
-            await processPendingText();
+            markdown_stream.finish();
 
             await writeNoRAGConversation(text, message, links);
 
             if (links.length !== 0) {
-              await writeRAGConversation(links, text, language);
+              await writeRAGConversation(links, text, language, titles);
             }
 
             return;
           }
 
           const dataObject = JSON.parse(eventData);
+          // Preamble with the time spent in the server queue
+          if (dataObject.admission) continue;
           if (links.length === 0) {
             links = dataObject.metadata.links;
             changeEggImageToGPTImage();
@@ -423,9 +410,14 @@ const ask_gpt = async (message) => {
             changeEggImageToImanage();
           }
           language = dataObject.metadata.language;
+          // Video titles resolved by the server, sent just before [DONE]
+          if (dataObject.metadata.titles) {
+            titles = dataObject.metadata.titles;
+          }
           try {
             if (dataObject.response) {
-              await processPendingText(dataObject.response);
+              text += dataObject.response;
+              markdown_stream.push(dataObject.response);
             }
           } catch (error) {
             console.error("Error parsing JSON:", error);
@@ -438,8 +430,9 @@ const ask_gpt = async (message) => {
 
     add_message(window.conversation_id, "user", user_image, message);
   } catch (e) {
+    if (markdown_stream) markdown_stream.finish();
     document.getElementById(`shape_assistant_${window.token}`).src =
-      "/assets/img/gpt_egg.png";
+      "/assets/img/gpt_egg.png?w=96";
     document.getElementById(`assistant_${window.token}`).style.opacity = "0";
 
     add_message(window.conversation_id, "user", user_image, message);
@@ -485,7 +478,7 @@ function changeEggImageToImanage() {
   let imanageImageChanged = false;
   if (!imanageImageChanged) {
     document.getElementById(`shape_assistant_${window.token}`).style.content =
-      "url(/assets/img/imanage_egg.png)";
+      "url(/assets/img/imanage_egg.png?w=96)";
 
     const imgElement = document.getElementById(`assistant_${window.token}`);
     imgElement.style.opacity = "0";
@@ -497,7 +490,7 @@ function changeEggImageToGPTImage() {
   let eggImageChanged = false;
   if (!eggImageChanged) {
     document.getElementById(`shape_assistant_${window.token}`).style.content =
-      "url(/assets/img/gpt_egg.png)";
+      "url(/assets/img/gpt_egg.png?w=96)";
     const imgElement = document.getElementById(`assistant_${window.token}`);
     imgElement.style.opacity = "0";
     eggImageChanged = true;
@@ -556,7 +549,7 @@ function createVideoSourceBubble(url, title, index, allVideoIds, allTitles) {
   return bubble;
 }
 
-async function writeRAGConversation(links, text, language) {
+async function writeRAGConversation(links, text, language, server_titles = []) {
   responseContent = text;
 
   document.querySelectorAll(`code`).forEach((el) => {
@@ -564,13 +557,7 @@ async function writeRAGConversation(links, text, language) {
   });
 
   const video_ids = links.map((link) => getYouTubeID(link));
-
-  const titles = await Promise.all(
-    video_ids.map(async (video_id) => {
-      const title = await fetchVideoTitle(video_id);
-      return title;
-    })
-  );
+  const titles = await fetchVideoTitles(video_ids, server_titles);
 
   // Créer le conteneur pour les bulles vidéo
   const videoSourcesContainer = document.createElement('div');
@@ -626,17 +613,22 @@ async function writeRAGConversation(links, text, language) {
   );
 }
 
-async function fetchVideoTitle(videoID) {
-  const response = await fetch(
-    `https://www.youtube.com/oembed?url=https://www.youtube.com/watch?v=${videoID}&format=json`
-  );
-  if (response.ok) {
-    const data = await response.json();
-    title = data.title;
-    const cleanTitle = title.replace(/^\d+ - /, "");
-    return cleanTitle; // Return the title of the video
+// Titles missing from the stream are asked to the server in one request;
+// it caches them, the browser never calls YouTube itself
+async function fetchVideoTitles(video_ids, titles = []) {
+  const missing = video_ids.filter((id, i) => id && !titles[i]);
+  if (missing.length === 0) return video_ids.map((id, i) => titles[i]);
+
+  let resolved = {};
+  try {
+    const response = await fetch(
+      `/backend-api/v2/links?ids=${encodeURIComponent(missing.join(","))}`
+    );
+    if (response.ok) resolved = (await response.json()).titles;
+  } catch (e) {
+    console.warn(e);
   }
-  return null;
+  return video_ids.map((id, i) => titles[i] || resolved[id] || null);
 }
 
 function getScrollY(msg) {
@@ -705,6 +697,7 @@ const hide_option = async (conversation_id) => {
 };
 
 const delete_conversation = async (conversation_id) => {
+  await store_request(`/${conversation_id}`, { method: `DELETE` });
   localStorage.removeItem(`conversation:${conversation_id}`);
 
   const conversation = document.getElementById(`convo-${conversation_id}`);
@@ -755,9 +748,7 @@ const new_conversation = async () => {
 };
 
 const load_conversation = async (conversation_id) => {
-  let conversation = await JSON.parse(
-    localStorage.getItem(`conversation:${conversation_id}`)
-  );
+  let conversation = await fetch_conversation(conversation_id);
 
   conversation?.items.forEach((item) => {
     const messageAlignmentClass =
@@ -840,44 +831,171 @@ const load_conversation = async (conversation_id) => {
   }, 500);
 };
 
-const get_conversation = async (conversation_id) => {
-  let conversation = await JSON.parse(
-    localStorage.getItem(`conversation:${conversation_id}`)
-  );
-  return conversation.items;
+// ========== STOCKAGE DES CONVERSATIONS ==========
+// Les conversations sont stockées côté serveur (/backend-api/v2/conversations),
+// une page à la fois. localStorage ne sert plus que de repli si le stockage
+// serveur est indisponible (déploiement en lecture seule, store désactivé).
+const conversations_api = `/backend-api/v2/conversations`;
+let server_store = true;
+let store_queue = Promise.resolve();
+let conversations_cursor = null;
+
+// X-Client-Id suffit à lire et supprimer l'historique : il est tiré du
+// générateur cryptographique du navigateur (128 bits), pas de Math.random()
+const secret_id = () =>
+  Array.from(crypto.getRandomValues(new Uint8Array(16)), (b) =>
+    b.toString(16).padStart(2, `0`)
+  ).join(``);
+
+const client_id = () => {
+  let id = localStorage.getItem(`client_id`);
+  if (!id) {
+    id = secret_id();
+    localStorage.setItem(`client_id`, id);
+  }
+  return id;
 };
 
-const add_conversation = async (conversation_id, title) => {
-  if (localStorage.getItem(`conversation:${conversation_id}`) == null) {
-    localStorage.setItem(
-      `conversation:${conversation_id}`,
-      JSON.stringify({
-        id: conversation_id,
-        title: title,
-        items: [],
-      })
+// Vider localStorage sans perdre l'identifiant qui relie le navigateur à
+// son historique serveur
+const clear_local_storage = () => {
+  const id = localStorage.getItem(`client_id`);
+  localStorage.clear();
+  if (id) localStorage.setItem(`client_id`, id);
+};
+
+const store_request = async (path, options = {}) => {
+  if (!server_store) return null;
+  try {
+    const response = await fetch(`${conversations_api}${path}`, {
+      ...options,
+      headers: {
+        "content-type": `application/json`,
+        "X-Client-Id": client_id(),
+      },
+    });
+    const data = await response.json();
+    if (response.status >= 500 || data.error === `Conversation store disabled`) {
+      server_store = false;
+      return null;
+    }
+    return response.ok ? data : null;
+  } catch (e) {
+    console.warn(`Stockage serveur indisponible, repli sur localStorage:`, e);
+    server_store = false;
+    return null;
+  }
+};
+
+// Les écritures passent par une file : les messages d'une réponse arrivent
+// dans l'ordre même quand les appels ne sont pas attendus
+const enqueue_store = (task) => {
+  store_queue = store_queue.then(task).catch((e) => console.warn(e));
+  return store_queue;
+};
+
+const fetch_conversation = async (conversation_id) => {
+  await store_queue;
+  let conversation = null;
+  let after = 0;
+  while (server_store && after !== null) {
+    const page = await store_request(
+      `/${conversation_id}?after=${after}&limit=100`
     );
+    if (!page) break;
+    if (conversation) conversation.items.push(...page.items);
+    else conversation = page;
+    after = page.next;
   }
+  if (server_store) return conversation;
+
+  return JSON.parse(localStorage.getItem(`conversation:${conversation_id}`));
+};
+
+const get_conversation = async (conversation_id) => {
+  let conversation = await fetch_conversation(conversation_id);
+  return conversation ? conversation.items : [];
+};
+
+// The server rebuilds the context from its own copy of the conversation;
+// otherwise only the last turns are sent, it keeps a bounded window anyway
+const HISTORY_MESSAGES = 12;
+
+const recent_history = async (conversation_id) => {
+  await store_queue;
+  if (server_store) return [];
+  return (await get_conversation(conversation_id)).slice(-HISTORY_MESSAGES);
+};
+
+const add_conversation = async (conversation_id, title) => {
+  return enqueue_store(async () => {
+    const created = await store_request(``, {
+      method: `POST`,
+      body: JSON.stringify({ id: conversation_id, title: title }),
+    });
+    if (created) return;
+
+    if (localStorage.getItem(`conversation:${conversation_id}`) == null) {
+      localStorage.setItem(
+        `conversation:${conversation_id}`,
+        JSON.stringify({
+          id: conversation_id,
+          title: title,
+          items: [],
+        })
+      );
+    }
+  });
 };
 
 const add_message = async (conversation_id, role, image, content) => {
-  const conversation = JSON.parse(
-    localStorage.getItem(`conversation:${conversation_id}`)
-  );
+  return enqueue_store(async () => {
+    const appended = await store_request(`/${conversation_id}/messages`, {
+      method: `POST`,
+      body: JSON.stringify({ role: role, image: image, content: content }),
+    });
+    if (appended) return;
+
+    const conversation = JSON.parse(
+      localStorage.getItem(`conversation:${conversation_id}`)
+    ) || { id: conversation_id, title: ``, items: [] };
+
+    conversation.items.push({
+      role: role,
+      image: image,
+      content: content,
+    });
 
-  conversation.items.push({
-    role: role,
-    image: image,
-    content: content,
+    localStorage.setItem(
+      `conversation:${conversation_id}`,
+      JSON.stringify(conversation)
+    );
   });
+};
 
-  localStorage.setItem(
-    `conversation:${conversation_id}`,
-    JSON.stringify(conversation)
+// Envoie une seule fois au serveur les conversations encore en localStorage
+const migrate_local_conversations = async () => {
+  const keys = Object.keys(localStorage).filter((key) =>
+    key.startsWith(`conversation:`)
   );
+  for (const key of keys) {
+    if (!server_store) return;
+    let conversation;
+    try {
+      conversation = JSON.parse(localStorage.getItem(key));
+    } catch (e) {
+      console.warn('Conversation corrompue:', key);
+      continue;
+    }
+    const saved = await store_request(``, {
+      method: `POST`,
+      body: JSON.stringify(conversation),
+    });
+    if (saved) localStorage.removeItem(key);
+  }
 };
 
-const load_conversations = async (limit, offset, loader) => {
+const local_conversations = () => {
   let conversations = [];
   for (let i = 0; i < localStorage.length; i++) {
     if (localStorage.key(i).startsWith("conversation:")) {
@@ -885,15 +1003,10 @@ const load_conversations = async (limit, offset, loader) => {
       conversations.push(JSON.parse(conversation));
     }
   }
+  return conversations;
+};
 
-  // Vider la nouvelle liste des conversations
-  const conversationsList = document.getElementById('conversationsList');
-  if (conversationsList) {
-    conversationsList.innerHTML = '';
-    
-    // Ajouter chaque conversation avec la nouvelle structure
-    for (conversation of conversations) {
-      conversationsList.innerHTML += `
+const conversation_item = (conversation) => `
         <div class="conversation-item" id="convo-${conversation.id}">
           <div class="conversation-item-content" onclick="set_conversation('${conversation.id}')">
             <span class="conversation-item-title">${conversation.title}</span>
@@ -903,7 +1016,53 @@ const load_conversations = async (limit, offset, loader) => {
           </div>
         </div>
       `;
-    }
+
+const load_more_item = () => `
+        <div class="conversation-item" id="conversations-more">
+          <div class="conversation-item-content" onclick="load_more_conversations()">
+            <span class="conversation-item-title">…</span>
+          </div>
+        </div>
+      `;
+
+// Page suivante de la liste, sans recharger celles déjà affichées
+const load_more_conversations = async () => {
+  const conversationsList = document.getElementById('conversationsList');
+  if (!conversationsList || !conversations_cursor) return;
+
+  const page = await store_request(
+    `?limit=20&cursor=${encodeURIComponent(conversations_cursor)}`
+  );
+  document.getElementById('conversations-more')?.remove();
+  if (!page) return;
+
+  conversations_cursor = page.next;
+  conversationsList.insertAdjacentHTML(
+    'beforeend',
+    page.conversations.map(conversation_item).join('') +
+      (page.next ? load_more_item() : '')
+  );
+};
+
+const load_conversations = async (limit, offset, loader) => {
+  await store_queue;
+  let conversations;
+  const page = await store_request(`?limit=${limit}`);
+  if (page) {
+    conversations = page.conversations;
+    conversations_cursor = page.next;
+  } else {
+    conversations = local_conversations();
+    conversations_cursor = null;
+  }
+
+  // Vider la nouvelle liste des conversations
+  const conversationsList = document.getElementById('conversationsList');
+  if (conversationsList) {
+    // Ajouter chaque conversation avec la nouvelle structure, en une écriture
+    conversationsList.innerHTML =
+      conversations.map(conversation_item).join('') +
+      (conversations_cursor ? load_more_item() : '');
   } else {
     // Fallback pour l'ancien système si le nouvel élément n'existe pas
     console.warn('conversationsList non trouvé, utilisation de l\'ancien système');
@@ -1059,6 +1218,8 @@ const message_id = () => {
 window.onload = async () => {
   load_settings_localstorage();
 
+  await migrate_local_conversations();
+
   conversations = 0;
   for (let i = 0; i < localStorage.length; i++) {
     if (localStorage.key(i).startsWith("conversation:")) {
@@ -1066,7 +1227,7 @@ window.onload = async () => {
     }
   }
 
-  if (conversations == 0) localStorage.clear();
+  if (!server_store && conversations == 0) clear_local_storage();
 
   await setTimeout(() => {
     load_conversations(20, 0);
@@ -1,10 +1,19 @@
 // ========== CARTE FICHIER AVEC PREVIEW - VERSION FIXÉE ==========
 
+// Le fichier est envoyé au serveur (server/blobs.py) et la carte ne garde
+// que son empreinte : plus de base64 ni de limite localStorage
+const FILE_UPLOADS_URL = '/backend-api/v2/uploads';
+const FILE_BLOBS_URL = '/backend-api/v2/blobs';
+const FILE_UPLOAD_RETRIES = 5;
+// Sans stockage serveur (Vercel), le fichier reste en mémoire
+const FILE_MEMORY_MAX_SIZE = 5 * 1024 * 1024;
+
 class FileCard extends BaseCard {
     constructor(cardData, workspaceManager) {
         // Données par défaut pour les cartes fichier
         const fileDefaults = {
             type: 'file',
+            blobId: cardData.blobId || null,
             fileData: cardData.fileData || null,
             fileName: cardData.fileName || null,
             fileType: cardData.fileType || null,
@@ -47,8 +56,83 @@ class FileCard extends BaseCard {
         });
     }
 
-    // ========== FIX : GESTION PREVIEW SIMPLIFIÉE ==========
-    
+    // ========== UPLOAD PAR MORCEAUX VERS LE SERVEUR ==========
+
+    hasFile() {
+        return !!(this.data.blobId || this.data.fileData);
+    }
+
+    fileUrl(download = false) {
+        if (!this.data.blobId) return this.data.fileData;
+
+        const params = new URLSearchParams({
+            type: this.data.fileType || 'application/octet-stream',
+            name: this.data.fileName || this.data.blobId
+        });
+        if (download) params.set('download', '1');
+        return `${FILE_BLOBS_URL}/${this.data.blobId}?${params}`;
+    }
+
+    async uploadFile(file) {
+        const created = await fetch(FILE_UPLOADS_URL, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ size: file.size, name: file.name, type: file.type })
+        });
+        if (!created.ok) {
+            const error = new Error(`Upload refusé (${created.status})`);
+            error.status = created.status;
+            throw error;
+        }
+
+        let state = await created.json();
+        const uploadUrl = `${FILE_UPLOADS_URL}/${state.id}`;
+        let retries = 0;
+
+        // Un morceau à la fois ; après une coupure, on repart de l'offset
+        // que le serveur a réellement écrit
+        while (!state.blob) {
+            this.showUploadProgress(state.offset / file.size);
+            try {
+                const response = await fetch(uploadUrl, {
+                    method: 'PATCH',
+                    headers: {
+                        'Content-Type': 'application/octet-stream',
+                        'Upload-Offset': String(state.offset)
+                    },
+                    body: file.slice(state.offset, state.offset + state.chunk_size)
+                });
+                const body = await response.json();
+                if (response.ok) {
+                    state = { ...state, ...body };
+                    retries = 0;
+                    continue;
+                }
+                if (response.status === 409 && typeof body.offset === 'number') {
+                    state.offset = body.offset;
+                    continue;
+                }
+                throw new Error(body.error || `Upload échoué (${response.status})`);
+            } catch (error) {
+                if (++retries > FILE_UPLOAD_RETRIES) {
+                    fetch(uploadUrl, { method: 'DELETE' }).catch(() => {});
+                    throw error;
+                }
+                await new Promise(resolve => setTimeout(resolve, 500 * retries));
+                const resumed = await fetch(uploadUrl).then(r => r.ok ? r.json() : null).catch(() => null);
+                if (resumed) state.offset = resumed.offset;
+            }
+        }
+
+        this.showUploadProgress(1);
+        return state.blob;
+    }
+
+    showUploadProgress(ratio) {
+        const text = this.element?.querySelector('.upload-text');
+        if (text) text.textContent = `Envoi en cours… ${Math.round(ratio * 100)}%`;
+    }
+
     async processFile(file) {
         // Vérifier le type de fichier
         if (!this.isValidFileType(file.type)) {
@@ -56,17 +140,24 @@ class FileCard extends BaseCard {
             return;
         }
 
-        // Vérifier la taille (limite à 5MB au lieu de 10MB)
-        const maxSize = 5 * 1024 * 1024; // 5MB pour éviter quota exceeded
-        if (file.size > maxSize) {
-            alert('Fichier trop volumineux. Taille maximale : 5MB.');
-            return;
-        }
-
         try {
-            const fileData = await this.readFileAsDataURL(file);
-            
+            let blobId = null;
+            let fileData = null;
+            try {
+                blobId = await this.uploadFile(file);
+            } catch (error) {
+                // Stockage serveur absent ou désactivé : ancien mode en mémoire
+                if (![404, 503].includes(error.status)) throw error;
+                if (file.size > FILE_MEMORY_MAX_SIZE) {
+                    alert('Fichier trop volumineux. Taille maximale : 5MB.');
+                    return;
+                }
+                fileData = await this.readFileAsDataURL(file);
+            }
+
             // Mettre à jour les données
+            this.cleanup();
+            this.data.blobId = blobId;
             this.data.fileData = fileData;
             this.data.fileName = file.name;
             this.data.fileType = file.type;
@@ -108,7 +199,7 @@ class FileCard extends BaseCard {
     // 🔧 FIX : Méthodes preview simplifiées
     
     showPreview() {
-        if (!this.data.fileData) return;
+        if (!this.hasFile()) return;
         
         const fileView = this.element.querySelector(`#file-view-${this.data.id}`);
         const previewView = this.element.querySelector(`#file-preview-${this.data.id}`);
@@ -158,7 +249,7 @@ class FileCard extends BaseCard {
 
     // 🔧 FIX : Toggle preview corrigé
     async togglePreview() {
-        if (!this.data.fileData) {
+        if (!this.hasFile()) {
             console.warn('⚠️ Pas de fichier à prévisualiser');
             return;
         }
@@ -272,7 +363,7 @@ class FileCard extends BaseCard {
         const previewBtn = this.element.querySelector('.file-preview-btn');
         const uploadBtn = this.element.querySelector('.file-upload-btn');
         
-        const hasFile = !!this.data.fileData;
+        const hasFile = this.hasFile();
         
         if (downloadBtn) {
             downloadBtn.disabled = !hasFile;
@@ -301,13 +392,13 @@ class FileCard extends BaseCard {
                 class: 'file-download-btn', 
                 icon: 'fas fa-download', 
                 title: 'Télécharger fichier',
-                disabled: !this.data.fileData
+                disabled: !this.hasFile()
             },
             { 
                 class: 'file-preview-btn', 
                 icon: 'fas fa-eye', 
                 title: 'Voir/Masquer preview',
-                disabled: !this.data.fileData
+                disabled: !this.hasFile()
             }
         ];
 
@@ -329,14 +420,14 @@ class FileCard extends BaseCard {
     }
 
     getFileViewHTML() {
-        if (!this.data.fileData) {
+        if (!this.hasFile()) {
             return `
                 <div class="file-upload-zone">
                     <div class="upload-icon">
                         <i class="fas fa-cloud-upload-alt"></i>
                     </div>
                     <p class="upload-text">Cliquez pour uploader un fichier</p>
-                    <p class="upload-hint">PDF, PNG, JPG, JPEG, GIF (max 5MB)</p>
+                    <p class="upload-hint">PDF, PNG, JPG, JPEG, GIF</p>
                 </div>
             `;
         }
@@ -361,14 +452,14 @@ class FileCard extends BaseCard {
     }
 
     getPreviewHTML() {
-        if (!this.data.fileData) return '<p class="no-preview">Aucun fichier à prévisualiser</p>';
+        if (!this.hasFile()) return '<p class="no-preview">Aucun fichier à prévisualiser</p>';
 
         if (this.isImageFile()) {
             return `
                 <div class="image-preview">
                     <div class="image-container" id="image-container-${this.data.id}">
                         <img id="preview-image-${this.data.id}" 
-                             src="${this.data.fileData}" 
+                             src="${this.fileUrl()}" 
                              alt="${this.data.fileName}"
                              class="preview-img"
                              onload="this.classList.add('loaded')">
@@ -482,10 +573,10 @@ class FileCard extends BaseCard {
     }
 
     downloadFile() {
-        if (!this.data.fileData) return;
+        if (!this.hasFile()) return;
 
         const link = document.createElement('a');
-        link.href = this.data.fileData;
+        link.href = this.fileUrl(true);
         link.download = this.data.fileName;
         document.body.appendChild(link);
         link.click();
@@ -493,13 +584,17 @@ class FileCard extends BaseCard {
     }
 
     async initPdfPreview() {
-        if (!this.data.fileData || !this.isPdfFile()) return;
+        if (!this.hasFile() || !this.isPdfFile()) return;
 
         try {
             await this.loadPdfJs();
             
-            const pdfData = atob(this.data.fileData.split(',')[1]);
-            const loadingTask = window.pdfjsLib.getDocument({ data: pdfData });
+            // Depuis le serveur, PDF.js ne lit que les plages dont il a
+            // besoin (requêtes Range) au lieu du fichier entier
+            const source = this.data.blobId
+                ? { url: this.fileUrl() }
+                : { data: atob(this.data.fileData.split(',')[1]) };
+            const loadingTask = window.pdfjsLib.getDocument(source);
             
             this.pdfDoc = await loadingTask.promise;
             this.currentPage = 1;
@@ -535,6 +630,7 @@ class FileCard extends BaseCard {
             title: 'Upload File',
             position,
             pinned: false,
+            blobId: null,
             fileData: null,
             fileName: null,
             fileType: null,
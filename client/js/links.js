@@ -18,7 +18,7 @@ function linksHTML() {
     <img
         width="25px"
         height="25px"
-        src="/assets/img/nog_logo_no_text.png"
+        src="/assets/img/nog_logo_no_text.png?w=64"
         alt="logo"
       />
       
@@ -43,16 +43,9 @@ function linksHTML() {
 }
 
 async function fetchVideoTitle(videoID) {
-  const response = await fetch(
-    `https://www.youtube.com/oembed?url=https://www.youtube.com/watch?v=${videoID}&format=json`
-  );
-  if (response.ok) {
-    const data = await response.json();
-    title = data.title;
-    const cleanTitle = title.replace(/^\d+ - /, "");
-    return cleanTitle; // Return the title of the video
-  }
-  return null;
+  // Resolved and cached by the server (see fetchVideoTitles in chat.js)
+  const [title] = await fetchVideoTitles([videoID]);
+  return title;
 }
 
 // for debug
@@ -0,0 +1,129 @@
+/* ========== RENDU MARKDOWN INCRÉMENTAL DES RÉPONSES ========== */
+
+// Renders a streamed markdown answer without re-parsing it from the start.
+// Complete blocks (text up to a blank line outside a code fence) are parsed
+// once and appended; only the unfinished last block is parsed again, at
+// most once per animation frame however many events arrived in between.
+class MarkdownStream {
+  constructor(container, { cursor = "", typing = false, onRender = null } = {}) {
+    this.container = container;
+    this.typing = typing;
+    this.onRender = onRender;
+
+    this.source = "";
+    this.shown = 0; // characters revealed so far (typing effect)
+    this.committed = 0; // characters parsed into permanent blocks
+    this.scanned = 0; // start of the first line not yet scanned
+    this.boundary = 0; // end of the last complete block
+    this.inFence = false;
+    this.previousBlank = true;
+
+    this.tailNodes = [];
+    this.frame = null;
+    this.finished = false;
+
+    const template = document.createElement("template");
+    template.innerHTML = cursor;
+    this.cursor = template.content.firstElementChild;
+
+    container.innerHTML = "";
+  }
+
+  push(text) {
+    if (this.finished || !text) return;
+    this.source += text;
+    this.schedule();
+  }
+
+  schedule() {
+    if (this.frame === null) {
+      this.frame = requestAnimationFrame(() => this.render());
+    }
+  }
+
+  // Renders everything received and stops; the cursor is removed
+  finish() {
+    if (this.finished) return;
+    this.cancel();
+    this.shown = this.source.length;
+    this.render(true);
+  }
+
+  cancel() {
+    this.finished = true;
+    if (this.frame !== null) {
+      cancelAnimationFrame(this.frame);
+      this.frame = null;
+    }
+    if (this.cursor) this.cursor.remove();
+  }
+
+  reveal() {
+    // Typing is cosmetic: the backlog is drained in a few frames, so the
+    // text never lags more than a fraction of a second behind the stream
+    const backlog = this.source.length - this.shown;
+    if (!this.typing || backlog <= 0) {
+      this.shown = this.source.length;
+      return;
+    }
+    this.shown += Math.max(MarkdownStream.TYPING_CHARS, Math.ceil(backlog / 6));
+    this.shown = Math.min(this.shown, this.source.length);
+  }
+
+  scan(end) {
+    // Each line is looked at once: fences toggle, a blank line after text
+    // outside a fence closes a block
+    while (this.scanned < end) {
+      const newline = this.source.indexOf("\n", this.scanned);
+      if (newline === -1 || newline >= end) break;
+
+      const line = this.source.slice(this.scanned, newline);
+      const blank = line.trim() === "";
+      if (/^ {0,3}(```|~~~)/.test(line)) {
+        this.inFence = !this.inFence;
+      } else if (blank && !this.inFence && !this.previousBlank) {
+        this.boundary = newline + 1;
+      }
+      this.previousBlank = blank;
+      this.scanned = newline + 1;
+    }
+  }
+
+  render(final = false) {
+    this.frame = null;
+    this.reveal();
+    this.scan(this.shown);
+    if (final) this.boundary = this.shown;
+
+    this.tailNodes.forEach((node) => node.remove());
+    this.tailNodes = [];
+
+    if (this.boundary > this.committed) {
+      this.container.append(
+        this.parse(this.source.slice(this.committed, this.boundary))
+      );
+      this.committed = this.boundary;
+    }
+
+    if (this.shown > this.committed) {
+      const tail = this.parse(this.source.slice(this.committed, this.shown));
+      this.tailNodes = Array.from(tail.childNodes);
+      this.container.append(tail);
+    }
+
+    if (!final && this.cursor) {
+      (this.container.lastElementChild || this.container).append(this.cursor);
+    }
+    if (this.onRender) this.onRender();
+    if (!final && this.shown < this.source.length) this.schedule();
+  }
+
+  parse(markdown) {
+    const template = document.createElement("template");
+    template.innerHTML = marked.parse(markdown);
+    return template.content;
+  }
+}
+
+// Minimum characters revealed per frame when the typing effect is on
+MarkdownStream.TYPING_CHARS = 3;
@@ -447,3 +447,8 @@ function sendMessage() {
 if (typeof window !== 'undefined') {
    window.ModernChatBar = ModernChatBar;
 }
+
+// Initialisation
+document.addEventListener('DOMContentLoaded', () => {
+   window.modernChatBar = new ModernChatBar();
+});
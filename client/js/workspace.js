@@ -1,5 +1,8 @@
 // ========== WORKSPACE MANAGER AVEC SYSTÈME MODULAIRE - VERSION FIXÉE ==========
 
+// Cards sent per bulk sync request (the server accepts up to documents.max_sync)
+const SYNC_BATCH_SIZE = 200;
+
 class WorkspaceManager {
     constructor() {
         this.cards = [];
@@ -557,9 +560,11 @@ class WorkspaceManager {
 
     /**
      * Synchronizes local changes with iManage
+     * @param {Object} [options]
+     * @param {boolean} [options.force=false] - Overwrite without checking versions
      * @returns {Promise<void>}
      */
-    async syncWithiManage() {
+    async syncWithiManage({ force = false } = {}) {
         try {
             console.log('🔄 Syncing with iManage...');
             this.showLoadingState(true, 'Synchronisation avec iManage en cours...');
@@ -576,45 +581,60 @@ class WorkspaceManager {
                 return;
             }
 
-            // Process each modified/conflicted card
-            for (const card of cardsToSync) {
-                try {
-                    // Update sync status to pending
-                    card.updateSyncStatus('pending');
-
-                    // Prepare document data for iManage
-                    const documentData = {
-                        id: card.data.iManageId,
-                        name: card.data.title,
-                        content: card.getContentForSync(), // Card class should implement this
-                        metadata: {
-                            ...card.data.metadata,
-                            custom1: card.data.clientLevel,
-                            custom2: card.data.workspaceLevel,
-                            folders: card.data.folders
-                        }
-                    };
+            // One request per batch of cards; the server applies each
+            // document only if it is still at the version the card was loaded from
+            let failed = 0;
+            for (let i = 0; i < cardsToSync.length; i += SYNC_BATCH_SIZE) {
+                const batch = cardsToSync.slice(i, i + SYNC_BATCH_SIZE);
+                batch.forEach(card => card.updateSyncStatus('pending'));
+
+                const documents = batch.map(card => ({
+                    id: card.data.iManageId,
+                    name: card.data.title,
+                    version: force ? null : card.data.iManageVersion,
+                    content: card.getContentForSync(), // Card class should implement this
+                    metadata: {
+                        ...card.data.metadata,
+                        custom1: card.data.clientLevel,
+                        custom2: card.data.workspaceLevel,
+                        folders: card.data.folders
+                    }
+                }));
 
-                    // Call iManage API to update document
-                    const response = await fetch(`/api/v2/documents/${card.data.iManageId}`, {
-                        method: 'PUT',
+                let results;
+                try {
+                    const response = await fetch('/api/v2/documents/bulk', {
+                        method: 'POST',
                         headers: { 'Content-Type': 'application/json' },
-                        body: JSON.stringify(documentData)
+                        body: JSON.stringify({ documents })
                     });
-
                     if (!response.ok) {
-                        throw new Error(`Failed to sync document ${card.data.id}: ${response.statusText}`);
+                        throw new Error(`Failed to sync documents: ${response.statusText}`);
                     }
-
-                    // Update sync status and timestamp
-                    card.updateSyncStatus('synced');
-                    card.data.lastSync = new Date().toISOString();
-
+                    results = (await response.json()).results;
                 } catch (error) {
-                    console.error(`❌ Error syncing card ${card.data.id}:`, error);
-                    card.updateSyncStatus('conflict');
+                    batch.forEach(card => card.updateSyncStatus('conflict'));
                     throw error;
                 }
+
+                // Results come back in the order the documents were sent
+                const now = new Date().toISOString();
+                batch.forEach((card, index) => {
+                    const result = results[index];
+                    if (result && result.status === 200) {
+                        card.data.iManageVersion = result.version;
+                        card.data.lastSync = now;
+                        card.updateSyncStatus('synced');
+                    } else {
+                        console.error(`❌ Error syncing card ${card.data.id}:`, result?.error);
+                        card.updateSyncStatus('conflict');
+                        failed++;
+                    }
+                });
+            }
+
+            if (failed > 0) {
+                throw new Error(`${failed} document(s) en conflit sur ${cardsToSync.length}`);
             }
 
             console.log(`✅ Successfully synced ${cardsToSync.length} documents with iManage`);
@@ -646,7 +666,7 @@ class WorkspaceManager {
             switch (resolution) {
                 case 'local':
                     // Keep local version and force push to iManage
-                    await this.syncWithiManage();
+                    await this.syncWithiManage({ force: true });
                     break;
 
                 case 'remote':
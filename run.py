@@ -1,29 +1,30 @@
-from server.app import app
-from server.website import Website
-from server.backend import BackendApi
+import time
+
+STARTED = time.perf_counter()
+
+from server.config import load_config
+from server.factory import create_app
 
-from json import load
 
 if __name__ == '__main__':
-    config = load(open('config.json', 'r'))
+    config = load_config()
     site_config = config['site_config']
 
-    site = Website(app)
-    for route in site.routes:
-        app.add_url_rule(
-            route,
-            view_func=site.routes[route]['function'],
-            methods=site.routes[route]['methods'],
-        )
+    print(f"Running on port {site_config['port']}")
+    if config.get('asgi', {}).get('enable'):
+        import uvicorn
+        from server.asgi import create_asgi_app
 
-    backend_api = BackendApi(app)
-    for route in backend_api.routes:
-        app.add_url_rule(
-            route,
-            view_func=backend_api.routes[route]['function'],
-            methods=backend_api.routes[route]['methods'],
+        uvicorn.run(
+            create_asgi_app(create_app(started=STARTED), config),
+            host=site_config['host'],
+            port=site_config['port'],
+            log_level='debug' if site_config.get('debug') else 'info',
         )
+    elif config.get('wsgi', {}).get('enable'):
+        from server.launcher import serve
 
-    print(f"Running on port {site_config['port']}")
-    app.run(**site_config)
+        serve(create_app, config)
+    else:
+        create_app(started=STARTED).run(**site_config)
     print(f"Closing port {site_config['port']}")
@@ -0,0 +1,339 @@
+import ipaddress
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from json import dumps
+
+from server.config import load_config
+from server.conversations import CLIENT_HEADER, CLIENT_ID
+
+
+class AdmissionError(Exception):
+    def __init__(self, message: str, status: int, retry_after: float) -> None:
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    def headers(self) -> dict:
+        return {'Retry-After': str(max(1, math.ceil(self.retry_after)))}
+
+
+class RateLimiter:
+    # One token bucket per client: `burst` questions at once, then `rate`
+    # per second. Buckets of idle clients are full again and can be dropped,
+    # so only the `max_clients` most recent ones are kept
+    def __init__(self, rate: float = 0.5, burst: int = 5, max_clients: int = 10000) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def take(self, key: str) -> float:
+        # 0 when the question may go, else the seconds until it may
+        if self.rate <= 0:
+            return 0.0
+
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class _Waiter:
+    def __init__(self) -> None:
+        self.granted = False
+        self.event = threading.Event()
+
+    def grant(self) -> bool:
+        self.granted = True
+        self.event.set()
+        return True
+
+
+class _AsyncWaiter:
+    def __init__(self) -> None:
+        # asyncio is only loaded in the ASGI mode
+        import asyncio
+
+        self.granted = False
+        self.loop = asyncio.get_running_loop()
+        self.future = self.loop.create_future()
+
+    def grant(self) -> bool:
+        # Called from whichever thread released the slot
+        try:
+            self.loop.call_soon_threadsafe(self._resolve)
+        except RuntimeError:
+            return False
+        self.granted = True
+        return True
+
+    def _resolve(self) -> None:
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class Ticket:
+    # One admitted stream; the slot goes back when the stream ends
+    def __init__(self, controller: 'AdmissionController', queued: float) -> None:
+        self.controller = controller
+        self.queued = queued
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.controller._release()
+
+    def preamble(self) -> bytes:
+        admission = {'queue_ms': round(self.queued * 1000, 1)}
+        return f"data: {dumps({'admission': admission})}\n\n".encode('utf-8')
+
+
+class _Guarded:
+    # An iterator rather than a generator: WSGI servers close() a response
+    # they never iterated (client gone before the first write), and an
+    # unstarted generator would never reach its `finally`
+    def __init__(self, events, ticket: Ticket) -> None:
+        self.events = iter(events)
+        self.ticket = ticket
+        self.started = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        if not self.started:
+            self.started = True
+            return self.ticket.preamble()
+        try:
+            return next(self.events)
+        except BaseException:
+            self.ticket.release()
+            raise
+
+    def close(self) -> None:
+        try:
+            close = getattr(self.events, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self.ticket.release()
+
+
+class AdmissionController:
+    # Bounds the upstream streams one process keeps open. Past
+    # `max_concurrent`, questions wait in a FIFO of at most `max_queue` for
+    # `queue_timeout` seconds; a full queue or an expired wait is a 503, a
+    # client over its rate a 429. Both are answered without waiting
+    def __init__(self,
+                 enable: bool = True,
+                 max_concurrent: int = 64,
+                 max_queue: int = 128,
+                 queue_timeout: float = 10.0,
+                 limiter: RateLimiter = None,
+                 key: str = 'ip',
+                 trusted_proxies=('127.0.0.1', '::1')
+                 ) -> None:
+        self.enable = enable
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.limiter = RateLimiter(rate=0) if limiter is None else limiter
+        self.key = key
+        self.trusted_proxies = [ipaddress.ip_network(p, strict=False) for p in trusted_proxies]
+        self._lock = threading.Lock()
+        self._waiters = deque()
+        self.active = 0
+        self.admitted = 0
+        self.queued = 0
+        self.queue_seconds = 0.0
+        self.rate_limited = 0
+        self.overloaded = 0
+        self.timeouts = 0
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'AdmissionController':
+        section = config.get('admission', {})
+        return cls(
+            enable=section.get('enable', True),
+            max_concurrent=section.get('max_concurrent', 64),
+            max_queue=section.get('max_queue', 128),
+            queue_timeout=section.get('queue_timeout', 10.0),
+            limiter=RateLimiter(
+                rate=section.get('rate', 0.5),
+                burst=section.get('burst', 5),
+                max_clients=section.get('max_clients', 10000),
+            ),
+            key=section.get('key', 'ip'),
+            trusted_proxies=section.get('trusted_proxies', ['127.0.0.1', '::1']),
+        )
+
+    def client_key(self, headers, remote_addr: str) -> str:
+        # "client" trusts the browser id sent with every question; "ip" uses
+        # the peer address, or the X-Forwarded-For hop just before the
+        # trusted proxies when the peer is one of them
+        if self.key == 'client':
+            client = headers.get(CLIENT_HEADER, '')
+            if CLIENT_ID.match(client):
+                return client
+        if not self._trusted(remote_addr):
+            return remote_addr or ''
+        hops = [hop.strip() for hop in headers.get('X-Forwarded-For', '').split(',') if hop.strip()]
+        # Each proxy appends the address it got the request from: the
+        # right-most hop no trusted proxy vouches for is the client, anything
+        # to its left may be forged
+        for hop in reversed(hops):
+            if not self._trusted(hop):
+                return hop
+        return hops[0] if hops else remote_addr or ''
+
+    def _trusted(self, address: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in self.trusted_proxies)
+
+    def check_rate(self, key: str) -> None:
+        if not self.enable:
+            return
+        wait = self.limiter.take(key)
+        if wait:
+            with self._lock:
+                self.rate_limited += 1
+            raise AdmissionError('Too many requests', 429, wait)
+
+    def _enter(self, waiter):
+        # True when a slot is free and nobody is queued ahead
+        with self._lock:
+            if self.active < self.max_concurrent and not self._waiters:
+                self.active += 1
+                self.admitted += 1
+                return True
+            if len(self._waiters) >= self.max_queue:
+                self.overloaded += 1
+                raise AdmissionError('Server busy', 503, self.queue_timeout)
+            self._waiters.append(waiter)
+            self.queued += 1
+            return False
+
+    def _leave(self, waiter, started: float) -> bool:
+        # After a wait: True if the slot was handed over, False if the
+        # waiter was still queued (and is now removed)
+        with self._lock:
+            self.queue_seconds += time.monotonic() - started
+            if waiter.granted:
+                self.admitted += 1
+                return True
+            self._waiters.remove(waiter)
+            self.timeouts += 1
+            return False
+
+    def _release(self) -> None:
+        with self._lock:
+            while self._waiters:
+                # The slot passes straight to the oldest waiter
+                if self._waiters.popleft().grant():
+                    return
+            self.active -= 1
+
+    def admit(self) -> Ticket:
+        if not self.enable:
+            return None
+        waiter = _Waiter()
+        if self._enter(waiter):
+            return Ticket(self, 0.0)
+
+        started = time.monotonic()
+        waiter.event.wait(self.queue_timeout)
+        if not self._leave(waiter, started):
+            raise AdmissionError('Server busy', 503, self.queue_timeout)
+        return Ticket(self, time.monotonic() - started)
+
+    async def admit_async(self) -> Ticket:
+        import asyncio
+
+        if not self.enable:
+            return None
+        waiter = _AsyncWaiter()
+        if self._enter(waiter):
+            return Ticket(self, 0.0)
+
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # Client gone while queued: give back a slot it may have received
+            if self._leave(waiter, started):
+                self._release()
+            raise
+        if not self._leave(waiter, started):
+            raise AdmissionError('Server busy', 503, self.queue_timeout)
+        return Ticket(self, time.monotonic() - started)
+
+    def guard(self, events, ticket: Ticket):
+        # Preamble first, slot released when the stream ends or is closed
+        if ticket is None:
+            return events
+        return _Guarded(events, ticket)
+
+    def guard_async(self, events, ticket: Ticket):
+        # The ASGI handler releases the ticket itself: an async generator
+        # closed before its first step never runs its cleanup
+        if ticket is None:
+            return events
+        return self._guard_async(events, ticket)
+
+    async def _guard_async(self, events, ticket: Ticket):
+        try:
+            yield ticket.preamble()
+            async for event in events:
+                yield event
+        finally:
+            ticket.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'enable': self.enable,
+                'active': self.active,
+                'waiting': len(self._waiters),
+                'admitted': self.admitted,
+                'queued': self.queued,
+                'queue_seconds': round(self.queue_seconds, 6),
+                'rate_limited': self.rate_limited,
+                'overloaded': self.overloaded,
+                'timeouts': self.timeouts,
+                'clients': len(self.limiter),
+            }
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller() -> AdmissionController:
+    global _controller
+
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController.from_config(load_config())
+    return _controller
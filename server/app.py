@@ -1,3 +0,0 @@
-from flask import Flask
-
-app = Flask(__name__, template_folder='./../client/html')
@@ -0,0 +1,412 @@
+import asyncio
+import sys
+import time
+from json import loads, dumps
+
+from server.admission import AdmissionError, get_admission_controller
+from server.balancer import UpstreamRegistry, get_registry, proxy_settings
+from server.cache import get_answer_cache
+from server.config import load_config
+from server.context import get_context_builder
+from server.conversation import (
+    SSE_HEADERS, CORS_HEADERS, DONE_EVENT,
+    extract_question, build_payload, error_event
+)
+from server.links import get_link_resolver
+from server.metrics import get_metrics
+from server.relay import aiter_frames
+from server.resilience import CircuitOpenError, get_resilience
+from server.singleflight import get_async_single_flight
+from server.upstream import DEFAULT_HEADERS
+
+
+CONVERSATION_PATH = '/backend-api/v2/conversation'
+
+
+def _import_httpx():
+    try:
+        import httpx
+    except ImportError as e:
+        raise RuntimeError(
+            "The ASGI serving mode needs httpx: pip install -r requirements-asgi.txt"
+        ) from e
+    return httpx
+
+
+def _encode_headers(headers: dict) -> list:
+    return [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers.items()]
+
+
+class _WsgiInput:
+    # wsgi.input over the ASGI receive channel, read from the executor
+    # thread the WSGI app runs in: each read waits for the body chunks it
+    # needs instead of the whole body
+    def __init__(self, receive, loop) -> None:
+        self.receive = receive
+        self.loop = loop
+        self.buffer = bytearray()
+        self.done = False
+
+    def _fill(self) -> None:
+        message = asyncio.run_coroutine_threadsafe(self.receive(), self.loop).result()
+        if message['type'] == 'http.disconnect':
+            self.done = True
+            return
+        self.buffer += message.get('body', b'')
+        self.done = not message.get('more_body')
+
+    def _take(self, size: int) -> bytes:
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def read(self, size: int = -1) -> bytes:
+        while not self.done and (size is None or size < 0 or len(self.buffer) < size):
+            self._fill()
+        return self._take(len(self.buffer) if size is None or size < 0 else size)
+
+    def readline(self, size: int = -1) -> bytes:
+        while not self.done and b'\n' not in self.buffer and (size is None or size < 0 or len(self.buffer) < size):
+            self._fill()
+        end = self.buffer.find(b'\n') + 1 or len(self.buffer)
+        if size is not None and size >= 0:
+            end = min(end, size)
+        return self._take(end)
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+
+class AsyncUpstreamClient:
+    def __init__(self,
+                 registry: UpstreamRegistry,
+                 max_connections: int = 1000,
+                 max_keepalive_connections: int = 100,
+                 connect_timeout: float = 5.0,
+                 read_timeout: float = 30.0,
+                 http2: bool = False,
+                 proxies: dict = None
+                 ) -> None:
+        httpx = _import_httpx()
+        self.registry = registry
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+        )
+        # Outbound proxy per scheme, as requests does with `proxies`
+        mounts = {
+            f'{scheme}://': httpx.AsyncHTTPTransport(proxy=proxy, http2=http2, limits=limits)
+            for scheme, proxy in (proxies or {}).items()
+        }
+        self.client = httpx.AsyncClient(
+            headers=DEFAULT_HEADERS,
+            http2=http2,
+            limits=limits,
+            mounts=mounts or None,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        )
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'AsyncUpstreamClient':
+        upstream = config.get('upstream', {})
+        section = config.get('asgi', {})
+        return cls(
+            registry=get_registry(),
+            max_connections=section.get('max_connections', 1000),
+            max_keepalive_connections=section.get('max_keepalive_connections', 100),
+            connect_timeout=upstream.get('connect_timeout', 5.0),
+            read_timeout=upstream.get('read_timeout', 30.0),
+            http2=section.get('http2', False),
+            proxies=proxy_settings(config),
+        )
+
+    async def send(self, payload: dict):
+        # A fresh request per attempt: retries and hedges must not share one
+        lease = self.registry.acquire()
+        request = self.client.build_request('POST', lease.url, json=payload)
+        try:
+            response = await self.client.send(request, stream=True)
+        except Exception:
+            lease.fail()
+            raise
+        except BaseException:
+            # A losing hedge cancelled while it connected: not the backend's fault
+            lease.release()
+            raise
+        lease.headers(response.status_code)
+        return lease.wrap_async(response)
+
+    async def relay(self, payload: dict):
+        httpx = _import_httpx()
+        try:
+            with get_metrics().upstream_call() as call:
+                async with get_resilience().astream(lambda: self.send(payload), aiter_frames) as r:
+                    if r.status_code >= 400:
+                        call.http_error(r.status_code)
+                        yield error_event(f"API returned status code {r.status_code}")
+                        yield DONE_EVENT
+                        return
+
+                    async for frames in get_link_resolver().enrich_async(call.alines(r.aframes())):
+                        yield frames
+
+        except CircuitOpenError:
+            yield error_event("Service temporarily unavailable")
+            yield DONE_EVENT
+        except httpx.TimeoutException:
+            yield error_event("Request timeout")
+            yield DONE_EVENT
+        except httpx.TransportError:
+            yield error_event("Connection error to external API")
+            yield DONE_EVENT
+        except Exception as e:
+            yield error_event(f"Unexpected error: {str(e)}")
+            yield DONE_EVENT
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+class AsgiApp:
+    # Serves the conversation stream natively on the event loop and hands
+    # every other route (pages, assets, debug) to the Flask app in a thread
+    def __init__(self, wsgi_app, config: dict = None) -> None:
+        self.wsgi_app = wsgi_app
+        self.config = load_config() if config is None else config
+        self.upstream = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+
+        if scope['type'] != 'http':
+            return
+
+        if scope['path'] == CONVERSATION_PATH:
+            if scope['method'] == 'POST':
+                return await self._conversation(scope, receive, send)
+            if scope['method'] == 'OPTIONS':
+                return await self._respond(send, 200, b'', CORS_HEADERS)
+
+        return await self._wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self._get_upstream()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.upstream is not None:
+                    await self.upstream.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _get_upstream(self) -> AsyncUpstreamClient:
+        if self.upstream is None:
+            self.upstream = AsyncUpstreamClient.from_config(self.config)
+        return self.upstream
+
+    async def _read_body(self, receive) -> bytes:
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        return b''.join(chunks)
+
+    async def _respond(self, send, status: int, body: bytes, headers: dict):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': _encode_headers({**headers, 'Content-Length': str(len(body))}),
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _refuse(self, send, status: int, message: str, headers: dict):
+        await self._respond(send, status, error_event(message) + DONE_EVENT, {
+            **SSE_HEADERS,
+            'Content-Type': 'text/event-stream',
+            **headers,
+        })
+
+    async def _json(self, send, status: int, data: dict):
+        await self._respond(send, status, dumps(data).encode(), {'Content-Type': 'application/json'})
+
+    async def _conversation(self, scope, receive, send):
+        started = time.perf_counter()
+        try:
+            data = loads(await self._read_body(receive) or b'null')
+        except ValueError:
+            data = None
+        if not data:
+            return await self._json(send, 400, {"error": "No JSON data provided"})
+
+        question_text = extract_question(data)
+        if not question_text:
+            return await self._json(send, 400, {"error": "No question provided"})
+
+        headers = {k.decode('latin-1').title(): v.decode('latin-1') for k, v in scope.get('headers', [])}
+        admission = get_admission_controller()
+        payload = build_payload(question_text)
+        context = get_context_builder().apply(payload, data, headers)
+        answer_cache = get_answer_cache()
+        events, cache_status = answer_cache.stream_async(
+            payload['question'], headers, lambda: self._get_upstream().relay(payload), context
+        )
+
+        ticket = None
+        if cache_status != 'HIT':
+            resilience = get_resilience()
+            if not resilience.available():
+                return await self._refuse(send, 503, "Service temporarily unavailable", {
+                    'Retry-After': str(int(resilience.breaker.retry_after()) + 1),
+                    'X-Cache': cache_status,
+                })
+            # Only questions that reach the upstream use up the client's rate
+            try:
+                admission.check_rate(admission.client_key(headers, (scope.get('client') or ('',))[0]))
+                ticket = await admission.admit_async()
+            except AdmissionError as e:
+                return await self._refuse(send, e.status, str(e), {**e.headers(), 'X-Cache': cache_status})
+
+        # The slot is given back however the handler ends, even before streaming
+        try:
+            flight_role = 'off'
+            if cache_status != 'HIT':
+                events, flight_role = get_async_single_flight().stream(
+                    answer_cache.key(payload['question'], context), events
+                )
+                if flight_role == 'follower' and ticket is not None:
+                    # Reads the leader's stream: the slot goes back at once
+                    ticket.release()
+                    ticket = None
+
+            events = get_metrics().track_stream_async(events, started, cache_status)
+
+            # Queue time goes out first; the slot is freed however the stream ends
+            events = admission.guard_async(events, ticket)
+
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': _encode_headers({
+                    **SSE_HEADERS,
+                    'Content-Type': 'text/event-stream',
+                    'X-Cache': cache_status,
+                    'X-Single-Flight': flight_role,
+                }),
+            })
+
+            async def pump():
+                async for event in events:
+                    await send({'type': 'http.response.body', 'body': event, 'more_body': True})
+
+            async def wait_disconnect():
+                while (await receive())['type'] != 'http.disconnect':
+                    pass
+
+            # Whichever finishes first wins: a client that goes away cancels the
+            # upstream stream instead of letting it run to completion
+            pump_task = asyncio.ensure_future(pump())
+            disconnect_task = asyncio.ensure_future(wait_disconnect())
+            done, pending = await asyncio.wait(
+                {pump_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in pending:
+                task.cancel()
+
+            if pump_task in done:
+                pump_task.result()
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            if ticket is not None:
+                ticket.release()
+
+    async def _wsgi(self, scope, receive, send):
+        # The Flask app runs in an executor thread, reading the request body
+        # and sending its response chunks through the event loop as they
+        # come: uploads, blob downloads and large assets are never buffered
+        loop = asyncio.get_running_loop()
+        environ = self._environ(scope, _WsgiInput(receive, loop))
+
+        def call(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def run():
+            response = {}
+
+            def start_response(status, headers, exc_info=None):
+                if exc_info is not None and response.get('started'):
+                    raise exc_info[1].with_traceback(exc_info[2])
+                response['status'] = int(status.split(' ', 1)[0])
+                response['headers'] = headers
+                return write
+
+            def write(data):
+                if not response.get('started'):
+                    response['started'] = True
+                    call({
+                        'type': 'http.response.start',
+                        'status': response['status'],
+                        'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in response['headers']],
+                    })
+                if data:
+                    call({'type': 'http.response.body', 'body': data, 'more_body': True})
+
+            result = self.wsgi_app(environ, start_response)
+            try:
+                for chunk in result:
+                    write(chunk)
+                write(b'')
+                call({'type': 'http.response.body', 'body': b''})
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+
+        await loop.run_in_executor(None, run)
+
+    def _environ(self, scope, body) -> dict:
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            # Read to its end rather than to CONTENT_LENGTH: chunked uploads
+            # come without one
+            'wsgi.input_terminated': True,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            key = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[key] = value
+            else:
+                key = f'HTTP_{key}'
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+
+def create_asgi_app(wsgi_app, config: dict = None) -> AsgiApp:
+    return AsgiApp(wsgi_app, config=config)
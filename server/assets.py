@@ -0,0 +1,285 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import time
+
+from flask import Response
+
+from server.config import CLIENT_DIR, load_config, reload_enabled
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+MIMETYPES = {
+    '.css': 'text/css; charset=utf-8',
+    '.js': 'application/javascript; charset=utf-8',
+    '.html': 'text/html; charset=utf-8',
+    '.json': 'application/json',
+    '.svg': 'image/svg+xml',
+    '.webp': 'image/webp',
+    '.avif': 'image/avif',
+    '.ico': 'image/x-icon',
+    '.webmanifest': 'application/manifest+json',
+    '.map': 'application/json',
+}
+
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json',
+                'application/manifest+json', 'image/svg+xml')
+
+# Below this size the encoding overhead outweighs the savings
+MIN_COMPRESS_SIZE = 512
+
+# Compression runs once per file and process, so the levels trade first
+# request time against bytes on the wire
+BROTLI_QUALITY = 6
+GZIP_LEVEL = 6
+
+
+# Folders whose files get content-hashed URLs; vendored libraries and images
+# come first because css/js may reference them and must be hashed after
+# being rewritten
+FINGERPRINTED = ('vendor', 'img', 'css', 'js')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+ASSET_REF = re.compile(r'/assets/((?:vendor|css|js|img)/[^\s"\'`()<>?#]+)')
+
+
+def guess_mimetype(filename: str) -> str:
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in MIMETYPES:
+        return MIMETYPES[ext]
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+def accepted_values(header: str) -> set:
+    # Values of an Accept-style header (Accept, Accept-Encoding) with q > 0
+    values = set()
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            values.add(name)
+    return values
+
+
+class Asset:
+    __slots__ = ('path', 'data', 'mimetype', 'etag', '_variants')
+
+    def __init__(self, path: str, data: bytes) -> None:
+        self.path = path
+        self.data = data
+        self.mimetype = guess_mimetype(path)
+        self.etag = hashlib.sha256(data).hexdigest()[:32]
+        self._variants = None
+
+    @property
+    def variants(self) -> dict:
+        # encoding -> (body, etag); each representation gets its own strong
+        # validator since the bytes differ. Compressed on the first request
+        # for the file rather than at startup: a cold start only pays for
+        # the assets its first page uses
+        if self._variants is None:
+            variants = {}
+            data = self.data
+            if self.mimetype.startswith(COMPRESSIBLE) and len(data) >= MIN_COMPRESS_SIZE:
+                if brotli is not None:
+                    compressed = brotli.compress(data, quality=BROTLI_QUALITY)
+                    if len(compressed) < len(data):
+                        variants['br'] = (compressed, f'{self.etag}-br')
+                compressed = gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+                if len(compressed) < len(data):
+                    variants['gzip'] = (compressed, f'{self.etag}-gz')
+            self._variants = variants
+        return self._variants
+
+    def etags(self) -> set:
+        return {self.etag, *(etag for _, etag in self.variants.values())}
+
+    def select(self, accept_encoding: str):
+        accepted = accepted_values(accept_encoding)
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and encoding in accepted:
+                body, etag = self.variants[encoding]
+                return body, etag, encoding
+        return self.data, self.etag, None
+
+
+class AssetStore:
+    def __init__(self, root: str = CLIENT_DIR, cache_control: str = 'no-cache', reload: bool = False) -> None:
+        self.root = root
+        self.cache_control = cache_control
+        self.reload = reload
+        self._lock = threading.Lock()
+        self._checked = time.monotonic()
+        self.mtimes = {}
+        self.manifest = {}
+        self.hashed = {}
+        self.assets = self._load()
+
+    def _read_all(self) -> dict:
+        files = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            for filename in filenames:
+                if filename.startswith('.'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                key = os.path.relpath(path, self.root).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    files[key] = f.read()
+        return files
+
+    def _scan(self) -> dict:
+        mtimes = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            for filename in filenames:
+                if not filename.startswith('.'):
+                    path = os.path.join(dirpath, filename)
+                    mtimes[path] = os.path.getmtime(path)
+        return mtimes
+
+    def refresh(self, interval: float = 1.0) -> bool:
+        # Dev mode only: rebuild the whole table when any file changed,
+        # checking the tree at most once per `interval` seconds
+        now = time.monotonic()
+        if now - self._checked < interval:
+            return False
+        self._checked = now
+
+        mtimes = self._scan()
+        if mtimes == self.mtimes:
+            return False
+        with self._lock:
+            store = AssetStore(self.root, self.cache_control)
+            self.mtimes, self.manifest, self.hashed, self.assets = (
+                mtimes, store.manifest, store.hashed, store.assets
+            )
+        return True
+
+    def _load(self) -> dict:
+        self.mtimes = self._scan()
+        files = self._read_all()
+        assets = {}
+
+        def rank(key):
+            folder = key.split('/', 1)[0]
+            return FINGERPRINTED.index(folder) if folder in FINGERPRINTED else len(FINGERPRINTED)
+
+        for key in sorted(files, key=rank):
+            data = files[key]
+            if not key.startswith('img/') and guess_mimetype(key).startswith(COMPRESSIBLE):
+                data = self.rewrite(data.decode('utf-8', 'surrogateescape')).encode('utf-8', 'surrogateescape')
+            asset = assets[key] = Asset(key, data)
+
+            if key.split('/', 1)[0] in FINGERPRINTED:
+                stem, ext = os.path.splitext(key)
+                hashed_key = f'{stem}.{asset.etag[:12]}{ext}'
+                self.manifest[key] = hashed_key
+                self.hashed[hashed_key] = asset
+        return assets
+
+    def compress_all(self) -> None:
+        # Long-running servers compress everything up front (see launcher)
+        for asset in self.assets.values():
+            asset.variants
+
+    def url(self, key: str) -> str:
+        return f"/assets/{self.manifest.get(key, key)}"
+
+    def rewrite(self, text: str) -> str:
+        # Point every known /assets/... reference at its fingerprinted URL
+        return ASSET_REF.sub(lambda m: self.url(m.group(1)), text)
+
+    def get(self, folder: str, filename: str):
+        return self.assets.get(f'{folder}/{filename}')
+
+    def response(self, asset: Asset, headers, cache_control: str = None) -> Response:
+        body, etag, encoding = asset.select(headers.get('Accept-Encoding'))
+        response_headers = {
+            'ETag': f'"{etag}"',
+            'Cache-Control': cache_control or self.cache_control,
+        }
+        if asset.variants:
+            response_headers['Vary'] = 'Accept-Encoding'
+
+        if_none_match = headers.get('If-None-Match')
+        if if_none_match and self._matches(if_none_match, asset):
+            return Response(status=304, headers=response_headers)
+
+        if encoding:
+            response_headers['Content-Encoding'] = encoding
+        return Response(body, status=200, headers=response_headers, content_type=asset.mimetype)
+
+    def _matches(self, if_none_match: str, asset: Asset) -> bool:
+        if if_none_match.strip() == '*':
+            return True
+        candidates = {tag.strip().removeprefix('W/').strip('"') for tag in if_none_match.split(',')}
+        return not candidates.isdisjoint(asset.etags())
+
+    def lookup(self, folder: str, filename: str) -> tuple:
+        # (asset, Cache-Control) for a plain or fingerprinted URL
+        if self.reload:
+            self.refresh()
+
+        asset = self.get(folder, filename)
+        if asset is not None:
+            return asset, self.cache_control
+
+        # Fingerprinted URLs never change content, so browsers may keep them
+        # for a year without revalidating
+        asset = self.hashed.get(f'{folder}/{filename}')
+        if asset is not None:
+            return asset, IMMUTABLE
+        return None, None
+
+    def serve(self, folder: str, filename: str, headers):
+        asset, cache_control = self.lookup(folder, filename)
+        if asset is None:
+            return None
+        return self.response(asset, headers, cache_control=cache_control)
+
+    def stats(self) -> dict:
+        return {
+            'files': len(self.assets),
+            'fingerprinted': len(self.manifest),
+            'bytes': sum(len(a.data) for a in self.assets.values()),
+            'compressed_bytes': sum(
+                len(body) for a in self.assets.values() for body, _ in a.variants.values()
+            ),
+            'brotli': brotli is not None,
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_asset_store() -> AssetStore:
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                section = load_config().get('assets', {})
+                _store = AssetStore(
+                    cache_control=section.get('cache_control', 'no-cache'),
+                    reload=reload_enabled(),
+                )
+    return _store
@@ -1,52 +1,255 @@
-from flask import request, Response, stream_with_context
-import requests  
-from json import loads
+import sys
+import time
+
+from flask import request, Response, stream_with_context, jsonify
+
+from server.admission import AdmissionError, get_admission_controller
+from server.conversation import (
+    SSE_HEADERS, CORS_HEADERS, DONE_EVENT,
+    extract_question, build_payload, error_event
+)
+from server.config import load_config
+from server.metrics import error_type, get_metrics
+from server.relay import ClientWatch, StreamCancelled, UpstreamAbort, iter_frames
+
+
+ERROR_MESSAGES = {
+    'timeout': "Request timeout",
+    'connection': "Connection error to external API",
+    'circuit_open': "Service temporarily unavailable",
+}
+
+
+def _collector(module: str, name: str, read):
+    # Reads a module singleton only once a question has built it: a scrape
+    # must not import `requests`, warm the upstream pool or open the stores
+    def collect() -> dict:
+        instance = getattr(sys.modules.get(module), name, None)
+        return read(instance) if instance is not None else {}
+    return collect
 
 
 class BackendApi:
+    # The upstream client, caches and resolvers are imported and built on
+    # the first question rather than at startup: pages and assets, the first
+    # requests of a cold start, never need them (nor `requests`)
     def __init__(self, app) -> None:
         self.app = app
+        self.admission = get_admission_controller()
+        self.metrics = get_metrics()
+        self.metrics.instrument_app(app)
+        self.metrics.add_collector(
+            'nog_upstream_pool', _collector('server.upstream', '_client', lambda c: c.stats.snapshot()),
+            'Upstream connection pool', counters=('requests', 'hits', 'new_connections', 'waits', 'wait_seconds'))
+        self.metrics.add_collector(
+            'nog_upstream_backends', _collector('server.balancer', '_registry', lambda r: r.metrics()),
+            'Upstream backends', counters=('ejections',))
+        self.metrics.add_collector(
+            'nog_upstream_resilience', _collector('server.resilience', '_resilience', lambda r: r.metrics()),
+            'Upstream retries, hedges and circuit breaker (state 0 closed, 1 half-open, 2 open)',
+            counters=('retries', 'hedges', 'hedge_wins', 'breaker_opens', 'breaker_rejected'))
+        self.metrics.add_collector(
+            'nog_admission', self.admission.stats,
+            'Conversation admission control',
+            counters=('admitted', 'queued', 'queue_seconds', 'rate_limited', 'overloaded', 'timeouts'))
+        self.metrics.add_collector(
+            'nog_answer_cache', _collector('server.cache', '_cache', lambda c: c.stats()),
+            'Answer cache', counters=('hits', 'misses', 'bypasses'))
+        self.metrics.add_collector(
+            'nog_context', _collector('server.context', '_builder', lambda b: b.stats()),
+            'Conversation context builder', counters=('hits', 'misses'))
+        self.metrics.add_collector(
+            'nog_links', _collector('server.links', '_resolver', lambda r: r.stats()),
+            'YouTube link title resolver', counters=('hits', 'lookups', 'timeouts'))
+        self.metrics.add_collector(
+            'nog_single_flight', _collector('server.singleflight', '_flights', lambda f: f.stats()),
+            'Single-flight stream sharing', counters=('leaders', 'followers', 'aborted'))
+        # How often a stream waiting on the upstream checks that its client is still there
+        self.watch_interval = load_config().get('relay', {}).get('watch_ms', 250) / 1000
         self.routes = {
             '/backend-api/v2/conversation': {
                 'function': self._conversation,
-                'methods': ['POST']
-            }
+                'methods': ['POST', 'OPTIONS']
+            },
+            '/backend-api/v2/upstream': {
+                'function': self._upstream_stats,
+                'methods': ['GET']
+            },
+            '/backend-api/v2/cache': {
+                'function': self._cache_stats,
+                'methods': ['GET']
+            },
+            '/metrics': {
+                'function': self.metrics.response,
+                'methods': ['GET']
+            },
+            '/backend-api/<path:endpoint>': {
+                'function': self._fallback,
+                'methods': ['GET']
+            },
         }
 
+    @property
+    def upstream(self):
+        # Rebuilt per process by get_client() after a fork
+        from server.upstream import get_client
+        return get_client()
+
+    @property
+    def resilience(self):
+        from server.resilience import get_resilience
+        return get_resilience()
+
+    @property
+    def answer_cache(self):
+        from server.cache import get_answer_cache
+        return get_answer_cache()
+
+    @property
+    def flights(self):
+        from server.singleflight import get_single_flight
+        return get_single_flight()
+
+    @property
+    def context_builder(self):
+        from server.context import get_context_builder
+        return get_context_builder()
+
+    @property
+    def link_resolver(self):
+        from server.links import get_link_resolver
+        return get_link_resolver()
+
+    def _upstream_stats(self):
+        return jsonify({**self.upstream.pool_stats(), 'resilience': self.resilience.stats()})
+
+    def _cache_stats(self):
+        return jsonify({**self.answer_cache.stats(), 'single_flight': self.flights.stats(), 'context': self.context_builder.stats()})
+
+    def _fallback(self, endpoint):
+        return jsonify({
+            "message": f"API endpoint: {endpoint}",
+            "status": "working",
+            "method": request.method,
+            "note": "This is a fallback endpoint. Main chat API is at /backend-api/v2/conversation"
+        })
+
+    def _refuse(self, message: str, status: int, headers: dict) -> Response:
+        # Refusals are one-error SSE streams the chat reads like any answer
+        return Response(
+            error_event(message) + DONE_EVENT,
+            status=status,
+            mimetype="text/event-stream",
+            headers={**SSE_HEADERS, **headers}
+        )
+
     def _conversation(self):
+        if request.method == 'OPTIONS':
+            return '', 200, CORS_HEADERS
+
+        started = time.perf_counter()
         try:
-            
-            prompt = request.json['meta']['content']['parts'][0]
-            question_text = prompt['content'] if isinstance(prompt, dict) else prompt
-            
-            payload = {
-                "question": question_text.replace("?", "").replace("\n", "")
-            }
-
-            
-            api_url = "https://legal-chatbot.eastus.cloudapp.azure.com:443/v1/assist/stream/"
-            api_headers = {"Content-Type": "application/json", 'cache-control': 'no-cache', 'Connection': 'keep-alive'}
+            data = request.get_json(silent=True)
+            if not data:
+                return jsonify({"error": "No JSON data provided"}), 400
+
+            question_text = extract_question(data)
+            if not question_text:
+                return jsonify({"error": "No question provided"}), 400
+
+            upstream, resilience, link_resolver = self.upstream, self.resilience, self.link_resolver
+            answer_cache = self.answer_cache
+            payload = build_payload(question_text)
+
+            # Recent history within the token budget goes along with the question
+            context = self.context_builder.apply(payload, data, request.headers)
+
+            # Set off when every reader of the answer has left
+            abort = UpstreamAbort()
 
             def generate():
-                with requests.post(api_url, headers=api_headers, json=payload, stream=True) as r:
-                    
-                    if r.status_code >= 400:
-                        yield f"data: Error: Received status code {r.status_code} from API\n\n"
-                        return
-                    for line in r.iter_lines():
-                        if line:
-                            yield f"{line.decode('utf-8')}\n\n"
-                            # print(f"Received: {line.decode('utf-8')}")
+                try:
+                    with self.metrics.upstream_call() as call, \
+                            resilience.stream(lambda: upstream.stream(payload), iter_frames, abort) as r:
+                        if r.status_code >= 400:
+                            call.http_error(r.status_code)
+                            yield error_event(f"API returned status code {r.status_code}")
+                            yield DONE_EVENT
+                            return
+
+                        # Raw upstream bytes, split at SSE frame ends without
+                        # decoding, plus the titles of the cited videos
+                        yield from link_resolver.enrich(call.lines(abort.frames(r.frames())))
+
+                except StreamCancelled:
+                    # Nobody left to send an error to
+                    return
+                except Exception as e:
+                    yield error_event(ERROR_MESSAGES.get(error_type(e), f"Unexpected error: {str(e)}"))
+                    yield DONE_EVENT
+
+            # Replay a known answer, otherwise record the upstream stream
+            events, cache_status = answer_cache.stream(payload['question'], request.headers, generate, context)
+
+            ticket = None
+            flight_role = 'off'
+            if cache_status != 'HIT':
+                # Open circuit: answer now instead of queueing a doomed upstream call
+                if not resilience.available():
+                    return self._refuse("Service temporarily unavailable", 503, {
+                        'Retry-After': str(int(resilience.breaker.retry_after()) + 1),
+                        'X-Cache': cache_status,
+                    })
+
+                # Only questions that reach the upstream use up the client's
+                # rate; a slot among the concurrent streams comes after a
+                # bounded wait
+                try:
+                    self.admission.check_rate(self.admission.client_key(request.headers, request.remote_addr))
+                    ticket = self.admission.admit()
+                except AdmissionError as e:
+                    return self._refuse(str(e), e.status, {**e.headers(), 'X-Cache': cache_status})
+
+                try:
+                    # Concurrent requests for the same question share one upstream
+                    # stream, cut as soon as the last of their clients goes away
+                    watch = None
+                    if self.watch_interval > 0:
+                        watch = ClientWatch.from_environ(
+                            request.environ, self.watch_interval, lambda: self.metrics.stream_cancel('disconnect')
+                        )
+                    events, flight_role = self.flights.stream(
+                        answer_cache.key(payload['question'], context), events, abort, watch
+                    )
+                except BaseException:
+                    if ticket is not None:
+                        ticket.release()
+                    raise
+                if flight_role == 'follower' and ticket is not None:
+                    # Reads the leader's stream: the slot goes back at once
+                    ticket.release()
+                    ticket = None
+
+            try:
+                events = self.metrics.track_stream(events, started, cache_status)
+
+                # Queue time preamble first; the slot is released when the stream ends
+                events = self.admission.guard(events, ticket)
+            except BaseException:
+                if ticket is not None:
+                    ticket.release()
+                raise
 
             return Response(
-                stream_with_context(generate()),
+                stream_with_context(events),
                 mimetype="text/event-stream",
                 headers={
-                    'Cache-Control': 'no-cache',
-                    'X-Accel-Buffering': 'no'  
+                    **SSE_HEADERS,
+                    'X-Cache': cache_status,
+                    'X-Single-Flight': flight_role,
                 }
             )
 
         except Exception as e:
-            print(f"Error: {e}")
-            return Response(f"An error occurred: {str(e)}", status=500)
+            print(f"Error in conversation endpoint: {e}")
+            return jsonify({"error": f"Server error: {str(e)}"}), 500
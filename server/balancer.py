@@ -0,0 +1,283 @@
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+from server.config import load_config
+
+
+DEFAULT_URL = "https://legal-chatbot.eastus.cloudapp.azure.com:443/v1/assist/stream/"
+
+HEALTHY, EJECTED, PROBING = 'healthy', 'ejected', 'probing'
+
+
+def proxy_settings(config: dict):
+    # The `proxy` section as a scheme -> proxy URL map, None when disabled.
+    # Entries may omit the scheme ("127.0.0.1:7890")
+    section = config.get('proxy', {})
+    if not section.get('enable'):
+        return None
+    proxies = {}
+    for scheme in ('http', 'https'):
+        proxy = section.get(scheme)
+        if proxy:
+            proxies[scheme] = proxy if '://' in proxy else f'http://{proxy}'
+    return proxies or None
+
+
+class Backend:
+    def __init__(self, url: str, weight: float = 1, name: str = None) -> None:
+        self.url = url
+        self.weight = weight
+        self.name = name or urlsplit(url).hostname or url
+        self.state = HEALTHY
+        # Streams currently open on this backend
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive = 0
+        # Moving average of the time to response headers, and its sample count
+        self.latency = 0.0
+        self.samples = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.eject_seconds = 0.0
+
+    def available(self, now: float) -> bool:
+        if self.weight <= 0:
+            return False
+        if self.state == EJECTED:
+            return now >= self.ejected_until
+        if self.state == PROBING:
+            # One trial stream at a time until it proves healthy again
+            return self.outstanding == 0
+        return True
+
+    def snapshot(self, now: float) -> dict:
+        return {
+            'name': self.name,
+            'url': self.url,
+            'weight': self.weight,
+            'state': self.state,
+            'outstanding': self.outstanding,
+            'requests': self.requests,
+            'failures': self.failures,
+            'consecutive_failures': self.consecutive,
+            'latency': round(self.latency, 6),
+            'ejections': self.ejections,
+            'ejected_for': round(max(self.ejected_until - now, 0), 3) if self.state == EJECTED else 0,
+        }
+
+
+class Lease:
+    # One stream on one backend, from the request until its response is
+    # closed. release() may be called more than once, the first one counts
+    __slots__ = ('registry', 'backend', 'started', 'closed', 'failed')
+
+    def __init__(self, registry, backend: Backend) -> None:
+        self.registry = registry
+        self.backend = backend
+        self.started = time.perf_counter()
+        self.closed = False
+        self.failed = None
+
+    @property
+    def url(self) -> str:
+        return self.backend.url
+
+    def headers(self, status: int) -> None:
+        # Response headers are in: 5xx count against the backend, anything
+        # else proves it alive, and the wait feeds its latency
+        self.failed = status >= 500
+        self.registry.observe(self, time.perf_counter() - self.started)
+
+    def fail(self) -> None:
+        # No response at all (connect error, timeout before the headers)
+        self.failed = True
+        self.registry.observe(self, None)
+        self.release()
+
+    def release(self) -> None:
+        self.registry.release(self)
+
+    def wrap(self, response):
+        # The stream ends when its response is closed, by whichever path
+        # (relay finished, retry, losing hedge, client gone)
+        close = response.close
+
+        def _close():
+            try:
+                close()
+            finally:
+                self.release()
+
+        response.close = _close
+        return response
+
+    def wrap_async(self, response):
+        aclose = response.aclose
+
+        async def _aclose():
+            try:
+                await aclose()
+            finally:
+                self.release()
+
+        response.aclose = _aclose
+        return response
+
+
+class UpstreamRegistry:
+    # The backends of the legal-assist API. Each stream goes to the
+    # available backend with the fewest open streams for its weight;
+    # passive health checks eject a backend after `eject_failures`
+    # consecutive failures, or when its latency is `slow_factor` times the
+    # median of the others. An ejected backend gets a trial stream after
+    # `eject_seconds` (doubled on each new ejection, up to
+    # `max_eject_seconds`) and is re-admitted when it succeeds
+    def __init__(self,
+                 backends: list,
+                 eject_failures: int = 3,
+                 eject_seconds: float = 10.0,
+                 max_eject_seconds: float = 300.0,
+                 slow_factor: float = 3.0,
+                 min_samples: int = 20,
+                 latency_alpha: float = 0.2
+                 ) -> None:
+        if not backends:
+            raise ValueError('At least one upstream backend is needed')
+        self.backends = backends
+        self.eject_failures = eject_failures
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self.slow_factor = slow_factor
+        self.min_samples = min_samples
+        self.latency_alpha = latency_alpha
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'UpstreamRegistry':
+        section = config.get('upstream', {})
+        # `backends` list, or the former single `url`
+        entries = section.get('backends') or [{'url': section.get('url', DEFAULT_URL)}]
+        return cls(
+            backends=[Backend(e['url'], e.get('weight', 1), e.get('name')) for e in entries],
+            eject_failures=section.get('eject_failures', 3),
+            eject_seconds=section.get('eject_seconds', 10.0),
+            max_eject_seconds=section.get('max_eject_seconds', 300.0),
+            slow_factor=section.get('slow_factor', 3.0),
+            min_samples=section.get('min_samples', 20),
+        )
+
+    @property
+    def urls(self) -> list:
+        return [b.url for b in self.backends if b.weight > 0]
+
+    def acquire(self) -> Lease:
+        now = time.monotonic()
+        with self._lock:
+            candidates = [b for b in self.backends if b.available(now)]
+            if not candidates:
+                # Everything ejected (or probing): fail open to the backend
+                # due back first rather than refusing the question
+                candidates = [min(
+                    [b for b in self.backends if b.weight > 0] or self.backends,
+                    key=lambda b: b.ejected_until
+                )]
+            # Fewest open streams per unit of weight; ties (an idle pool)
+            # are drawn at random in proportion to the weights
+            backend = min(candidates, key=lambda b: (
+                b.outstanding / (b.weight or 1e-9), -random.random() ** (1 / (b.weight or 1e-9))
+            ))
+            if backend.state == EJECTED:
+                backend.state = PROBING
+            backend.outstanding += 1
+            backend.requests += 1
+        return Lease(self, backend)
+
+    def release(self, lease: Lease) -> None:
+        with self._lock:
+            if lease.closed:
+                return
+            lease.closed = True
+            lease.backend.outstanding -= 1
+
+    def observe(self, lease: Lease, latency) -> None:
+        backend = lease.backend
+        with self._lock:
+            if lease.failed:
+                backend.failures += 1
+                backend.consecutive += 1
+                if backend.state == PROBING or backend.consecutive >= self.eject_failures:
+                    self._eject(backend)
+                return
+
+            backend.consecutive = 0
+            if backend.state == PROBING:
+                backend.state = HEALTHY
+                backend.eject_seconds = 0.0
+            if latency is not None:
+                if backend.samples:
+                    backend.latency += self.latency_alpha * (latency - backend.latency)
+                else:
+                    backend.latency = latency
+                backend.samples += 1
+                if self._slow(backend):
+                    self._eject(backend)
+
+    def _slow(self, backend: Backend) -> bool:
+        if self.slow_factor <= 0 or backend.samples < self.min_samples:
+            return False
+        others = sorted(
+            b.latency for b in self.backends
+            if b is not backend and b.state == HEALTHY and b.samples >= self.min_samples
+        )
+        if not others:
+            return False
+        return backend.latency > self.slow_factor * others[len(others) // 2]
+
+    def _eject(self, backend: Backend) -> None:
+        # Never the last healthy backend: a slow or failing answer beats none
+        if backend.state == HEALTHY and not any(
+                b is not backend and b.state == HEALTHY and b.weight > 0 for b in self.backends):
+            return
+        backend.eject_seconds = min(
+            backend.eject_seconds * 2 if backend.eject_seconds else self.eject_seconds,
+            self.max_eject_seconds
+        )
+        backend.state = EJECTED
+        backend.ejected_until = time.monotonic() + backend.eject_seconds
+        backend.ejections += 1
+        backend.consecutive = 0
+        # Starts over once re-admitted, the slow history is not held against it
+        backend.samples = 0
+
+    def snapshot(self) -> list:
+        now = time.monotonic()
+        with self._lock:
+            return [b.snapshot(now) for b in self.backends]
+
+    def metrics(self) -> dict:
+        # Flat numbers for the /metrics collector
+        with self._lock:
+            return {
+                'backends': len(self.backends),
+                'healthy': sum(b.state == HEALTHY for b in self.backends),
+                'ejected': sum(b.state == EJECTED for b in self.backends),
+                'ejections': sum(b.ejections for b in self.backends),
+                'outstanding': sum(b.outstanding for b in self.backends),
+            }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> UpstreamRegistry:
+    global _registry
+
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = UpstreamRegistry.from_config(load_config())
+    return _registry
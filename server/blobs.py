@@ -0,0 +1,392 @@
+import hashlib
+import os
+import re
+import threading
+import time
+import uuid
+from json import dumps, loads
+
+from flask import request, jsonify, send_file
+
+from server.config import ROOT_DIR, load_config
+
+
+BLOB_ID = re.compile(r'^[0-9a-f]{64}$')
+UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+OFFSET_HEADER = 'Upload-Offset'
+
+# Types a blob may be served as; anything else downloads as bytes so an
+# uploaded page cannot run in the app's origin
+SAFE_TYPES = {
+    'application/pdf', 'image/png', 'image/jpeg', 'image/gif', 'image/webp',
+    'text/plain', 'application/octet-stream',
+}
+
+
+class BlobError(Exception):
+    def __init__(self, message: str, status: int = 400, offset: int = None) -> None:
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+class _Upload:
+    __slots__ = ('id', 'size', 'name', 'type', 'created', 'hash', 'offset', 'lock')
+
+    def __init__(self, upload_id: str, size: int, name: str, content_type: str, created: float) -> None:
+        self.id = upload_id
+        self.size = size
+        self.name = name
+        self.type = content_type
+        self.created = created
+        # Running sha256 of the bytes received so far, None until rebuilt
+        self.hash = None
+        self.offset = 0
+        self.lock = threading.Lock()
+
+    def meta(self) -> dict:
+        return {'size': self.size, 'name': self.name, 'type': self.type, 'created': self.created}
+
+
+class BlobStore:
+    # Content-addressed files on disk: objects/ab/abcdef... named after the
+    # sha256 of their bytes, so the same file uploaded twice is stored once.
+    # Uploads are written in chunks to uploads/<id>.part and hashed as they
+    # arrive; a dropped upload resumes from the size of its part file
+    def __init__(self,
+                 path: str,
+                 max_size: int = 1024 * 1024 * 1024,
+                 chunk_size: int = 8 * 1024 * 1024,
+                 read_size: int = 64 * 1024,
+                 upload_ttl: float = 86400
+                 ) -> None:
+        self.path = path
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.read_size = read_size
+        self.upload_ttl = upload_ttl
+        self.objects = os.path.join(path, 'objects')
+        self.uploads = os.path.join(path, 'uploads')
+        self._lock = threading.Lock()
+        self._active = {}
+        self._purged = 0.0
+        self._stats = {
+            'uploads_started': 0,
+            'uploads_completed': 0,
+            'uploads_expired': 0,
+            'deduplicated': 0,
+            'bytes_received': 0,
+            'bytes_stored': 0,
+        }
+        os.makedirs(self.objects, exist_ok=True)
+        os.makedirs(self.uploads, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'BlobStore':
+        section = config.get('blobs', {})
+        return cls(
+            path=os.path.join(ROOT_DIR, section.get('path', 'data/blobs')),
+            max_size=section.get('max_size', 1024 * 1024 * 1024),
+            chunk_size=section.get('chunk_size', 8 * 1024 * 1024),
+            read_size=section.get('read_size', 64 * 1024),
+            upload_ttl=section.get('upload_ttl', 86400),
+        )
+
+    def object_path(self, blob_id: str) -> str:
+        return os.path.join(self.objects, blob_id[:2], blob_id)
+
+    def _part_path(self, upload_id: str) -> str:
+        return os.path.join(self.uploads, f'{upload_id}.part')
+
+    def _meta_path(self, upload_id: str) -> str:
+        return os.path.join(self.uploads, f'{upload_id}.json')
+
+    def blob(self, blob_id: str):
+        if not BLOB_ID.match(blob_id):
+            return None
+        path = self.object_path(blob_id)
+        return path if os.path.isfile(path) else None
+
+    def create(self, size: int, name: str = '', content_type: str = '') -> _Upload:
+        if size < 0:
+            raise BlobError('Invalid upload size')
+        if size > self.max_size:
+            raise BlobError(f'File too large (max {self.max_size} bytes)', 413)
+        self._purge()
+
+        upload = _Upload(uuid.uuid4().hex, size, name[:255], content_type[:100], time.time())
+        with open(self._meta_path(upload.id), 'w') as f:
+            f.write(dumps(upload.meta()))
+        open(self._part_path(upload.id), 'wb').close()
+        upload.hash = hashlib.sha256()
+        with self._lock:
+            self._active[upload.id] = upload
+            self._stats['uploads_started'] += 1
+        return upload
+
+    def get(self, upload_id: str) -> _Upload:
+        if not UPLOAD_ID.match(upload_id):
+            raise BlobError('Upload not found', 404)
+        with self._lock:
+            upload = self._active.get(upload_id)
+        if upload is not None:
+            return upload
+
+        # Started before a restart or by another worker: the files on disk
+        # are the state, the running hash is rebuilt on the next write
+        try:
+            with open(self._meta_path(upload_id), 'r') as f:
+                meta = loads(f.read())
+            offset = os.path.getsize(self._part_path(upload_id))
+        except (OSError, ValueError):
+            raise BlobError('Upload not found', 404)
+        upload = _Upload(upload_id, meta['size'], meta.get('name', ''), meta.get('type', ''), meta['created'])
+        upload.offset = offset
+        with self._lock:
+            return self._active.setdefault(upload_id, upload)
+
+    def _rehash(self, upload: _Upload) -> None:
+        digest = hashlib.sha256()
+        offset = 0
+        with open(self._part_path(upload.id), 'rb') as f:
+            for block in iter(lambda: f.read(self.read_size), b''):
+                digest.update(block)
+                offset += len(block)
+        upload.hash, upload.offset = digest, offset
+
+    def write(self, upload_id: str, offset: int, stream) -> dict:
+        # Appends the request body at `offset`, which must be where the
+        # previous chunk ended. Memory stays at one read_size block whatever
+        # the chunk or file size
+        upload = self.get(upload_id)
+        if not upload.lock.acquire(blocking=False):
+            raise BlobError('Upload already in progress', 409)
+        try:
+            if upload.hash is None or upload.offset != os.path.getsize(self._part_path(upload.id)):
+                self._rehash(upload)
+            if offset != upload.offset:
+                raise BlobError('Offset mismatch', 409, upload.offset)
+
+            received = 0
+            with open(self._part_path(upload.id), 'ab') as f:
+                while True:
+                    block = stream.read(self.read_size)
+                    if not block:
+                        break
+                    if upload.offset + len(block) > upload.size:
+                        raise BlobError('Chunk goes past the declared size', 413, upload.offset)
+                    f.write(block)
+                    upload.hash.update(block)
+                    upload.offset += len(block)
+                    received += len(block)
+            with self._lock:
+                self._stats['bytes_received'] += received
+
+            if upload.offset < upload.size:
+                return {'id': upload.id, 'offset': upload.offset, 'size': upload.size}
+            return self._finish(upload)
+        except BlobError:
+            raise
+        except Exception:
+            # Client gone mid-chunk: keep what reached the disk, the hash is
+            # rebuilt from it when the upload resumes
+            upload.hash = None
+            raise
+        finally:
+            upload.lock.release()
+
+    def _finish(self, upload: _Upload) -> dict:
+        blob_id = upload.hash.hexdigest()
+        path = self.object_path(blob_id)
+        part = self._part_path(upload.id)
+        deduplicated = os.path.exists(path)
+        if deduplicated:
+            os.unlink(part)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(part, path)
+        self._discard(upload.id)
+        with self._lock:
+            self._stats['uploads_completed'] += 1
+            if deduplicated:
+                self._stats['deduplicated'] += 1
+            else:
+                self._stats['bytes_stored'] += upload.size
+        return {
+            'id': upload.id,
+            'offset': upload.size,
+            'size': upload.size,
+            'blob': blob_id,
+            'deduplicated': deduplicated,
+        }
+
+    def abort(self, upload_id: str) -> None:
+        upload = self.get(upload_id)
+        for path in (self._part_path(upload.id), self._meta_path(upload.id)):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        self._discard(upload.id)
+
+    def _discard(self, upload_id: str) -> None:
+        try:
+            os.unlink(self._meta_path(upload_id))
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self._active.pop(upload_id, None)
+
+    def _purge(self) -> None:
+        # Abandoned uploads older than upload_ttl, looked for at most once a minute
+        now = time.time()
+        with self._lock:
+            if now - self._purged < 60:
+                return
+            self._purged = now
+        expired = 0
+        for entry in os.scandir(self.uploads):
+            if entry.name.endswith('.part') and now - entry.stat().st_mtime > self.upload_ttl:
+                upload_id = entry.name[:-len('.part')]
+                try:
+                    os.unlink(entry.path)
+                except FileNotFoundError:
+                    continue
+                self._discard(upload_id)
+                expired += 1
+        with self._lock:
+            self._stats['uploads_expired'] += expired
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, 'uploads_active': len(self._active)}
+
+
+class BlobApi:
+    # Registered by the app factory. The store is opened on first use: on a
+    # read-only deployment uploads answer 503 and the file card keeps the
+    # file in memory as before
+    def __init__(self) -> None:
+        self.routes = {
+            '/backend-api/v2/uploads': {
+                'function': self._uploads,
+                'methods': ['POST']
+            },
+            '/backend-api/v2/uploads/<upload_id>': {
+                'function': self._upload,
+                'methods': ['GET', 'PATCH', 'DELETE']
+            },
+            '/backend-api/v2/blobs/<blob_id>': {
+                'function': self._blob,
+                'methods': ['GET']
+            },
+        }
+
+    def _handle(self, handler):
+        try:
+            store = get_blob_store()
+            if store is None:
+                raise BlobError('Blob store disabled', 404)
+            return handler(store)
+        except BlobError as e:
+            body = {'error': str(e)}
+            headers = {}
+            if e.offset is not None:
+                body['offset'] = e.offset
+                headers[OFFSET_HEADER] = str(e.offset)
+            return jsonify(body), e.status, headers
+        except OSError as e:
+            print(f"Blob store error: {e}")
+            return jsonify({'error': 'Blob store unavailable'}), 503
+
+    def _progress(self, state: dict, status: int = 200):
+        return jsonify(state), status, {OFFSET_HEADER: str(state['offset'])}
+
+    def _uploads(self):
+        def handler(store):
+            data = request.get_json(silent=True) or {}
+            try:
+                size = int(data.get('size'))
+            except (TypeError, ValueError):
+                raise BlobError('Missing or invalid size')
+            upload = store.create(size, str(data.get('name', '')), str(data.get('type', '')))
+            state = {'id': upload.id, 'offset': 0, 'size': upload.size, 'chunk_size': store.chunk_size}
+            if upload.size == 0:
+                state = store.write(upload.id, 0, request.stream)
+            response = self._progress(state, 201)
+            response[2]['Location'] = f'/backend-api/v2/uploads/{upload.id}'
+            return response
+
+        return self._handle(handler)
+
+    def _upload(self, upload_id):
+        def handler(store):
+            if request.method == 'DELETE':
+                store.abort(upload_id)
+                return '', 204
+
+            if request.method == 'GET':
+                upload = store.get(upload_id)
+                return self._progress({'id': upload.id, 'offset': upload.offset, 'size': upload.size})
+
+            if request.content_length and request.content_length > store.chunk_size:
+                raise BlobError(f'Chunk too large (max {store.chunk_size} bytes)', 413)
+            try:
+                offset = int(request.headers.get(OFFSET_HEADER, ''))
+            except ValueError:
+                raise BlobError(f'Missing or invalid {OFFSET_HEADER} header')
+            return self._progress(store.write(upload_id, offset, request.stream))
+
+        return self._handle(handler)
+
+    def _blob(self, blob_id):
+        def handler(store):
+            path = store.blob(blob_id)
+            if path is None:
+                raise BlobError('Blob not found', 404)
+
+            content_type = request.args.get('type', 'application/octet-stream')
+            if content_type not in SAFE_TYPES:
+                content_type = 'application/octet-stream'
+            name = request.args.get('name') or blob_id
+
+            # Range and If-None-Match are answered by send_file; the file
+            # object goes to the server's file wrapper (sendfile under
+            # gunicorn) instead of being read into memory here
+            response = send_file(
+                path,
+                mimetype=content_type,
+                as_attachment=request.args.get('download') == '1',
+                download_name=name,
+                conditional=True,
+                etag=blob_id,
+                max_age=365 * 86400,
+            )
+            # Content-addressed: the bytes behind an id never change
+            response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+            response.headers['X-Content-Type-Options'] = 'nosniff'
+            return response
+
+        return self._handle(handler)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_blob_store():
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                config = load_config()
+                if not config.get('blobs', {}).get('enable', True):
+                    return None
+                _store = BlobStore.from_config(config)
+    return _store
+
+
+def blob_stats() -> dict:
+    # For /metrics: never creates the store directories just to report on them
+    return _store.stats() if _store is not None else {}
@@ -0,0 +1,616 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+import threading
+
+from server.assets import IMMUTABLE, Asset, get_asset_store
+from server.config import CLIENT_DIR, ROOT_DIR, load_config
+
+
+# Third-party libraries the pages load, pinned with the sha256 of every
+# file. `python -m server.bundles vendor` downloads them under
+# client/vendor/<name>@<version>/ and refuses a file whose digest differs
+# or is not recorded yet; the pages keep the CDN URL, which is served from
+# the local copy once it exists and left as is until then
+VENDOR = {
+    'font-awesome': ('6.4.0', 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/{version}/', {
+        'css/all.min.css': '1edb1725a9ea8ca4dcf2f5508cee183218aa1685e47c1b23056717f754f58ebf',
+        'webfonts/fa-brands-400.ttf': '20c4a58bc9d1d69e935d06f1528923646a715be5e218665655cade8f5f1b8c00',
+        'webfonts/fa-brands-400.woff2': '748332090c4b8e20f95d0ff59f0be20fa9c889359d3b36d4b886d73376054207',
+        'webfonts/fa-regular-400.ttf': '528d022dce6725f8a0811fd91d8e6513445c81ef33353a5c3234eab932551abf',
+        'webfonts/fa-regular-400.woff2': '8e7e5ea1b15f62ab14dbd41768e8fbcd21cc859a4ea5da812457ee714299fb35',
+        'webfonts/fa-solid-900.ttf': '67a65763c7f80903d81603bbeb9049fc2bf28508479b83ed011fe24c71fa950a',
+        'webfonts/fa-solid-900.woff2': '7152a6933ee3d690ec2af3d09da9d701723d16aa3410a6d80f28ff8866f3b880',
+        'webfonts/fa-v4compatibility.ttf': '0515a423f828ce4e6accf92a2ea0b03d19d31cc86d9af0373291e1fd4db5f348',
+        'webfonts/fa-v4compatibility.woff2': '694a17c3d9d6c05f8aac63c544615552a4b220e9a4de863d87341a6bcfc1bc8d',
+    }),
+    # Not recorded yet: the first `vendor --record` prints them, to be
+    # checked against the package registry and pasted here
+    'markdown-it': ('14.1.0', 'https://cdn.jsdelivr.net/npm/markdown-it@{version}/', {
+        'dist/markdown-it.min.js': None,
+    }),
+    'marked': ('12.0.2', 'https://cdn.jsdelivr.net/npm/marked@{version}/', {
+        'marked.min.js': None,
+    }),
+    'highlight.js': ('11.9.0', 'https://cdn.jsdelivr.net/gh/highlightjs/cdn-release@{version}/', {
+        'build/styles/base16/dracula.min.css': None,
+    }),
+}
+
+# Bumped when the minifier output changes, so bundle URLs do too
+BUILD_VERSION = '1'
+
+REGION = re.compile(r'<!--\s*bundle:\s*([\w-]+)\.(js|css)\s*-->(.*?)<!--\s*endbundle\s*-->', re.S)
+TAG = re.compile(
+    r'<script\b([^>]*)\bsrc="([^"]+)"([^>]*)>\s*</script>'
+    r'|<link\b[^>]*\brel="stylesheet"[^>]*>'
+)
+HREF = re.compile(r'\bhref="([^"]+)"')
+HTML_COMMENT = re.compile(r'<!--.*?-->', re.S)
+
+SOURCE_MAP_COMMENT = re.compile(r'^\s*(?://[#@]\s*sourceMappingURL=.*|/\*[#@]\s*sourceMappingURL=.*?\*/)\s*$', re.M)
+
+JS_TOKEN = re.compile(r'''
+    (?P<space>[^\S\n]+)
+  | (?P<newline>\n)
+  | (?P<comment>//[^\n]*|/\*[\s\S]*?(?:\*/|\Z))
+  | (?P<string>'(?:[^'\\\n]|\\[\s\S])*'|"(?:[^"\\\n]|\\[\s\S])*")
+  | (?P<template>`)
+  | (?P<slash>/)
+  | (?P<brace>[{}])
+  | (?P<word>[\w$\\]+)
+  | (?P<punct>[^\s\w$\\'"`/{}]+)
+  | (?P<other>[\s\S])
+''', re.X)
+JS_REGEX = re.compile(r'/(?:[^/\\\[\n]|\\[^\n]|\[(?:[^\]\\\n]|\\[^\n])*\])+/[\w$]*')
+JS_TEMPLATE = re.compile(r'(?:[^`\\$]|\\[\s\S]|\$(?!\{))*')
+# A `/` after these starts a regular expression, not a division
+JS_REGEX_KEYWORDS = frozenset((
+    'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void',
+    'throw', 'case', 'do', 'else', 'yield', 'await',
+))
+# A file starting with one of these would continue the previous statement
+JS_CONTINUATION = ('(', '[', '`', '+', '-', '/')
+
+CSS_TOKEN = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<comment>/\*[\s\S]*?(?:\*/|\Z))
+  | (?P<string>"(?:[^"\\\n]|\\[\s\S])*"|'(?:[^'\\\n]|\\[\s\S])*')
+  | (?P<url>url\(\s*[^'"\s)][^)]*\))
+  | (?P<punct>[{};,>])
+  | (?P<word>[^\s"'/{};,>]+|/)
+''', re.X | re.I)
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''', re.I)
+# @charset and @import are only valid at the top of a stylesheet, so they
+# are lifted to the top of the bundle
+CSS_PRELUDE = re.compile(r'''\s*(?:/\*[\s\S]*?\*/\s*)*(@(?:import|charset)\b(?:"[^"]*"|'[^']*'|[^;"'])*;)''', re.I)
+
+BASE64 = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+
+
+def vendor_key(url: str):
+    # client/ path of the pinned file behind a CDN URL, None if not vendored
+    url = 'https:' + url if url.startswith('//') else url
+    for name, (version, base, files) in VENDOR.items():
+        base = base.format(version=version)
+        if url.startswith(base) and url[len(base):] in files:
+            return f'vendor/{name}@{version}/{url[len(base):]}'
+    return None
+
+
+def _word_char(c: str) -> bool:
+    return c.isalnum() or c in '_$\\' or ord(c) > 127
+
+
+class _Output:
+    # Minified text as lines of (text, segments); a segment maps an output
+    # column back to (line, column) in the source, one per source line
+    def __init__(self, join) -> None:
+        self.join = join
+        self.lines = []
+        self.parts = []
+        self.segments = []
+        self.width = 0
+        self.space = False
+        self.last = ''
+        self.source_line = -1
+
+    def emit(self, text: str, line: int, column: int) -> None:
+        if self.space and self.parts and self.join(self.last, text[0]):
+            self.parts.append(' ')
+            self.width += 1
+        self.space = False
+        if line != self.source_line:
+            self.segments.append((self.width, line, column))
+            self.source_line = line
+        self.parts.append(text)
+        self.width += len(text)
+        self.last = text[-1]
+
+    def raw(self, text: str, line: int, column: int) -> None:
+        # Verbatim text that may span lines (template literal, string with
+        # a line continuation): its line breaks are kept as they are
+        for i, chunk in enumerate(text.split('\n')):
+            if i:
+                self.newline(force=True)
+                line, column = line + 1, 0
+            if chunk:
+                self.space = False
+                self.emit(chunk, line, column)
+
+    def newline(self, force: bool = False) -> None:
+        if self.parts or force:
+            self.lines.append((''.join(self.parts), self.segments))
+        self.parts, self.segments, self.width = [], [], 0
+        self.space = False
+        self.last = ''
+        self.source_line = -1
+
+    def finish(self) -> list:
+        self.newline()
+        return self.lines
+
+
+def _js_join(a: str, b: str) -> bool:
+    # Whether two tokens separated by whitespace in the source need a space
+    return (
+        (_word_char(a) and (_word_char(b) or (a.isdigit() and b == '.')))
+        or (a in '+-' and b in '+-')
+        or (a == '/' and b in '/*')
+        or (a == '<' and b == '!')
+    )
+
+
+def minify_js(text: str) -> list:
+    # Drops comments, indentation and blank lines and collapses whitespace
+    # where no token needs it. Line breaks are kept, so automatic semicolon
+    # insertion sees the same code and the source map can stay per line
+    out = _Output(_js_join)
+    stack = []
+    previous = None
+    line, line_start, position, end = 0, 0, 0, len(text)
+
+    def regex_allowed():
+        if previous is None:
+            return True
+        kind, value = previous
+        if kind == 'word':
+            return value in JS_REGEX_KEYWORDS
+        if kind == 'punct':
+            return value[-1] not in ')]'
+        return kind == 'brace'
+
+    in_template = False
+    while position < end:
+        start = position
+        column = position - line_start
+        if in_template:
+            match = JS_TEMPLATE.match(text, position)
+            out.raw(match.group(), line, column)
+            position = match.end()
+            after = line + text.count('\n', start, position), position - max(
+                text.rfind('\n', start, position) + 1, line_start)
+            if text.startswith('${', position):
+                out.emit('${', *after)
+                stack.append('template')
+                previous = ('brace', '{')
+                position += 2
+                in_template = False
+            elif position < end:
+                out.emit('`', *after)
+                previous = ('string', '`')
+                position += 1
+                in_template = False
+        else:
+            match = JS_TOKEN.match(text, position)
+            kind, value = match.lastgroup, match.group()
+            position = match.end()
+            if kind == 'space':
+                out.space = True
+            elif kind == 'newline':
+                out.newline()
+            elif kind == 'comment':
+                if '\n' in value:
+                    out.newline()
+                else:
+                    out.space = True
+            elif kind == 'template':
+                out.emit(value, line, column)
+                in_template = True
+            elif kind == 'slash':
+                regex = JS_REGEX.match(text, start) if regex_allowed() else None
+                if regex:
+                    value = regex.group()
+                    position = regex.end()
+                out.emit(value, line, column)
+                previous = ('regex' if regex else 'punct', value)
+            elif kind == 'brace':
+                out.emit(value, line, column)
+                previous = ('brace', value)
+                if value == '{':
+                    stack.append('brace')
+                elif stack and stack.pop() == 'template':
+                    in_template = True
+            elif kind == 'string':
+                out.raw(value, line, column)
+                previous = ('string', value)
+            else:
+                out.emit(value, line, column)
+                previous = ('word' if kind == 'word' else 'punct', value)
+
+        breaks = text.count('\n', start, position)
+        if breaks:
+            line += breaks
+            line_start = text.rfind('\n', start, position) + 1
+
+    return out.finish()
+
+
+def _css_join(a: str, b: str) -> bool:
+    return not (a in '{};,>:' or b in '{};,>!')
+
+
+def minify_css(text: str) -> list:
+    # Comments and whitespace out; the whole stylesheet on one line
+    out = _Output(_css_join)
+    line, line_start = 0, 0
+    for match in CSS_TOKEN.finditer(text):
+        kind, value = match.lastgroup, match.group()
+        if kind in ('space', 'comment'):
+            out.space = True
+        else:
+            if value == '}' and out.last == ';':
+                # The last declaration of a block needs no semicolon
+                out.parts.pop()
+                out.width -= 1
+            out.emit(value, line, match.start() - line_start)
+        breaks = value.count('\n')
+        if breaks:
+            line += breaks
+            line_start = match.start() + value.rfind('\n') + 1
+    return out.finish()
+
+
+def _unchanged(text: str) -> list:
+    return [(chunk, [(0, i, 0)]) for i, chunk in enumerate(text.rstrip('\n').split('\n'))]
+
+
+def _rebase_css(text: str, key: str) -> str:
+    # Relative url() references resolve against the stylesheet's own folder,
+    # which is no longer the one it is served from once bundled
+    base = posixpath.join('/assets', posixpath.dirname(key))
+
+    def rebase(match):
+        quote, ref = match.groups()
+        if ref.startswith(('/', '#', 'data:')) or ':' in ref.split('/', 1)[0]:
+            return match.group()
+        return f'url({quote}{posixpath.normpath(posixpath.join(base, ref))}{quote})'
+
+    return CSS_URL.sub(rebase, text)
+
+
+def _css_prelude(text: str):
+    # Leading @charset/@import rules with their line, and the rest of the
+    # stylesheet (line numbers unchanged)
+    rules, position = [], 0
+    while True:
+        match = CSS_PRELUDE.match(text, position)
+        if match is None:
+            break
+        rules.append((' '.join(match.group(1).split()), text.count('\n', 0, match.start(1))))
+        position = match.end()
+    if not rules:
+        return rules, text
+    return rules, '\n' * text.count('\n', 0, position) + text[position:]
+
+
+def _vlq(value: int) -> str:
+    value = (-value << 1) | 1 if value < 0 else value << 1
+    encoded = ''
+    while True:
+        digit, value = value & 31, value >> 5
+        encoded += BASE64[digit | (32 if value else 0)]
+        if not value:
+            return encoded
+
+
+def source_map(filename: str, sources: list, lines: list) -> dict:
+    # Version 3 source map; `lines` holds (text, [(column, source, line,
+    # source column)]) per line of the bundle
+    mappings = []
+    source, source_line, source_column = 0, 0, 0
+    for _, segments in lines:
+        column, encoded = 0, []
+        for generated, index, line, original in segments:
+            encoded.append(''.join(map(_vlq, (
+                generated - column, index - source, line - source_line, original - source_column
+            ))))
+            column, source, source_line, source_column = generated, index, line, original
+        mappings.append(','.join(encoded))
+    return {
+        'version': 3,
+        'file': posixpath.basename(filename),
+        'sources': sources,
+        'names': [],
+        'mappings': ';'.join(mappings),
+    }
+
+
+class Bundle:
+    __slots__ = ('filename', 'kind', 'keys', 'asset', 'map')
+
+    def __init__(self, filename: str, kind: str, keys: list) -> None:
+        self.filename = filename
+        self.kind = kind
+        self.keys = keys
+        # Built on the first request for the bundle
+        self.asset = None
+        self.map = None
+
+
+class Bundler:
+    # Per-page JS/CSS bundles. A page marks the tags to bundle with
+    #   <!-- bundle: chat.js --> ... <!-- endbundle -->
+    # and gets one fingerprinted tag in their place. Files served from
+    # elsewhere (a library not vendored yet) keep their own tag, in order,
+    # splitting the bundle around them
+    def __init__(self, assets=None, enable: bool = True, minify: bool = True, source_maps: bool = True) -> None:
+        self.assets = assets or get_asset_store()
+        self.enable = enable
+        self.minify = minify
+        self.source_maps = source_maps
+        self._lock = threading.Lock()
+        self.bundles = {}
+
+    @classmethod
+    def from_config(cls, config: dict, assets=None) -> 'Bundler':
+        section = config.get('bundles', {})
+        return cls(
+            assets=assets,
+            enable=section.get('enable', True),
+            minify=section.get('minify', True),
+            source_maps=section.get('source_maps', True),
+        )
+
+    def page(self, text: str) -> str:
+        return REGION.sub(self._region, text)
+
+    def _entries(self, name: str, kind: str, body: str) -> list:
+        # (tag, url, key, defer) in page order; key is None for files not
+        # in the asset table
+        body = HTML_COMMENT.sub('', body)
+        if TAG.sub('', body).strip():
+            raise ValueError(f'Bundle {name}.{kind}: only <script src> and stylesheet <link> tags can be bundled')
+        entries = []
+        for match in TAG.finditer(body):
+            script = match.group(2) is not None
+            if script != (kind == 'js'):
+                raise ValueError(f'Bundle {name}.{kind}: mixes scripts and stylesheets')
+            url = match.group(2) if script else HREF.search(match.group()).group(1)
+            key = url[len('/assets/'):] if url.startswith('/assets/') else vendor_key(url)
+            if key not in self.assets.assets:
+                key = None
+            defer = script and 'defer' in f'{match.group(1)} {match.group(3)}'.split()
+            entries.append((match.group(), url, key, defer))
+        return entries
+
+    def _region(self, match) -> str:
+        name, kind, body = match.groups()
+        text = match.string
+        indent = text[text.rfind('\n', 0, match.start()) + 1:match.start()]
+        indent = indent if not indent.strip() else ''
+
+        tags, run, seen, parts = [], [], set(), []
+
+        def flush():
+            if run:
+                parts.append(f'{name}-{len(parts) + 1}' if parts else name)
+                tags.append(self._tag(self._bundle(parts[-1], kind, run)))
+                run.clear()
+
+        for tag, url, key, defer in self._entries(name, kind, body):
+            if key is None:
+                flush()
+                tags.append(tag)
+            elif not self.enable:
+                tags.append(tag.replace(url, f'/assets/{key}'))
+            elif key not in seen:
+                seen.add(key)
+                run.append((key, defer))
+        flush()
+        return f'\n{indent}'.join(tags)
+
+    def _bundle(self, name: str, kind: str, run: list) -> tuple:
+        keys = [key for key, _ in run]
+        digest = hashlib.sha256(f'{BUILD_VERSION}:{self.minify}:{self.source_maps}'.encode())
+        for key in keys:
+            digest.update(f'\n{key}:{self.assets.assets[key].etag}'.encode())
+        filename = f'bundles/{name}.{digest.hexdigest()[:12]}.{kind}'
+        with self._lock:
+            if filename not in self.bundles:
+                self.bundles[filename] = Bundle(filename, kind, keys)
+        return filename, all(defer for _, defer in run)
+
+    @staticmethod
+    def _tag(bundle: tuple) -> str:
+        filename, defer = bundle
+        if filename.endswith('.css'):
+            return f'<link rel="stylesheet" href="/assets/{filename}" />'
+        return f'<script src="/assets/{filename}"{" defer" if defer else ""}></script>'
+
+    def build(self, bundle: Bundle) -> None:
+        if bundle.asset is not None:
+            return
+        with self._lock:
+            if bundle.asset is None:
+                self._build(bundle)
+
+    def _build(self, bundle: Bundle) -> None:
+        script = bundle.kind == 'js'
+        sources, prelude, lines = [], [], []
+        for key in bundle.keys:
+            asset = self.assets.assets.get(key)
+            if asset is None:
+                continue
+            index = len(sources)
+            sources.append(f'/assets/{key}')
+            text = SOURCE_MAP_COMMENT.sub('', asset.data.decode('utf-8', 'surrogateescape'))
+            if not script:
+                text = self.assets.rewrite(_rebase_css(text, key))
+                rules, text = _css_prelude(text)
+                prelude.extend((rule, [(0, index, line, 0)]) for rule, line in rules)
+
+            # Vendored files ship minified already
+            if self.minify and not key.startswith('vendor/'):
+                output = minify_js(text) if script else minify_css(text)
+            else:
+                output = _unchanged(text)
+            if script and lines and output and output[0][0].startswith(JS_CONTINUATION):
+                first, segments = output[0]
+                output[0] = (f';{first}', [(column + 1, *rest) for column, *rest in segments])
+            lines.extend(
+                (chunk, [(column, index, line, original) for column, line, original in segments])
+                for chunk, segments in output
+            )
+
+        lines = prelude + lines
+        body = '\n'.join(chunk for chunk, _ in lines) + '\n'
+        if self.source_maps:
+            name = posixpath.basename(bundle.filename) + '.map'
+            body += f'//# sourceMappingURL={name}\n' if script else f'/*# sourceMappingURL={name} */\n'
+            bundle.map = Asset(f'{bundle.filename}.map', json.dumps(
+                source_map(bundle.filename, sources, lines), separators=(',', ':')
+            ).encode('utf-8'))
+        bundle.asset = Asset(bundle.filename, body.encode('utf-8', 'surrogateescape'))
+
+    def build_all(self) -> None:
+        # Long-running servers build and compress every bundle up front
+        for bundle in list(self.bundles.values()):
+            self.build(bundle)
+            bundle.asset.variants
+
+    def serve(self, filename: str, headers):
+        bundle = self.bundles.get(f'bundles/{filename.removesuffix(".map")}')
+        if bundle is None:
+            return None
+        self.build(bundle)
+        asset = bundle.map if filename.endswith('.map') else bundle.asset
+        if asset is None:
+            return None
+        return self.assets.response(asset, headers, cache_control=IMMUTABLE)
+
+    def stats(self) -> dict:
+        built = [b for b in self.bundles.values() if b.asset is not None]
+        return {
+            'bundles': len(self.bundles),
+            'built': len(built),
+            'bytes': sum(len(b.asset.data) for b in built),
+        }
+
+
+_bundler = None
+_bundler_lock = threading.Lock()
+
+
+def get_bundler() -> Bundler:
+    global _bundler
+
+    if _bundler is None:
+        with _bundler_lock:
+            if _bundler is None:
+                _bundler = Bundler.from_config(load_config())
+    return _bundler
+
+
+def vendor(force: bool = False, record: bool = False) -> None:
+    # Downloads the pinned libraries into client/vendor, to be committed.
+    # A file is only written when its sha256 is the one in VENDOR; with
+    # `record`, files without one are written and their digest printed
+    import requests
+
+    from server.balancer import proxy_settings
+
+    proxies = proxy_settings(load_config())
+    for name, (version, base, files) in VENDOR.items():
+        base = base.format(version=version)
+        for file, digest in files.items():
+            path = os.path.join(CLIENT_DIR, 'vendor', f'{name}@{version}', *file.split('/'))
+            if os.path.exists(path) and not force:
+                with open(path, 'rb') as f:
+                    _check_digest(f'{name}@{version}/{file}', f.read(), digest, record)
+                continue
+            response = requests.get(base + file, timeout=30, proxies=proxies)
+            response.raise_for_status()
+            _check_digest(f'{name}@{version}/{file}', response.content, digest, record)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Dot-prefixed until complete: the asset table skips those
+            partial = os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.part')
+            with open(partial, 'wb') as f:
+                f.write(response.content)
+            os.replace(partial, path)
+            print(f"{name}@{version}/{file}: {len(response.content)} bytes")
+
+
+def _check_digest(label: str, data: bytes, expected, record: bool) -> None:
+    digest = hashlib.sha256(data).hexdigest()
+    if expected is None:
+        if not record:
+            raise RuntimeError(f"{label}: no sha256 pinned in VENDOR (got {digest}); "
+                               f"check it and pin it, or run `vendor --record`")
+        print(f"{label}: sha256 {digest}, to pin in VENDOR")
+    elif digest != expected:
+        raise RuntimeError(f"{label}: sha256 {digest} does not match the pinned {expected}")
+
+
+def build(out: str) -> None:
+    # Builds the bundles of every page into `out` and reports what each
+    # page still loads
+    from server.pages import get_renderer
+
+    renderer = get_renderer()
+    bundler = renderer.bundler
+    for name, template in sorted(renderer.templates.items()):
+        html = b''.join(s for s in template.segments if isinstance(s, bytes)).decode('utf-8')
+        scripts = len(re.findall(r'<script\b[^>]*\bsrc=', html))
+        stylesheets = len(re.findall(r'<link\b[^>]*\brel="stylesheet"', html))
+        print(f"{name}: {scripts} scripts, {stylesheets} stylesheets")
+
+    for filename, bundle in sorted(bundler.bundles.items()):
+        bundler.build(bundle)
+        source = sum(len(bundler.assets.assets[key].data) for key in bundle.keys if key in bundler.assets.assets)
+        data = bundle.asset.data
+        print(f"{filename}: {source} -> {len(data)} bytes, {len(gzip.compress(data, mtime=0))} gzipped")
+        for asset in (bundle.asset, bundle.map):
+            if asset is None:
+                continue
+            path = os.path.join(out, *asset.path.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(asset.data)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description='Vendor the client libraries and build the page bundles')
+    commands = parser.add_subparsers(dest='command', required=True)
+    vendor_parser = commands.add_parser('vendor', help='download the pinned libraries into client/vendor')
+    vendor_parser.add_argument('--force', action='store_true', help='download files already present again')
+    vendor_parser.add_argument('--record', action='store_true', help='accept files with no pinned sha256 and print it')
+    build_parser = commands.add_parser('build', help='write every bundle and its source map to a folder')
+    build_parser.add_argument('--out', default=os.path.join(ROOT_DIR, 'dist'))
+    args = parser.parse_args(argv)
+
+    if args.command == 'vendor':
+        try:
+            vendor(force=args.force, record=args.record)
+        except RuntimeError as e:
+            parser.exit(1, f"{e}\n")
+    else:
+        build(args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+import hashlib
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from server.config import ROOT_DIR, load_config
+
+
+BYPASS_HEADER = 'X-Cache-Bypass'
+PUNCTUATION = re.compile(r'[^\w\s]')
+WHITESPACE = re.compile(r'\s+')
+
+
+def wants_bypass(headers) -> bool:
+    # `X-Cache-Bypass: 1` (or true/yes/on); 0, false, no, off or empty do not
+    value = (headers.get(BYPASS_HEADER) or '').strip().lower()
+    return value not in ('', '0', 'false', 'no', 'off')
+
+
+def normalize_question(question: str) -> str:
+    question = unicodedata.normalize('NFKC', question).casefold()
+    question = PUNCTUATION.sub(' ', question)
+    return WHITESPACE.sub(' ', question).strip()
+
+
+def is_error_event(event: bytes) -> bool:
+    # Events are coalesced byte chunks, an error frame may not come first
+    return b'data: {"error"' in event or b'data: Error' in event
+
+
+def pack_events(events: list) -> bytes:
+    # Each chunk prefixed with its 4-byte length, keeping chunk boundaries
+    return b''.join(struct.pack('>I', len(e)) + e for e in events)
+
+
+def unpack_events(data: bytes) -> list:
+    events = []
+    position = 0
+    while position < len(data):
+        size, = struct.unpack_from('>I', data, position)
+        position += 4
+        events.append(data[position:position + size])
+        position += size
+    return events
+
+
+class DiskStore:
+    # SQLite second tier so answers survive restarts and are shared by the
+    # worker processes of one host
+    def __init__(self, path: str, max_bytes: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS answer_chunks ('
+            'key TEXT PRIMARY KEY, question TEXT, events BLOB, size INTEGER, '
+            'expires REAL, accessed REAL)'
+        )
+        self.db.execute('CREATE INDEX IF NOT EXISTS answer_chunks_accessed ON answer_chunks (accessed)')
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self.db.execute(
+                'SELECT events, expires FROM answer_chunks WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self.db.execute('DELETE FROM answer_chunks WHERE key = ?', (key,))
+                return None
+            self.db.execute('UPDATE answer_chunks SET accessed = ? WHERE key = ?', (now, key))
+        # The expiry goes along: a copy kept in memory must not outlive it
+        return unpack_events(row[0]), row[1]
+
+    def put(self, key: str, question: str, events: list, size: int, expires: float) -> None:
+        now = time.time()
+        with self._lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO answer_chunks VALUES (?, ?, ?, ?, ?, ?)',
+                (key, question, pack_events(events), size, expires, now)
+            )
+            self.db.execute('DELETE FROM answer_chunks WHERE expires < ?', (now,))
+            total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM answer_chunks').fetchone()[0]
+            while total > self.max_bytes:
+                row = self.db.execute(
+                    'SELECT key, size FROM answer_chunks ORDER BY accessed LIMIT 1'
+                ).fetchone()
+                if row is None:
+                    break
+                self.db.execute('DELETE FROM answer_chunks WHERE key = ?', (row[0],))
+                total -= row[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self.db.execute('DELETE FROM answer_chunks')
+
+
+class _Recording:
+    def __init__(self, cache, key: str, question: str) -> None:
+        self.cache = cache
+        self.key = key
+        self.question = question
+        self.events = []
+        self.size = 0
+        self.complete = False
+
+    def feed(self, event: bytes) -> None:
+        if self.events is None:
+            return
+        self.size += len(event)
+        if is_error_event(event) or self.size > self.cache.max_answer_bytes:
+            self.events = None
+            return
+        self.events.append(event)
+        if b'data: [DONE]' in event:
+            self.complete = True
+
+    def finish(self) -> None:
+        if self.events and self.complete:
+            self.cache.put(self.key, self.question, self.events)
+
+
+async def _replay_async(events):
+    for event in events:
+        yield event
+
+
+class AnswerCache:
+    def __init__(self,
+                 enable: bool = True,
+                 ttl: float = 86400,
+                 max_entries: int = 1000,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 max_answer_bytes: int = 1024 * 1024,
+                 path: str = None,
+                 max_disk_bytes: int = 512 * 1024 * 1024
+                 ) -> None:
+        self.enable = enable
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_answer_bytes = max_answer_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.disk = None
+        if enable and path:
+            self.disk = DiskStore(os.path.join(ROOT_DIR, path), max_disk_bytes)
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'AnswerCache':
+        section = config.get('answer_cache', {})
+        return cls(
+            enable=section.get('enable', True),
+            ttl=section.get('ttl', 86400),
+            max_entries=section.get('max_entries', 1000),
+            max_bytes=section.get('max_bytes', 64 * 1024 * 1024),
+            max_answer_bytes=section.get('max_answer_bytes', 1024 * 1024),
+            path=section.get('path'),
+            max_disk_bytes=section.get('max_disk_bytes', 512 * 1024 * 1024),
+        )
+
+    def key(self, question: str, context: str = '') -> str:
+        # `context` digests the history forwarded with the question: a
+        # follow-up only matches answers given after the same exchange
+        question = normalize_question(question)
+        if context:
+            question = f'{question}\0{context}'
+        return hashlib.sha256(question.encode('utf-8')).hexdigest()
+
+    def get(self, key: str):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, events, size = entry
+                if expires >= now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return events
+                del self._entries[key]
+                self._bytes -= size
+
+        row = self.disk.get(key) if self.disk else None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        events, expires = row
+        self._remember(key, events, sum(len(e) for e in events), expires - time.time())
+        return events
+
+    def put(self, key: str, question: str, events: list) -> None:
+        # Chunks are kept as relayed so a hit replays the same writes
+        events = list(events)
+        size = sum(len(e) for e in events)
+        if size > self.max_answer_bytes:
+            return
+        self._remember(key, events, size)
+        if self.disk:
+            self.disk.put(key, question, events, size, time.time() + self.ttl)
+
+    def _remember(self, key: str, events: list, size: int, ttl: float = None) -> None:
+        # `ttl`: what remains of an entry read back from disk, whose wall
+        # clock expiry becomes a monotonic deadline here
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+            self._entries[key] = (time.monotonic() + ttl, events, size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def record(self, key: str, question: str, events):
+        # Relay the stream untouched and keep a copy; only a complete answer
+        # (no error event, terminated by [DONE]) is stored
+        recording = _Recording(self, key, question)
+        for event in events:
+            yield event
+            recording.feed(event)
+        recording.finish()
+
+    async def record_async(self, key: str, question: str, events):
+        recording = _Recording(self, key, question)
+        async for event in events:
+            yield event
+            recording.feed(event)
+        recording.finish()
+
+    def _lookup(self, question: str, headers, context: str):
+        key = self.key(question, context)
+        if wants_bypass(headers):
+            with self._lock:
+                self.bypasses += 1
+            return key, None, 'BYPASS'
+
+        events = self.get(key)
+        return key, events, 'HIT' if events is not None else 'MISS'
+
+    def stream(self, question: str, headers, generate, context: str = ''):
+        # Returns (events, status) where status feeds the X-Cache header
+        if not self.enable:
+            return generate(), 'DISABLED'
+
+        key, events, status = self._lookup(question, headers, context)
+        if events is not None:
+            return iter(events), status
+        return self.record(key, question, generate()), status
+
+    def stream_async(self, question: str, headers, generate, context: str = ''):
+        if not self.enable:
+            return generate(), 'DISABLED'
+
+        key, events, status = self._lookup(question, headers, context)
+        if events is not None:
+            return _replay_async(events), status
+        return self.record_async(key, question, generate()), status
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.disk:
+            self.disk.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'enable': self.enable,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'bypasses': self.bypasses,
+                'disk': self.disk.path if self.disk else None,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> AnswerCache:
+    global _cache
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AnswerCache.from_config(load_config())
+    return _cache
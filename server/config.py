@@ -1,3 +1,39 @@
+import os
+from json import load
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLIENT_DIR = os.path.join(ROOT_DIR, 'client')
+CONFIG_PATH = os.environ.get('NOG_CONFIG', os.path.join(ROOT_DIR, 'config.json'))
+
+_config = None
+
+
+def load_config(path: str = None) -> dict:
+    global _config
+
+    if path is None and _config is not None:
+        return _config
+
+    try:
+        with open(path or CONFIG_PATH, 'r') as f:
+            config = load(f)
+    except FileNotFoundError:
+        config = {}
+
+    if path is None:
+        _config = config
+    return config
+
+
+def reload_enabled(config: dict = None) -> bool:
+    # Dev mode: pages and assets are reloaded from disk when they change
+    config = load_config() if config is None else config
+    return config.get('pages', {}).get(
+        'reload', config.get('site_config', {}).get('debug', False)
+    )
+
+
 models = {
     'text-gpt-0040-render-sha-0': 'gpt-4',
     'text-gpt-0035-render-sha-0': 'gpt-3.5-turbo',
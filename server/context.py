@@ -0,0 +1,202 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from server.config import load_config
+from server.conversation import extract_history
+from server.conversations import CLIENT_HEADER, CLIENT_ID, get_conversation_store
+
+
+ROLES = ('user', 'assistant')
+MESSAGE_OVERHEAD = 4
+
+
+def estimate_tokens(text: str) -> int:
+    # Tokenizer-free estimate: BPE vocabularies average about four characters
+    # per token on French and English prose
+    return (len(text) + 3) // 4 + MESSAGE_OVERHEAD
+
+
+class _Entry:
+    __slots__ = ('message', 'tokens', 'digest')
+
+    def __init__(self, role: str, content: str) -> None:
+        self.message = {'role': role, 'content': content}
+        self.tokens = estimate_tokens(content)
+        self.digest = hashlib.sha1(f'{role}\0{content}'.encode('utf-8')).digest()
+
+
+def _entry(item):
+    # Only the text turns are forwarded; video link cards and malformed items
+    # are skipped but still counted so the prefix offsets stay aligned
+    if not isinstance(item, dict) or item.get('role') not in ROLES:
+        return None
+    content = item.get('content')
+    if not isinstance(content, str) or not content:
+        return None
+    return _Entry(item['role'], content)
+
+
+class _Prefix:
+    # What is known of one conversation: how many items were already seen and
+    # the converted tail, no longer than the largest window ever forwarded
+    __slots__ = ('count', 'last', 'entries')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.last = None
+        self.entries = []
+
+
+class ContextBuilder:
+    def __init__(self,
+                 enable: bool = True,
+                 field: str = 'history',
+                 max_tokens: int = 1024,
+                 max_messages: int = 12,
+                 max_conversations: int = 1000
+                 ) -> None:
+        self.enable = enable
+        self.field = field
+        self.max_tokens = max_tokens
+        self.max_messages = max_messages
+        self.max_conversations = max_conversations
+        self._lock = threading.Lock()
+        self._prefixes = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'ContextBuilder':
+        section = config.get('context', {})
+        return cls(
+            enable=section.get('enable', True),
+            field=section.get('field', 'history'),
+            max_tokens=section.get('max_tokens', 1024),
+            max_messages=section.get('max_messages', 12),
+            max_conversations=section.get('max_conversations', 1000),
+        )
+
+    def _prefix(self, key: tuple) -> _Prefix:
+        with self._lock:
+            prefix = self._prefixes.get(key)
+            if prefix is not None:
+                self._prefixes.move_to_end(key)
+                self.hits += 1
+                return prefix
+            self.misses += 1
+            return _Prefix()
+
+    def _store(self, key: tuple, prefix: _Prefix) -> None:
+        with self._lock:
+            self._prefixes[key] = prefix
+            self._prefixes.move_to_end(key)
+            while len(self._prefixes) > self.max_conversations:
+                self._prefixes.popitem(last=False)
+
+    def _extend(self, prefix: _Prefix, items: list, count: int) -> _Prefix:
+        # Copy-on-write: requests racing on the same conversation each build
+        # their own prefix and the last one to finish is kept
+        updated = _Prefix()
+        updated.count = count
+        updated.last = items[-1] if items else prefix.last
+        updated.entries = prefix.entries + [e for e in map(_entry, items) if e is not None]
+        del updated.entries[:-self.max_messages]
+        return updated
+
+    def _from_request(self, key: tuple, history: list) -> _Prefix:
+        prefix = self._prefix(key)
+        # The client resends everything: only the items past the cached
+        # prefix are converted, as long as that prefix is still the same
+        if not (0 < prefix.count <= len(history) and history[prefix.count - 1] == prefix.last):
+            prefix = _Prefix()
+        return self._extend(prefix, history[prefix.count:], len(history))
+
+    def _from_store(self, key: tuple, owner: str, conversation_id: str) -> _Prefix:
+        store = get_conversation_store()
+        prefix = self._prefix(key)
+        if store is None:
+            return prefix
+
+        # Only the messages appended since the previous turn are read back
+        items, after = [], prefix.count
+        while after is not None:
+            page = store.get(owner, conversation_id, store.max_page_size, after)
+            if page is None:
+                return _Prefix()
+            if page['messages'] < prefix.count:
+                # Deleted and started over under the same id
+                prefix = _Prefix()
+                after = 0
+                continue
+            items.extend(page['items'])
+            after = page['next']
+        if not items:
+            return prefix
+        return self._extend(prefix, items, prefix.count + len(items))
+
+    def window(self, prefix: _Prefix) -> list:
+        # Newest messages first until the budget is spent
+        window, budget = [], self.max_tokens
+        for entry in reversed(prefix.entries):
+            if entry.tokens > budget or len(window) >= self.max_messages:
+                break
+            budget -= entry.tokens
+            window.append(entry)
+        window.reverse()
+        return window
+
+    def apply(self, payload: dict, data: dict, headers) -> str:
+        # Adds the trimmed history to the upstream payload and returns a
+        # digest of it, used to key cached and coalesced answers
+        if not self.enable:
+            return ''
+
+        conversation_id = str(data.get('conversation_id') or '')
+        owner = headers.get(CLIENT_HEADER, '')
+        history = extract_history(data)
+        key = (owner, conversation_id)
+
+        try:
+            if history:
+                prefix = self._from_request(key, history)
+            elif conversation_id and CLIENT_ID.match(owner) and CLIENT_ID.match(conversation_id):
+                prefix = self._from_store(key, owner, conversation_id)
+            else:
+                return ''
+        except Exception as e:
+            # Context is best effort: the question alone still gets answered
+            print(f"Context assembly failed: {e}")
+            return ''
+
+        if conversation_id:
+            self._store(key, prefix)
+
+        window = self.window(prefix)
+        if not window:
+            return ''
+        payload[self.field] = [entry.message for entry in window]
+        return hashlib.sha256(b''.join(entry.digest for entry in window)).hexdigest()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'enable': self.enable,
+                'conversations': len(self._prefixes),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+_builder = None
+_builder_lock = threading.Lock()
+
+
+def get_context_builder() -> ContextBuilder:
+    global _builder
+
+    if _builder is None:
+        with _builder_lock:
+            if _builder is None:
+                _builder = ContextBuilder.from_config(load_config())
+    return _builder
@@ -0,0 +1,38 @@
+from json import dumps
+
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Cache-Bypass, X-Client-Id'
+}
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Cache-Bypass, X-Client-Id'
+}
+
+DONE_EVENT = b"data: [DONE]\n\n"
+
+
+def extract_question(data: dict) -> str:
+    prompt = data.get('meta', {}).get('content', {}).get('parts', [{}])[0]
+    return prompt.get('content', '') if isinstance(prompt, dict) else str(prompt)
+
+
+def extract_history(data: dict) -> list:
+    history = data.get('meta', {}).get('content', {}).get('conversation')
+    return history if isinstance(history, list) else []
+
+
+def build_payload(question_text: str) -> dict:
+    return {
+        "question": question_text.replace("?", "").replace("\n", "")
+    }
+
+
+def error_event(message: str) -> bytes:
+    return f"data: {dumps({'error': message})}\n\n".encode('utf-8')
@@ -0,0 +1,303 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from json import dumps, loads
+
+from flask import request, jsonify
+
+from server.config import ROOT_DIR, load_config
+
+
+CLIENT_HEADER = 'X-Client-Id'
+CLIENT_ID = re.compile(r'^[\w-]{1,64}$')
+
+
+class ConversationError(Exception):
+    def __init__(self, message: str, status: int = 400) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def encode_cursor(updated: float, conversation_id: str) -> str:
+    return f'{updated!r}:{conversation_id}'
+
+
+def decode_cursor(cursor: str):
+    try:
+        updated, conversation_id = cursor.split(':', 1)
+        return float(updated), conversation_id
+    except ValueError:
+        raise ConversationError('Invalid cursor')
+
+
+class ConversationStore:
+    # Conversations per client in SQLite (WAL): one row per conversation,
+    # indexed by last update for the sidebar, and one row per message so an
+    # answer is appended without rewriting the history
+    def __init__(self,
+                 path: str,
+                 page_size: int = 20,
+                 max_page_size: int = 100,
+                 max_message_bytes: int = 1024 * 1024
+                 ) -> None:
+        self.path = path
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+        self.max_message_bytes = max_message_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS conversations ('
+            'owner TEXT, id TEXT, title TEXT, created REAL, updated REAL, messages INTEGER, '
+            'PRIMARY KEY (owner, id))'
+        )
+        self.db.execute(
+            'CREATE INDEX IF NOT EXISTS conversations_updated '
+            'ON conversations (owner, updated, id)'
+        )
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS messages ('
+            'owner TEXT, conversation_id TEXT, position INTEGER, role TEXT, '
+            'image TEXT, content TEXT, created REAL, '
+            'PRIMARY KEY (owner, conversation_id, position)) WITHOUT ROWID'
+        )
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'ConversationStore':
+        section = config.get('conversations', {})
+        return cls(
+            path=os.path.join(ROOT_DIR, section.get('path', 'data/conversations.sqlite3')),
+            page_size=section.get('page_size', 20),
+            max_page_size=section.get('max_page_size', 100),
+            max_message_bytes=section.get('max_message_bytes', 1024 * 1024),
+        )
+
+    def _limit(self, limit) -> int:
+        if limit is None:
+            return self.page_size
+        return max(1, min(int(limit), self.max_page_size))
+
+    def list(self, owner: str, limit: int = None, cursor: str = None) -> dict:
+        # Keyset pagination on (updated, id): every page costs one index range
+        # scan, however many conversations come before it
+        limit = self._limit(limit)
+        query = 'SELECT id, title, created, updated, messages FROM conversations WHERE owner = ?'
+        params = [owner]
+        if cursor:
+            updated, conversation_id = decode_cursor(cursor)
+            query += ' AND (updated < ? OR (updated = ? AND id < ?))'
+            params += [updated, updated, conversation_id]
+        query += ' ORDER BY updated DESC, id DESC LIMIT ?'
+        params.append(limit + 1)
+
+        with self._lock:
+            rows = self.db.execute(query, params).fetchall()
+
+        conversations = [{
+            'id': row[0], 'title': row[1], 'created': row[2], 'updated': row[3], 'messages': row[4],
+        } for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = conversations[-1]
+            next_cursor = encode_cursor(last['updated'], last['id'])
+        return {'conversations': conversations, 'next': next_cursor}
+
+    def get(self, owner: str, conversation_id: str, limit: int = None, after: int = 0) -> dict:
+        limit = self._limit(limit)
+        with self._lock:
+            row = self.db.execute(
+                'SELECT title, created, updated, messages FROM conversations WHERE owner = ? AND id = ?',
+                (owner, conversation_id)
+            ).fetchone()
+            if row is None:
+                return None
+            items = self.db.execute(
+                'SELECT position, role, image, content FROM messages '
+                'WHERE owner = ? AND conversation_id = ? AND position >= ? '
+                'ORDER BY position LIMIT ?',
+                (owner, conversation_id, after, limit)
+            ).fetchall()
+
+        next_position = items[-1][0] + 1 if items and items[-1][0] + 1 < row[3] else None
+        return {
+            'id': conversation_id,
+            'title': row[0],
+            'created': row[1],
+            'updated': row[2],
+            'messages': row[3],
+            'items': [{'role': r[1], 'image': r[2], 'content': loads(r[3])} for r in items],
+            'next': next_position,
+        }
+
+    def create(self, owner: str, conversation_id: str, title: str = '') -> bool:
+        now = time.time()
+        with self._lock:
+            cursor = self.db.execute(
+                'INSERT OR IGNORE INTO conversations VALUES (?, ?, ?, ?, ?, 0)',
+                (owner, conversation_id, title, now, now)
+            )
+        return cursor.rowcount > 0
+
+    def append(self, owner: str, conversation_id: str, items: list, title: str = '') -> int:
+        # Positions are handed out inside one write transaction, so appends
+        # racing on the same conversation never interleave or collide
+        rows = []
+        for item in items:
+            if not isinstance(item, dict):
+                raise ConversationError('Invalid message')
+            content = dumps(item.get('content', ''))
+            if len(content) > self.max_message_bytes:
+                raise ConversationError('Message too large', 413)
+            rows.append((item.get('role', 'user'), item.get('image', ''), content))
+
+        now = time.time()
+        with self._lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                self.db.execute(
+                    'INSERT OR IGNORE INTO conversations VALUES (?, ?, ?, ?, ?, 0)',
+                    (owner, conversation_id, title, now, now)
+                )
+                count = self.db.execute(
+                    'SELECT messages FROM conversations WHERE owner = ? AND id = ?',
+                    (owner, conversation_id)
+                ).fetchone()[0]
+                self.db.executemany(
+                    'INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [(owner, conversation_id, count + i, role, image, content, now)
+                     for i, (role, image, content) in enumerate(rows)]
+                )
+                self.db.execute(
+                    'UPDATE conversations SET messages = ?, updated = ? WHERE owner = ? AND id = ?',
+                    (count + len(rows), now, owner, conversation_id)
+                )
+                self.db.execute('COMMIT')
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+        return count + len(rows)
+
+    def delete(self, owner: str, conversation_id: str = None) -> int:
+        # Without an id every conversation of the client is removed
+        if conversation_id is None:
+            conversations, messages, params = 'owner = ?', 'owner = ?', [owner]
+        else:
+            conversations = 'owner = ? AND id = ?'
+            messages = 'owner = ? AND conversation_id = ?'
+            params = [owner, conversation_id]
+        with self._lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                deleted = self.db.execute(f'DELETE FROM conversations WHERE {conversations}', params).rowcount
+                self.db.execute(f'DELETE FROM messages WHERE {messages}', params)
+                self.db.execute('COMMIT')
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+        return deleted
+
+
+class ConversationApi:
+    # Registered by the app factory. The store is opened
+    # on first use so a read-only deployment still serves everything else
+    def __init__(self) -> None:
+        self.routes = {
+            '/backend-api/v2/conversations': {
+                'function': self._conversations,
+                'methods': ['GET', 'POST', 'DELETE']
+            },
+            '/backend-api/v2/conversations/<conversation_id>': {
+                'function': self._stored_conversation,
+                'methods': ['GET', 'DELETE']
+            },
+            '/backend-api/v2/conversations/<conversation_id>/messages': {
+                'function': self._messages,
+                'methods': ['POST']
+            },
+        }
+
+    def _context(self):
+        owner = request.headers.get(CLIENT_HEADER, '')
+        if not CLIENT_ID.match(owner):
+            raise ConversationError(f'Missing or invalid {CLIENT_HEADER} header')
+        store = get_conversation_store()
+        if store is None:
+            raise ConversationError('Conversation store disabled', 404)
+        return store, owner
+
+    def _handle(self, handler):
+        try:
+            return handler(*self._context())
+        except ConversationError as e:
+            return jsonify({'error': str(e)}), e.status
+        except (sqlite3.Error, OSError) as e:
+            print(f"Conversation store error: {e}")
+            return jsonify({'error': 'Conversation store unavailable'}), 503
+
+    def _conversations(self):
+        def handler(store, owner):
+            if request.method == 'GET':
+                return jsonify(store.list(owner, request.args.get('limit', type=int), request.args.get('cursor')))
+            if request.method == 'DELETE':
+                return jsonify({'deleted': store.delete(owner)})
+
+            data = request.get_json(silent=True) or {}
+            conversation_id = str(data.get('id', ''))
+            if not CLIENT_ID.match(conversation_id):
+                raise ConversationError('Missing or invalid conversation id')
+            created = store.create(owner, conversation_id, str(data.get('title', '')))
+            if data.get('items'):
+                store.append(owner, conversation_id, data['items'])
+            return jsonify({'id': conversation_id, 'created': created}), 201 if created else 200
+
+        return self._handle(handler)
+
+    def _stored_conversation(self, conversation_id):
+        def handler(store, owner):
+            if request.method == 'DELETE':
+                return jsonify({'deleted': store.delete(owner, conversation_id)})
+
+            conversation = store.get(
+                owner, conversation_id,
+                request.args.get('limit', type=int), request.args.get('after', 0, type=int)
+            )
+            if conversation is None:
+                raise ConversationError('Conversation not found', 404)
+            return jsonify(conversation)
+
+        return self._handle(handler)
+
+    def _messages(self, conversation_id):
+        def handler(store, owner):
+            if not CLIENT_ID.match(conversation_id):
+                raise ConversationError('Invalid conversation id')
+            data = request.get_json(silent=True) or {}
+            items = data.get('items', [data] if 'role' in data else [])
+            if not items:
+                raise ConversationError('No message provided')
+            count = store.append(owner, conversation_id, items, str(data.get('title', '')))
+            return jsonify({'id': conversation_id, 'messages': count})
+
+        return self._handle(handler)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_conversation_store():
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                config = load_config()
+                if not config.get('conversations', {}).get('enable', True):
+                    return None
+                _store = ConversationStore.from_config(config)
+    return _store
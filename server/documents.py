@@ -0,0 +1,549 @@
+import hashlib
+import importlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from json import dumps, loads
+
+from flask import request, jsonify, Response
+
+from server.config import ROOT_DIR, load_config
+
+
+# Fields a PUT may change; anything else in the metadata is ignored
+METADATA_FIELDS = ('custom1', 'custom2', 'folders', 'description', 'documentNumber', 'classification')
+
+
+class DocumentError(Exception):
+    def __init__(self, message: str, status: int = 400) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class DocumentUpdate:
+    __slots__ = ('id', 'fields', 'version')
+
+    def __init__(self, document_id: str, fields: dict, version: int = None) -> None:
+        self.id = document_id
+        self.fields = fields
+        # Expected current version, None to overwrite whatever is there
+        self.version = version
+
+
+def document_etag(document: dict) -> str:
+    return f"{document['id']}-{document['version']}"
+
+
+def parse_etag_version(document_id: str, etag: str):
+    prefix = f'{document_id}-'
+    if not etag.startswith(prefix):
+        raise DocumentError('If-Match does not name this document', 412)
+    try:
+        return int(etag[len(prefix):])
+    except ValueError:
+        raise DocumentError('Invalid If-Match version', 412)
+
+
+def parse_update(document_id: str, body: dict, version: int = None) -> DocumentUpdate:
+    # Same body as the workspace sync sends: name and content at the top,
+    # iManage profile fields under metadata
+    if not isinstance(body, dict):
+        raise DocumentError('Invalid document')
+    metadata = body.get('metadata') or {}
+    if not isinstance(metadata, dict):
+        raise DocumentError('Invalid metadata')
+
+    fields = {k: metadata[k] for k in METADATA_FIELDS if k in metadata}
+    if 'name' in body:
+        fields['name'] = str(body['name'])
+    if 'content' in body:
+        fields['content'] = body['content']
+    if version is None and body.get('version') is not None:
+        try:
+            version = int(body['version'])
+        except (TypeError, ValueError):
+            raise DocumentError('Invalid version')
+    return DocumentUpdate(document_id, fields, version)
+
+
+class DocumentBackend:
+    # What the document service needs from a document management system.
+    # Results of put_documents() are (status, document) pairs in the order of
+    # the updates: 200 with the new document, 404, or 412 with the current one
+    def get_workspace(self, customer_id: str, library_id: str, workspace_id: str):
+        raise NotImplementedError
+
+    def get_document(self, document_id: str):
+        raise NotImplementedError
+
+    def put_documents(self, updates: list) -> list:
+        raise NotImplementedError
+
+
+class SQLiteDocumentBackend(DocumentBackend):
+    # Local stand-in for iManage: workspaces and document profiles in SQLite
+    # (WAL), documents indexed by workspace so a listing is one range scan
+    def __init__(self, path: str, seed: str = None) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS workspaces ('
+            'customer TEXT, library TEXT, id TEXT, data TEXT, '
+            'PRIMARY KEY (customer, library, id))'
+        )
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS documents ('
+            'id TEXT PRIMARY KEY, customer TEXT, library TEXT, workspace TEXT, '
+            'version INTEGER, data TEXT, content TEXT)'
+        )
+        self.db.execute(
+            'CREATE INDEX IF NOT EXISTS documents_workspace '
+            'ON documents (customer, library, workspace, id)'
+        )
+        if seed and not self.db.execute('SELECT 1 FROM workspaces LIMIT 1').fetchone():
+            with open(seed, 'r') as f:
+                self.import_workspaces(loads(f.read()))
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'SQLiteDocumentBackend':
+        section = config.get('documents', {})
+        seed = section.get('seed')
+        return cls(
+            path=os.path.join(ROOT_DIR, section.get('path', 'data/documents.sqlite3')),
+            seed=os.path.join(ROOT_DIR, seed) if seed else None,
+        )
+
+    def import_workspaces(self, data: dict) -> None:
+        # {"workspaces": [{"customer", "library", "id", "name", ..., "documents": [...]}]}
+        with self._lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                for workspace in data.get('workspaces', []):
+                    workspace = dict(workspace)
+                    documents = workspace.pop('documents', [])
+                    key = (str(workspace.pop('customer')), str(workspace.pop('library')), str(workspace['id']))
+                    self.db.execute('INSERT OR REPLACE INTO workspaces VALUES (?, ?, ?, ?)', (*key, dumps(workspace)))
+                    for document in documents:
+                        document = dict(document)
+                        content = document.pop('content', '')
+                        document['version'] = int(document.get('version', 1))
+                        self.db.execute(
+                            'INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            (str(document['id']), *key, document['version'], dumps(document), dumps(content))
+                        )
+                self.db.execute('COMMIT')
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+
+    def get_workspace(self, customer_id: str, library_id: str, workspace_id: str):
+        key = (customer_id, library_id, workspace_id)
+        with self._lock:
+            row = self.db.execute(
+                'SELECT data FROM workspaces WHERE customer = ? AND library = ? AND id = ?', key
+            ).fetchone()
+            if row is None:
+                return None
+            documents = self.db.execute(
+                'SELECT data FROM documents WHERE customer = ? AND library = ? AND workspace = ? ORDER BY id', key
+            ).fetchall()
+        return {
+            **loads(row[0]),
+            'customerId': customer_id,
+            'libraryId': library_id,
+            'documents': [loads(d[0]) for d in documents],
+        }
+
+    def get_document(self, document_id: str):
+        with self._lock:
+            row = self.db.execute(
+                'SELECT customer, library, workspace, data, content FROM documents WHERE id = ?', (document_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return self._document(row)
+
+    def _document(self, row) -> dict:
+        return {
+            **loads(row[3]),
+            'customerId': row[0],
+            'libraryId': row[1],
+            'workspaceId': row[2],
+            'content': loads(row[4]),
+        }
+
+    def put_documents(self, updates: list) -> list:
+        # The whole batch is one write transaction: N updates, one commit
+        results = []
+        now = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                for update in updates:
+                    row = self.db.execute(
+                        'SELECT customer, library, workspace, data, content FROM documents WHERE id = ?',
+                        (update.id,)
+                    ).fetchone()
+                    if row is None:
+                        results.append((404, None))
+                        continue
+                    current = self._document(row)
+                    if update.version is not None and update.version != current['version']:
+                        results.append((412, current))
+                        continue
+
+                    fields = dict(update.fields)
+                    content = fields.pop('content', current['content'])
+                    data = {**loads(row[3]), **fields}
+                    data['version'] = current['version'] + 1
+                    data['modifiedDate'] = now
+                    self.db.execute(
+                        'UPDATE documents SET version = ?, data = ?, content = ? WHERE id = ?',
+                        (data['version'], dumps(data), dumps(content), update.id)
+                    )
+                    results.append((200, self._document((*row[:3], dumps(data), dumps(content)))))
+                self.db.execute('COMMIT')
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+        return results
+
+
+BACKENDS = {
+    'sqlite': SQLiteDocumentBackend,
+}
+
+
+def load_backend(config: dict) -> DocumentBackend:
+    # `backend` is a name from BACKENDS or "package.module:Class" for a
+    # connector living elsewhere; either way built with from_config(config)
+    name = config.get('documents', {}).get('backend', 'sqlite')
+    if name in BACKENDS:
+        return BACKENDS[name].from_config(config)
+    module, _, attribute = name.partition(':')
+    if not attribute:
+        raise ValueError(f"Unknown document backend: {name}")
+    return getattr(importlib.import_module(module), attribute).from_config(config)
+
+
+class _Batch:
+    __slots__ = ('updates', 'results', 'error', 'full', 'done')
+
+    def __init__(self) -> None:
+        self.updates = []
+        self.results = None
+        self.error = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class WriteBatcher:
+    # Group commit: the first PUT of a window waits up to `max_delay` for
+    # others, then writes them all with one put_documents() call. Every
+    # caller still gets its own result
+    def __init__(self, backend: DocumentBackend, max_delay: float = 0.005, max_batch: int = 100) -> None:
+        self.backend = backend
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pending = None
+        self.batches = 0
+        self.writes = 0
+
+    def submit(self, updates: list) -> list:
+        if not updates:
+            return []
+        with self._lock:
+            batch = self._pending
+            leader = batch is None
+            if leader:
+                batch = self._pending = _Batch()
+            start = len(batch.updates)
+            batch.updates.extend(updates)
+            if len(batch.updates) >= self.max_batch:
+                self._pending = None
+                batch.full.set()
+
+        if not leader:
+            batch.done.wait()
+        else:
+            if self.max_delay > 0:
+                batch.full.wait(self.max_delay)
+            with self._lock:
+                if self._pending is batch:
+                    self._pending = None
+                self.batches += 1
+                self.writes += len(batch.updates)
+            try:
+                batch.results = self.backend.put_documents(batch.updates)
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[start:start + len(updates)]
+
+
+class _Cached:
+    __slots__ = ('body', 'etag', 'expires')
+
+    def __init__(self, body: bytes, etag: str, expires: float) -> None:
+        self.body = body
+        self.etag = etag
+        self.expires = expires
+
+
+class DocumentService:
+    # Read-through cache in front of the backend. Workspace listings and
+    # documents are kept serialized with their ETag, so a hit costs no query
+    # and no JSON encoding; a write drops the entries it makes stale
+    def __init__(self,
+                 backend: DocumentBackend,
+                 ttl: float = 60,
+                 max_entries: int = 256,
+                 batch_ms: float = 5,
+                 max_batch: int = 100,
+                 sync_workers: int = 4,
+                 max_sync: int = 1000
+                 ) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_batch = max_batch
+        self.max_sync = max_sync
+        self.writer = WriteBatcher(backend, batch_ms / 1000, max_batch)
+        self._pool = ThreadPoolExecutor(max_workers=sync_workers, thread_name_prefix='documents')
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'DocumentService':
+        section = config.get('documents', {})
+        return cls(
+            backend=load_backend(config),
+            ttl=section.get('cache_ttl', 60),
+            max_entries=section.get('cache_entries', 256),
+            batch_ms=section.get('batch_ms', 5),
+            max_batch=section.get('max_batch', 100),
+            sync_workers=section.get('sync_workers', 4),
+            max_sync=section.get('max_sync', 1000),
+        )
+
+    def _cached(self, key: tuple, load):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires >= now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            generation = self._generation
+
+        value = load()
+        if value is None:
+            return None
+        body = dumps(value).encode('utf-8')
+        entry = _Cached(body, hashlib.sha1(body).hexdigest(), now + self.ttl)
+        if key[0] == 'document':
+            entry.etag = document_etag(value)
+
+        with self._lock:
+            # A write that landed while loading may have made `value` stale
+            if generation == self._generation:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def workspace(self, customer_id: str, library_id: str, workspace_id: str):
+        return self._cached(
+            ('workspace', customer_id, library_id, workspace_id),
+            lambda: self.backend.get_workspace(customer_id, library_id, workspace_id)
+        )
+
+    def document(self, document_id: str):
+        return self._cached(('document', document_id), lambda: self.backend.get_document(document_id))
+
+    def put(self, updates: list) -> list:
+        results = self.writer.submit(updates)
+        with self._lock:
+            self._generation += 1
+            for update, (status, document) in zip(updates, results):
+                self._entries.pop(('document', update.id), None)
+                if status == 200:
+                    self._entries.pop(('workspace', document['customerId'],
+                                       document['libraryId'], document['workspaceId']), None)
+        return results
+
+    def sync(self, updates: list) -> list:
+        # Bulk sync: the updates are cut into batches written concurrently by
+        # the pool, each batch one backend call with its own version checks
+        if len(updates) > self.max_sync:
+            raise DocumentError(f'At most {self.max_sync} documents per sync', 413)
+        chunks = [updates[i:i + self.max_batch] for i in range(0, len(updates), self.max_batch)]
+        results = []
+        for chunk in self._pool.map(self.put, chunks):
+            results.extend(chunk)
+        return results
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'batches': self.writer.batches,
+                'writes': self.writer.writes,
+            }
+
+
+class DocumentApi:
+    # The iManage routes workspace.js calls, served from the document service
+    def __init__(self) -> None:
+        self.routes = {
+            '/api/v2/customers/<customer_id>/libraries/<library_id>/workspaces/<workspace_id>': {
+                'function': self._workspace,
+                'methods': ['GET']
+            },
+            '/api/v2/documents/bulk': {
+                'function': self._bulk,
+                'methods': ['POST']
+            },
+            '/api/v2/documents/<document_id>': {
+                'function': self._document,
+                'methods': ['GET', 'PUT']
+            },
+        }
+
+    def _handle(self, handler):
+        try:
+            service = get_document_service()
+            if service is None:
+                raise DocumentError('Document service disabled', 404)
+            return handler(service)
+        except DocumentError as e:
+            return jsonify({'error': str(e)}), e.status
+        except (sqlite3.Error, OSError) as e:
+            print(f"Document backend error: {e}")
+            return jsonify({'error': 'Document backend unavailable'}), 503
+
+    def _respond(self, entry: _Cached) -> Response:
+        # Revalidated on every use: an unchanged workspace answers 304
+        response = Response(entry.body, content_type='application/json')
+        response.set_etag(entry.etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
+
+    def _workspace(self, customer_id, library_id, workspace_id):
+        def handler(service):
+            entry = service.workspace(customer_id, library_id, workspace_id)
+            if entry is None:
+                raise DocumentError('Workspace not found', 404)
+            return self._respond(entry)
+
+        return self._handle(handler)
+
+    def _document(self, document_id):
+        def handler(service):
+            if request.method == 'GET':
+                entry = service.document(document_id)
+                if entry is None:
+                    raise DocumentError('Document not found', 404)
+                return self._respond(entry)
+
+            version = None
+            if request.if_match and not request.if_match.star_tag:
+                etags = request.if_match.as_set()
+                version = parse_etag_version(document_id, next(iter(etags)))
+            update = parse_update(document_id, request.get_json(silent=True), version)
+            status, document = service.put([update])[0]
+            if status == 404:
+                raise DocumentError('Document not found', 404)
+            if document is not None:
+                document = {k: v for k, v in document.items() if k != 'content'}
+            response = jsonify(document if status == 200 else {'error': 'Version conflict', 'current': document})
+            response.status_code = status
+            response.set_etag(document_etag(document))
+            return response
+
+        return self._handle(handler)
+
+    def _bulk(self):
+        def handler(service):
+            data = request.get_json(silent=True) or {}
+            documents = data.get('documents')
+            if not isinstance(documents, list) or not documents:
+                raise DocumentError('No documents provided')
+
+            # Malformed items get their own 400 and do not fail the batch
+            updates, results = [], [None] * len(documents)
+            for i, body in enumerate(documents):
+                try:
+                    if not isinstance(body, dict) or not body.get('id'):
+                        raise DocumentError('Missing document id')
+                    updates.append((i, parse_update(str(body['id']), body)))
+                except DocumentError as e:
+                    results[i] = {'id': body.get('id') if isinstance(body, dict) else None,
+                                  'status': e.status, 'error': str(e)}
+
+            written = service.sync([update for _, update in updates])
+            for (i, update), (status, document) in zip(updates, written):
+                result = {'id': update.id, 'status': status}
+                if status == 200:
+                    result['version'] = document['version']
+                    result['modifiedDate'] = document.get('modifiedDate')
+                elif status == 412:
+                    result['error'] = 'Version conflict'
+                    result['version'] = document['version']
+                else:
+                    result['error'] = 'Document not found'
+                results[i] = result
+
+            counts = {}
+            for result in results:
+                counts[result['status']] = counts.get(result['status'], 0) + 1
+            return jsonify({
+                'results': results,
+                'synced': counts.get(200, 0),
+                'conflicts': counts.get(412, 0),
+                'failed': len(results) - counts.get(200, 0) - counts.get(412, 0),
+            })
+
+        return self._handle(handler)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_document_service():
+    global _service
+
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                config = load_config()
+                if not config.get('documents', {}).get('enable', True):
+                    return None
+                _service = DocumentService.from_config(config)
+    return _service
+
+
+def document_stats() -> dict:
+    # For /metrics: never opens the backend just to report on it
+    return _service.stats() if _service is not None else {}
@@ -0,0 +1,95 @@
+import os
+import threading
+import time
+
+from flask import Flask
+
+from server.config import CLIENT_DIR, load_config
+
+
+def _route_tables(app) -> list:
+    # Route classes in registration order. Each module stays cheap to
+    # import: the upstream client, SQLite stores and caches behind them are
+    # opened on first use
+    from server.backend import BackendApi
+    from server.blobs import BlobApi
+    from server.conversations import ConversationApi
+    from server.documents import DocumentApi
+    from server.links import LinkApi
+    from server.website import Website
+
+    return [
+        Website(app).routes,
+        BackendApi(app).routes,
+        ConversationApi().routes,
+        DocumentApi().routes,
+        LinkApi().routes,
+        BlobApi().routes,
+    ]
+
+
+def warm_upstream() -> threading.Thread:
+    # Opens the upstream sockets in the background: the first question
+    # finds them ready, while startup itself still never imports `requests`
+    def run():
+        from server.upstream import warm_up
+        warm_up()
+
+    thread = threading.Thread(target=run, name='upstream-warm-up', daemon=True)
+    thread.start()
+    return thread
+
+
+def create_app(started: float = None, warm_up: bool = True) -> Flask:
+    # The one app both entry points serve (api/index.py on Vercel, run.py
+    # locally). `started` is the perf_counter() value the entry point read
+    # before its imports, so the reported cold start includes them.
+    # `warm_up=False` leaves the upstream sockets to the caller (gunicorn
+    # opens them in each worker after the fork)
+    started = time.perf_counter() if started is None else started
+    load_config()
+
+    app = Flask(__name__, template_folder=os.path.join(CLIENT_DIR, 'html'), static_folder=None)
+
+    # Endpoints are named after their route: one view method may serve
+    # several routes (`/chat`, `/chat/`), and view names may repeat across
+    # route classes
+    for routes in _route_tables(app):
+        for route, spec in routes.items():
+            app.add_url_rule(route, endpoint=route, view_func=spec['function'], methods=spec['methods'])
+
+    from server.blobs import blob_stats
+    from server.documents import document_stats
+    from server.metrics import get_metrics
+
+    metrics = get_metrics()
+    metrics.add_collector(
+        'nog_documents', document_stats, 'Cached iManage document backend',
+        counters=('hits', 'misses', 'batches', 'writes'))
+    metrics.add_collector(
+        'nog_blobs', blob_stats, 'Resumable uploads and blob store',
+        counters=('uploads_started', 'uploads_completed', 'uploads_expired', 'deduplicated',
+                  'bytes_received', 'bytes_stored'))
+
+    startup = app.extensions['nog_startup'] = {
+        'seconds': time.perf_counter() - started,
+        'routes': len(list(app.url_map.iter_rules())),
+        'served': False,
+    }
+    metrics.add_collector(
+        'nog_startup', lambda: {'seconds': startup['seconds'], 'routes': startup['routes']},
+        'App factory startup (cold start)')
+    print(f"App ready in {startup['seconds'] * 1000:.1f} ms ({startup['routes']} routes)")
+    if warm_up:
+        warm_upstream()
+
+    @app.after_request
+    def _cold_start(response):
+        # The first response of an instance carries the cold start, so a
+        # slow first page on Vercel can be told apart from a slow upstream
+        if not startup['served']:
+            startup['served'] = True
+            response.headers['X-Cold-Start'] = f"{startup['seconds'] * 1000:.1f}ms"
+        return response
+
+    return app
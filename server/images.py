@@ -0,0 +1,229 @@
+import os
+import re
+import threading
+from io import BytesIO
+
+from server.assets import Asset, accepted_values, get_asset_store
+from server.config import ROOT_DIR, load_config
+
+try:
+    from PIL import Image, features
+except ImportError:
+    Image = None
+
+
+MIMETYPES = {
+    'avif': 'image/avif',
+    'webp': 'image/webp',
+    'png': 'image/png',
+    'jpeg': 'image/jpeg',
+}
+
+# Raster images that get variants; svg, ico and the manifest are served as is
+SOURCE_FORMATS = {'.png': 'png', '.jpg': 'jpeg', '.jpeg': 'jpeg', '.webp': 'webp'}
+
+# libavif encoder speed (0-10): 8 encodes a full-size logo about three times
+# faster than the default 6, for slightly larger files
+AVIF_SPEED = 8
+
+# Width-qualified references in pages, css and js (`/assets/img/x.png?w=96`)
+IMAGE_REF = re.compile(r'/assets/(img/[^\s"\'`()<>?#]+)\?w=(\d+)')
+
+
+class ImageVariants:
+    # Resized and re-encoded copies of client/img. A request gets the
+    # smallest variant at its `w` parameter (rounded up to one of `widths`)
+    # among the `formats` its Accept header lists and the image's own
+    # format. Variants are encoded once, kept in memory and written under
+    # `path` so a restart finds them again; anything not smaller than the
+    # original falls back to it
+    def __init__(self,
+                 assets=None,
+                 path: str = os.path.join(ROOT_DIR, 'data', 'images'),
+                 widths: list = (32, 64, 96, 128, 256, 512, 1024),
+                 formats: list = ('avif', 'webp'),
+                 quality: dict = None,
+                 enable: bool = True
+                 ) -> None:
+        self.assets = assets or get_asset_store()
+        self.path = path
+        self.widths = sorted(widths)
+        self.enable = enable and Image is not None
+        # Only what this Pillow build can encode (AVIF needs Pillow 11.2+)
+        self.formats = [f for f in formats if self.enable and features.check(f)]
+        self.quality = {'avif': 50, 'webp': 80, 'jpeg': 85, **(quality or {})}
+        self._lock = threading.Lock()
+        self._locks = {}
+        self.variants = {}
+        self.encoded = 0
+        self.disk_hits = 0
+        self.failures = 0
+
+    @classmethod
+    def from_config(cls, config: dict, assets=None) -> 'ImageVariants':
+        section = config.get('images', {})
+        return cls(
+            assets=assets,
+            path=os.path.join(ROOT_DIR, section.get('path', 'data/images')),
+            widths=section.get('widths', (32, 64, 96, 128, 256, 512, 1024)),
+            formats=section.get('formats', ('avif', 'webp')),
+            quality=section.get('quality'),
+            enable=section.get('enable', True),
+        )
+
+    @staticmethod
+    def source_format(asset: Asset):
+        return SOURCE_FORMATS.get(os.path.splitext(asset.path)[1].lower())
+
+    def width(self, value):
+        # The smallest configured width covering `value`; None (full size)
+        # when missing, invalid or beyond the largest one
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            return None
+        if value <= 0:
+            return None
+        return next((w for w in self.widths if w >= value), None)
+
+    def select(self, asset: Asset, accept: str, width=None) -> Asset:
+        source = self.source_format(asset)
+        if not self.enable or source is None:
+            return asset
+
+        width = self.width(width)
+        accepted = accepted_values(accept)
+        candidates = [asset if width is None else self._variant(asset, source, width)]
+        candidates += [
+            self._variant(asset, target, width) for target in self.formats
+            if target != source and MIMETYPES[target] in accepted
+        ]
+        # AVIF is usually the smallest, though not for every image and width
+        return min(candidates, key=lambda a: len(a.data))
+
+    def _variant(self, asset: Asset, target: str, width) -> Asset:
+        key = (asset.etag, target, width)
+        variant = self.variants.get(key)
+        if variant is not None:
+            return variant
+
+        # One encoder per variant; other images are not held up meanwhile
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            variant = self.variants.get(key)
+            if variant is None:
+                variant = self.variants[key] = self._load(asset, target, width)
+        with self._lock:
+            self._locks.pop(key, None)
+        return variant
+
+    def _load(self, asset: Asset, target: str, width) -> Asset:
+        stem = os.path.splitext(asset.path)[0]
+        name = f'{asset.etag}-{width or 0}-{self.quality.get(target, 0)}.{target}'
+        path = os.path.join(self.path, asset.etag[:2], name)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            self.disk_hits += 1
+        except OSError:
+            try:
+                data = self._encode(asset.data, target, width)
+                self.encoded += 1
+            except (OSError, ValueError, Image.DecompressionBombError):
+                # Unreadable or unsupported image: the original it is
+                self.failures += 1
+                data = b''
+            self._store(path, data)
+
+        if not data or len(data) >= len(asset.data):
+            return asset
+        return Asset(f'{stem}-{width or 0}.{target}', data)
+
+    def _encode(self, data: bytes, target: str, width) -> bytes:
+        with Image.open(BytesIO(data)) as image:
+            image.load()
+            if image.mode not in ('RGB', 'RGBA', 'L'):
+                # Palette and 1-bit images resample badly, and AVIF/WebP
+                # take RGB(A) anyway
+                image = image.convert('RGBA' if 'transparency' in image.info or 'A' in image.mode else 'RGB')
+            if width and width < image.width:
+                height = max(1, round(image.height * width / image.width))
+                image = image.resize((width, height), Image.LANCZOS)
+            if target == 'jpeg' and image.mode == 'RGBA':
+                image = image.convert('RGB')
+
+            out = BytesIO()
+            if target == 'png':
+                image.save(out, format='PNG', optimize=True)
+            elif target == 'avif':
+                image.save(out, format='AVIF', quality=self.quality.get(target, 50), speed=AVIF_SPEED)
+            else:
+                image.save(out, format=target.upper(), quality=self.quality.get(target, 80))
+            return out.getvalue()
+
+    def _store(self, path: str, data: bytes) -> None:
+        # Best effort: on a read-only disk (Vercel outside /tmp) variants
+        # live in memory only. An empty file records a failed encode
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            partial = f'{path}.{threading.get_ident()}.part'
+            with open(partial, 'wb') as f:
+                f.write(data)
+            os.replace(partial, path)
+        except OSError:
+            pass
+
+    def serve(self, filename: str, headers, width=None):
+        asset, cache_control = self.assets.lookup('img', filename)
+        if asset is None:
+            return None
+        variant = self.select(asset, headers.get('Accept'), width)
+        response = self.assets.response(variant, headers, cache_control=cache_control)
+        if self.enable and self.source_format(asset) is not None:
+            response.vary.add('Accept')
+        return response
+
+    def warm(self, text: str) -> int:
+        # Encodes every width-qualified image `text` references, in each
+        # format a browser may ask for, so first visits find them ready
+        count = 0
+        for key, width in set(IMAGE_REF.findall(text)):
+            asset = self.assets.assets.get(key) or self.assets.hashed.get(key)
+            source = asset is not None and self.source_format(asset)
+            if not self.enable or not source:
+                continue
+            width = self.width(width)
+            for target in {*self.formats, source}:
+                if target != source or width is not None:
+                    self._variant(asset, target, width)
+                    count += 1
+        return count
+
+    def stats(self) -> dict:
+        return {
+            'variants': len(self.variants),
+            'encoded': self.encoded,
+            'disk_hits': self.disk_hits,
+            'failures': self.failures,
+            'formats': len(self.formats),
+        }
+
+
+_variants = None
+_variants_lock = threading.Lock()
+
+
+def get_image_variants() -> ImageVariants:
+    global _variants
+
+    if _variants is None:
+        with _variants_lock:
+            if _variants is None:
+                from server.metrics import get_metrics
+
+                _variants = ImageVariants.from_config(load_config())
+                get_metrics().add_collector(
+                    'nog_images', _variants.stats, 'Responsive image variants',
+                    counters=('encoded', 'disk_hits', 'failures'))
+    return _variants
@@ -0,0 +1,130 @@
+import os
+
+import server.config
+from server.assets import get_asset_store
+from server.bundles import get_bundler
+from server.images import get_image_variants
+from server.pages import get_renderer
+
+
+def _import_gunicorn():
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError as e:
+        raise RuntimeError(
+            "The production WSGI mode needs gunicorn: pip install -r requirements-wsgi.txt"
+        ) from e
+    return BaseApplication
+
+
+class ServerSettings:
+    def __init__(self,
+                 host: str = '0.0.0.0',
+                 port: int = 1338,
+                 workers: int = 0,
+                 threads: int = 32,
+                 keepalive: float = 5,
+                 timeout: float = 60,
+                 graceful_timeout: float = 30,
+                 max_requests: int = 0,
+                 max_requests_jitter: int = 0,
+                 backlog: int = 2048,
+                 preload: bool = True
+                 ) -> None:
+        self.host = host
+        self.port = port
+        # 0: one worker per core
+        self.workers = workers or os.cpu_count() or 1
+        self.threads = threads
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.graceful_timeout = graceful_timeout
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.backlog = backlog
+        self.preload = preload
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'ServerSettings':
+        site = config.get('site_config', {})
+        section = config.get('wsgi', {})
+        return cls(
+            host=site.get('host', '0.0.0.0'),
+            port=site.get('port', 1338),
+            workers=section.get('workers', 0),
+            threads=section.get('threads', 32),
+            keepalive=section.get('keepalive', 5),
+            timeout=section.get('timeout', 60),
+            graceful_timeout=section.get('graceful_timeout', 30),
+            max_requests=section.get('max_requests', 0),
+            max_requests_jitter=section.get('max_requests_jitter', 0),
+            backlog=section.get('backlog', 2048),
+            preload=section.get('preload', True),
+        )
+
+    def options(self) -> dict:
+        # gthread: every SSE stream holds one thread of its worker while the
+        # other threads keep serving, and each yielded chunk is written to
+        # the socket as it comes (chunked encoding, no response buffering)
+        return {
+            'bind': f'{self.host}:{self.port}',
+            'worker_class': 'gthread',
+            'workers': self.workers,
+            'threads': self.threads,
+            'keepalive': self.keepalive,
+            'timeout': self.timeout,
+            'graceful_timeout': self.graceful_timeout,
+            'max_requests': self.max_requests,
+            'max_requests_jitter': self.max_requests_jitter,
+            'backlog': self.backlog,
+            # Each worker builds its own app, so a HUP brings code-free
+            # config changes to every module, not only to the config dict
+            'preload_app': False,
+            'post_fork': _post_fork,
+        }
+
+
+def _post_fork(arbiter, worker) -> None:
+    # Workers read config.json again, so a HUP (graceful reload: new
+    # workers started, old ones finish their streams) applies its changes
+    server.config._config = None
+    # Sockets are per process: each worker opens its own upstream ones
+    from server.factory import warm_upstream
+    warm_upstream()
+
+
+def preload() -> None:
+    # Built by each worker before it takes requests, so the first visits do
+    # not pay for compression, templates, bundles or image encodes. Done in
+    # the master it would be shared by the workers but left stale by a HUP
+    store = get_asset_store()
+    store.compress_all()
+    get_renderer()
+    get_bundler().build_all()
+    # Image variants the pages, css and js ask for (`?w=`), so first visits
+    # do not wait for an encode
+    images = get_image_variants()
+    for asset in list(store.assets.values()):
+        if not asset.path.startswith(('img/', 'vendor/')) and asset.mimetype.startswith(('text/', 'application/javascript')):
+            images.warm(asset.data.decode('utf-8', 'surrogateescape'))
+
+
+def serve(create_app, config: dict) -> None:
+    # `create_app()` builds the Flask app; it runs in every worker, after
+    # the fork
+    BaseApplication = _import_gunicorn()
+    settings = ServerSettings.from_config(config)
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for key, value in settings.options().items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            app = create_app(warm_up=False)
+            if settings.preload:
+                preload()
+            return app
+
+    print(f"Serving with {settings.workers} workers x {settings.threads} threads")
+    Application().run()
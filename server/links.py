@@ -0,0 +1,347 @@
+import importlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from json import dumps, loads
+
+from flask import request, jsonify
+
+from server.config import ROOT_DIR, load_config
+
+
+# Same pattern as getYouTubeID() in chat.js
+YOUTUBE_ID = re.compile(r'(?:youtube\.com/(?:watch\?v=|embed/)|youtu\.be/)([a-zA-Z0-9_-]{11})')
+VIDEO_ID = re.compile(r'^[a-zA-Z0-9_-]{11}$')
+TITLE_PREFIX = re.compile(r'^\d+ - ')
+DONE_MARKER = b'data: [DONE]'
+
+
+def video_id(url) -> str:
+    match = YOUTUBE_ID.search(url) if isinstance(url, str) else None
+    return match.group(1) if match else None
+
+
+def clean_title(title: str) -> str:
+    # The channel numbers its videos ("12 - Le bail commercial")
+    return TITLE_PREFIX.sub('', title)
+
+
+class OEmbedClient:
+    # YouTube has no batch oEmbed: the ids of one answer are looked up
+    # concurrently over a shared keep-alive session
+    URL = 'https://www.youtube.com/oembed'
+
+    def __init__(self, timeout: float = 2.0, workers: int = 16) -> None:
+        # Imported here: the app starts without loading requests
+        import requests
+
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='oembed')
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'OEmbedClient':
+        section = config.get('links', {})
+        return cls(timeout=section.get('timeout', 2.0), workers=section.get('workers', 16))
+
+    def _title(self, video_id: str):
+        from requests import RequestException
+
+        try:
+            r = self.session.get(self.URL, timeout=self.timeout, params={
+                'url': f'https://www.youtube.com/watch?v={video_id}', 'format': 'json',
+            })
+            if r.status_code != 200:
+                return None
+            return r.json().get('title')
+        except (RequestException, ValueError):
+            return None
+
+    def titles(self, video_ids: list) -> dict:
+        return {i: t for i, t in zip(video_ids, self._pool.map(self._title, video_ids)) if t}
+
+
+class StaticClient:
+    # Offline stand-in: titles from a JSON object {video_id: title}
+    def __init__(self, titles: dict) -> None:
+        self._titles = titles
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'StaticClient':
+        path = config.get('links', {}).get('titles')
+        if not path:
+            return cls({})
+        with open(os.path.join(ROOT_DIR, path), 'r') as f:
+            return cls(loads(f.read()))
+
+    def titles(self, video_ids: list) -> dict:
+        return {i: self._titles[i] for i in video_ids if i in self._titles}
+
+
+CLIENTS = {
+    'oembed': OEmbedClient,
+    'static': StaticClient,
+}
+
+
+def load_client(config: dict):
+    # `client` is a name from CLIENTS or "package.module:Class"
+    name = config.get('links', {}).get('client', 'oembed')
+    if name in CLIENTS:
+        return CLIENTS[name].from_config(config)
+    module, _, attribute = name.partition(':')
+    if not attribute:
+        raise ValueError(f"Unknown link client: {name}")
+    return getattr(importlib.import_module(module), attribute).from_config(config)
+
+
+class TitleCache:
+    # Video titles in memory and, if `path` is set, in SQLite so they
+    # survive restarts. Titles hardly ever change: the TTL is long. Ids
+    # without a title (dead link, failed lookup) are kept as None for
+    # `miss_ttl`, so a repeated dead link does not call the client again
+    def __init__(self, path: str = None, ttl: float = 30 * 86400, miss_ttl: float = 600) -> None:
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self._lock = threading.Lock()
+        self._titles = {}
+        self.db = None
+        if path:
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+                self.db.execute('PRAGMA journal_mode=WAL')
+                self.db.execute('CREATE TABLE IF NOT EXISTS titles (id TEXT PRIMARY KEY, title TEXT, expires REAL)')
+            except (sqlite3.Error, OSError) as e:
+                # Read-only deployments (Vercel) keep the titles in memory only
+                print(f"Link title cache kept in memory: {e}")
+                self.db = None
+
+    def get_many(self, video_ids: list) -> dict:
+        now = time.time()
+        found = {}
+        with self._lock:
+            for i in video_ids:
+                entry = self._titles.get(i)
+                if entry is not None and entry[1] >= now:
+                    found[i] = entry[0]
+            missing = [i for i in video_ids if i not in found]
+            if self.db is not None and missing:
+                rows = self.db.execute(
+                    f"SELECT id, title, expires FROM titles WHERE id IN ({','.join('?' * len(missing))}) "
+                    'AND expires >= ?', (*missing, now)
+                ).fetchall()
+                for i, title, expires in rows:
+                    self._titles[i] = (title, expires)
+                    found[i] = title
+        return found
+
+    def put_many(self, titles: dict) -> None:
+        # A None title records a miss
+        if not titles:
+            return
+        now = time.time()
+        rows = [(i, title, now + (self.ttl if title is not None else self.miss_ttl)) for i, title in titles.items()]
+        with self._lock:
+            for i, title, expires in rows:
+                self._titles[i] = (title, expires)
+            if self.db is not None:
+                self.db.executemany('INSERT OR REPLACE INTO titles VALUES (?, ?, ?)', rows)
+
+
+def _links_metadata(chunk: bytes):
+    # First frame of the chunk that carries a non-empty metadata.links.
+    # Answers without sources repeat "links": [] in every event: those
+    # chunks are skipped without parsing
+    if chunk.count(b'"links"') == chunk.count(b'"links": []'):
+        return None
+    for frame in chunk.split(b'\n\n'):
+        if b'"links"' not in frame or not frame.startswith(b'data: {'):
+            continue
+        try:
+            metadata = loads(frame[6:]).get('metadata') or {}
+        except ValueError:
+            continue
+        links = metadata.get('links')
+        if isinstance(links, list) and links:
+            return links, metadata.get('language')
+    return None
+
+
+class LinkResolver:
+    # Titles of the videos an answer links to. The lookup starts as soon as
+    # the links show up in the stream and runs while the answer is relayed;
+    # the titles go out in one extra event right before [DONE]. [DONE] waits
+    # at most `wait` for a lookup still running: past that it goes without
+    # the titles, which the chat then asks /backend-api/v2/links for (by
+    # then cached, the lookup carries on)
+    def __init__(self,
+                 enable: bool = True,
+                 client=None,
+                 cache: TitleCache = None,
+                 wait: float = 0.25,
+                 workers: int = 16
+                 ) -> None:
+        self.enable = enable
+        self.client = client
+        self.cache = cache or TitleCache()
+        self.wait = wait
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='links')
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.lookups = 0
+        self.timeouts = 0
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'LinkResolver':
+        section = config.get('links', {})
+        path = section.get('path', 'data/links.sqlite3')
+        return cls(
+            enable=section.get('enable', True),
+            client=load_client(config),
+            cache=TitleCache(
+                os.path.join(ROOT_DIR, path) if path else None,
+                section.get('ttl', 30 * 86400),
+                section.get('miss_ttl', 600),
+            ),
+            wait=section.get('wait', 0.25),
+            workers=section.get('workers', 16),
+        )
+
+    def titles(self, video_ids: list) -> dict:
+        # One cache read for all the ids, one client call for the misses
+        wanted = list(dict.fromkeys(i for i in video_ids if i))
+        found = self.cache.get_many(wanted)
+        missing = [i for i in wanted if i not in found]
+        with self._lock:
+            self.hits += len(found)
+            self.lookups += len(missing)
+        if missing:
+            resolved = {i: clean_title(t) for i, t in self.client.titles(missing).items()}
+            self.cache.put_many({i: resolved.get(i) for i in missing})
+            found.update(resolved)
+        return {i: t for i, t in found.items() if t is not None}
+
+    def _event(self, links: list, language) -> bytes:
+        titles = self.titles([video_id(link) for link in links])
+        metadata = {
+            'links': links,
+            'language': language,
+            'titles': [titles.get(video_id(link)) for link in links],
+        }
+        return f"data: {dumps({'response': '', 'metadata': metadata})}\n\n".encode('utf-8')
+
+    def _result(self, future) -> bytes:
+        try:
+            return future.result(timeout=self.wait)
+        except FutureTimeout:
+            with self._lock:
+                self.timeouts += 1
+        except Exception as e:
+            print(f"Link title lookup failed: {e}")
+        return b''
+
+    def _insert(self, chunk: bytes, event: bytes) -> bytes:
+        done = chunk.find(DONE_MARKER)
+        return chunk[:done] + event + chunk[done:]
+
+    def enrich(self, events):
+        if not self.enable:
+            return events
+        return self._enrich(events)
+
+    def _enrich(self, events):
+        future, sent = None, False
+        for chunk in events:
+            if future is None and b'"links"' in chunk:
+                found = _links_metadata(chunk)
+                if found is not None:
+                    future = self._pool.submit(self._event, *found)
+            if future is not None and not sent and DONE_MARKER in chunk:
+                chunk = self._insert(chunk, self._result(future))
+                sent = True
+            yield chunk
+        if future is not None and not sent:
+            event = self._result(future)
+            if event:
+                yield event
+
+    def enrich_async(self, events):
+        if not self.enable:
+            return events
+        return self._enrich_async(events)
+
+    async def _enrich_async(self, events):
+        # asyncio is only loaded in the ASGI mode
+        import asyncio
+
+        future, sent = None, False
+        async for chunk in events:
+            if future is None and b'"links"' in chunk:
+                found = _links_metadata(chunk)
+                if found is not None:
+                    future = asyncio.wrap_future(self._pool.submit(self._event, *found))
+            if future is not None and not sent and DONE_MARKER in chunk:
+                chunk = self._insert(chunk, await self._result_async(future))
+                sent = True
+            yield chunk
+        if future is not None and not sent:
+            event = await self._result_async(future)
+            if event:
+                yield event
+
+    async def _result_async(self, future) -> bytes:
+        import asyncio
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.wait)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+        except Exception as e:
+            print(f"Link title lookup failed: {e}")
+        return b''
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'enable': self.enable,
+                'hits': self.hits,
+                'lookups': self.lookups,
+                'timeouts': self.timeouts,
+            }
+
+
+class LinkApi:
+    # Titles for answers stored before the stream carried them, in one call
+    def __init__(self) -> None:
+        self.routes = {
+            '/backend-api/v2/links': {
+                'function': self._titles,
+                'methods': ['GET']
+            },
+        }
+
+    def _titles(self):
+        ids = [i for i in request.args.get('ids', '').split(',') if VIDEO_ID.match(i)][:50]
+        resolver = get_link_resolver()
+        if not resolver.enable:
+            return jsonify({'error': 'Link resolution disabled'}), 404
+        return jsonify({'titles': resolver.titles(ids)})
+
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def get_link_resolver() -> LinkResolver:
+    global _resolver
+
+    if _resolver is None:
+        with _resolver_lock:
+            if _resolver is None:
+                _resolver = LinkResolver.from_config(load_config())
+    return _resolver
@@ -0,0 +1,398 @@
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from server.config import load_config
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+EVENTS_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: tuple = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, '') for n in self.labels)
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key: tuple, value) -> list:
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, value=1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        if not self.labels:
+            self._values[()] = 0
+
+    def inc(self, value=1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def dec(self, value=1, **labels) -> None:
+        self.inc(-value, **labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        # One counter per bucket (non cumulative); the cumulative counts
+        # Prometheus expects are only computed when scraping
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self, key: tuple, state) -> list:
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float('inf'),), counts):
+            cumulative += n
+            le = 'le="' + _format_value(float(bound)) + '"'
+            lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}')
+        lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}')
+        lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {count}')
+        return lines
+
+
+def error_type(exc: BaseException) -> str:
+    # Neither these modules nor the clients are imported before the first
+    # upstream call
+    resilience = sys.modules.get('server.resilience')
+    if resilience is not None and isinstance(exc, resilience.CircuitOpenError):
+        return 'circuit_open'
+
+    relay = sys.modules.get('server.relay')
+    if relay is not None and isinstance(exc, relay.StreamCancelled):
+        return 'cancelled'
+
+    requests = sys.modules.get('requests')
+    if requests is not None:
+        if isinstance(exc, requests.exceptions.Timeout):
+            return 'timeout'
+        if isinstance(exc, requests.exceptions.ConnectionError):
+            return 'connection'
+
+    # httpx is only present in the ASGI mode, never import it from here
+    httpx = sys.modules.get('httpx')
+    if httpx is not None:
+        if isinstance(exc, httpx.TimeoutException):
+            return 'timeout'
+        if isinstance(exc, httpx.TransportError):
+            return 'connection'
+    return 'unexpected'
+
+
+class _UpstreamCall:
+    def __init__(self, metrics) -> None:
+        self.metrics = metrics
+        self.started = time.perf_counter()
+
+    def http_error(self, status: int) -> None:
+        self.metrics.upstream_errors.inc(type='http', status=status)
+
+    def _first_line(self) -> None:
+        self.metrics.upstream_first_line.observe(time.perf_counter() - self.started)
+
+    def lines(self, lines):
+        first = True
+        for line in lines:
+            if first and line:
+                self._first_line()
+                first = False
+            yield line
+
+    async def alines(self, lines):
+        first = True
+        async for line in lines:
+            if first and line:
+                self._first_line()
+                first = False
+            yield line
+
+
+class Metrics:
+    def __init__(self, enable: bool = True) -> None:
+        self.enable = enable
+        self._collectors = {}
+
+        self.upstream_connect = Histogram(
+            'nog_upstream_connect_seconds',
+            'TCP and TLS connect time of new upstream connections')
+        self.upstream_first_line = Histogram(
+            'nog_upstream_first_line_seconds',
+            'Time from sending the question to the first line of the upstream stream')
+        self.upstream_duration = Histogram(
+            'nog_upstream_duration_seconds',
+            'Duration of upstream streams')
+        self.upstream_active = Gauge(
+            'nog_upstream_active_streams',
+            'Upstream streams currently open')
+        self.upstream_errors = Counter(
+            'nog_upstream_errors_total',
+            'Upstream failures by type (timeout, connection, http, unexpected)',
+            labels=('type', 'status'))
+        self.upstream_cancelled = Counter(
+            'nog_upstream_cancelled_total',
+            'Upstream streams closed before their end because no client was reading them')
+
+        self.stream_ttfb = Histogram(
+            'nog_stream_ttfb_seconds',
+            'Time from the conversation request to the first event sent to the client',
+            labels=('cache',))
+        self.stream_duration = Histogram(
+            'nog_stream_duration_seconds',
+            'Duration of conversation streams as seen by the client',
+            labels=('cache',))
+        self.stream_bytes = Histogram(
+            'nog_stream_bytes',
+            'Bytes relayed per conversation stream',
+            labels=('cache',), buckets=BYTES_BUCKETS)
+        self.stream_events = Histogram(
+            'nog_stream_events',
+            'Events relayed per conversation stream',
+            labels=('cache',), buckets=EVENTS_BUCKETS)
+        self.stream_writes = Histogram(
+            'nog_stream_writes',
+            'Writes to the client per conversation stream (events are coalesced)',
+            labels=('cache',), buckets=EVENTS_BUCKETS)
+        self.stream_active = Gauge(
+            'nog_active_streams',
+            'Conversation streams currently relayed to clients')
+        self.stream_cancelled = Counter(
+            'nog_stream_cancelled_total',
+            'Conversation streams the client left before the end, by how it was noticed '
+            '(closed: failed write or closed by the server, disconnect: socket seen closed)',
+            labels=('reason',))
+
+        self.request_duration = Histogram(
+            'nog_http_request_duration_seconds',
+            'Time to produce a response (streams excluded), by route',
+            labels=('route', 'method', 'status'))
+
+        self.metrics = [
+            self.upstream_connect, self.upstream_first_line, self.upstream_duration,
+            self.upstream_active, self.upstream_errors, self.upstream_cancelled,
+            self.stream_ttfb, self.stream_duration, self.stream_bytes, self.stream_events,
+            self.stream_writes, self.stream_active, self.stream_cancelled,
+            self.request_duration,
+        ]
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'Metrics':
+        section = config.get('metrics', {})
+        return cls(enable=section.get('enable', True))
+
+    def add_collector(self, prefix: str, collect, help: str = None, counters: tuple = ()) -> None:
+        # `collect` returns a dict of numbers read at scrape time, e.g. the
+        # counters the pool and the caches already keep; the keys listed in
+        # `counters` only ever grow, the others are gauges. Keyed by prefix:
+        # building the app again replaces the collector instead of adding
+        # a second one (duplicate series)
+        self._collectors[prefix] = (collect, help or prefix.replace('_', ' '), frozenset(counters))
+
+    def observe_connect(self, seconds: float) -> None:
+        if self.enable:
+            self.upstream_connect.observe(seconds)
+
+    @contextmanager
+    def upstream_call(self):
+        # Wraps one upstream request: exceptions are counted by type and
+        # re-raised for the caller to turn into an error event
+        call = _UpstreamCall(self)
+        if not self.enable:
+            yield call
+            return
+
+        self.upstream_active.inc()
+        try:
+            yield call
+        except Exception as e:
+            kind = error_type(e)
+            if kind == 'cancelled':
+                self.upstream_cancelled.inc()
+            else:
+                self.upstream_errors.inc(type=kind)
+            raise
+        except BaseException:
+            # GeneratorExit or asyncio.CancelledError: the stream was dropped
+            self.upstream_cancelled.inc()
+            raise
+        finally:
+            self.upstream_active.dec()
+            self.upstream_duration.observe(time.perf_counter() - call.started)
+
+    def stream_cancel(self, reason: str) -> None:
+        if self.enable:
+            self.stream_cancelled.inc(reason=reason)
+
+    def track_stream(self, events, started: float, cache: str):
+        if not self.enable:
+            return events
+        return self._track(events, started, cache)
+
+    def track_stream_async(self, events, started: float, cache: str):
+        if not self.enable:
+            return events
+        return self._track_async(events, started, cache)
+
+    def _track(self, events, started: float, cache: str):
+        self.stream_active.inc()
+        size = count = writes = 0
+        try:
+            for chunk in events:
+                if not size:
+                    self.stream_ttfb.observe(time.perf_counter() - started, cache=cache)
+                # Chunks are coalesced SSE frames, one frame per blank line
+                count += chunk.count(b'\n\n')
+                size += len(chunk)
+                writes += 1
+                yield chunk
+        except GeneratorExit:
+            # Closed by the server before the end: the client went away
+            self.stream_cancel('closed')
+            raise
+        finally:
+            self._finish(started, cache, size, count, writes)
+
+    async def _track_async(self, events, started: float, cache: str):
+        # asyncio is only loaded in the ASGI mode
+        import asyncio
+
+        self.stream_active.inc()
+        size = count = writes = 0
+        try:
+            async for chunk in events:
+                if not size:
+                    self.stream_ttfb.observe(time.perf_counter() - started, cache=cache)
+                # Chunks are coalesced SSE frames, one frame per blank line
+                count += chunk.count(b'\n\n')
+                size += len(chunk)
+                writes += 1
+                yield chunk
+        except (GeneratorExit, asyncio.CancelledError):
+            self.stream_cancel('closed')
+            raise
+        finally:
+            self._finish(started, cache, size, count, writes)
+
+    def _finish(self, started: float, cache: str, size: int, count: int, writes: int) -> None:
+        self.stream_active.dec()
+        self.stream_duration.observe(time.perf_counter() - started, cache=cache)
+        self.stream_bytes.observe(size, cache=cache)
+        self.stream_events.observe(count, cache=cache)
+        self.stream_writes.observe(writes, cache=cache)
+
+    def instrument_app(self, app) -> None:
+        if not self.enable:
+            return
+
+        from flask import g, request
+
+        @app.before_request
+        def _metrics_start():
+            g.metrics_started = time.perf_counter()
+
+        @app.after_request
+        def _metrics_observe(response):
+            started = g.pop('metrics_started', None)
+            if started is not None:
+                self.request_duration.observe(
+                    time.perf_counter() - started,
+                    route=request.url_rule.rule if request.url_rule else 'unmatched',
+                    method=request.method,
+                    status=response.status_code,
+                )
+            return response
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for prefix, (collect, help, counters) in list(self._collectors.items()):
+            for key, value in collect().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    name = f'{prefix}_{key}'
+                    lines.append(f"# HELP {name} {help}: {key.replace('_', ' ')}")
+                    lines.append(f"# TYPE {name} {'counter' if key in counters else 'gauge'}")
+                    lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def response(self):
+        from flask import Response
+
+        if not self.enable:
+            return Response('Metrics are disabled', status=404)
+        return Response(self.render(), content_type=CONTENT_TYPE)
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> Metrics:
+    global _metrics
+
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = Metrics.from_config(load_config())
+    return _metrics
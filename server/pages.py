@@ -0,0 +1,117 @@
+import os
+import re
+import threading
+import time
+from html import escape
+from os import urandom
+
+from flask import Response
+
+from server.assets import get_asset_store
+from server.bundles import get_bundler
+from server.config import CLIENT_DIR, reload_enabled
+
+
+TEMPLATE_DIR = os.path.join(CLIENT_DIR, 'html')
+PLACEHOLDER = re.compile(r'{{\s*(\w+)\s*}}')
+
+
+def new_chat_id() -> str:
+    return f'{urandom(4).hex()}-{urandom(2).hex()}-{urandom(2).hex()}-{urandom(2).hex()}-{hex(int(time.time() * 1000))[2:]}'
+
+
+class Template:
+    __slots__ = ('name', 'mtime', 'segments')
+
+    def __init__(self, name: str, text: str, mtime: float = 0.0) -> None:
+        self.name = name
+        self.mtime = mtime
+
+        # Alternating static bytes and placeholder names, split once so a
+        # render is a single join
+        self.segments = []
+        position = 0
+        for match in PLACEHOLDER.finditer(text):
+            self.segments.append(text[position:match.start()].encode('utf-8'))
+            self.segments.append(match.group(1))
+            position = match.end()
+        self.segments.append(text[position:].encode('utf-8'))
+
+    def render(self, **context) -> bytes:
+        if len(self.segments) == 1:
+            return self.segments[0]
+
+        parts = []
+        for i, segment in enumerate(self.segments):
+            if i % 2:
+                value = context.get(segment)
+                segment = escape(str(value)).encode('utf-8') if value is not None else b''
+            parts.append(segment)
+        return b''.join(parts)
+
+
+class PageRenderer:
+    def __init__(self, root: str = TEMPLATE_DIR, assets=None, bundler=None, reload: bool = False) -> None:
+        self.root = root
+        self.assets = assets or get_asset_store()
+        self.bundler = bundler or get_bundler()
+        self.reload = reload
+        self._lock = threading.Lock()
+        self.templates = {}
+        for filename in os.listdir(root):
+            if filename.endswith('.html'):
+                self.templates[filename] = self._compile(filename)
+
+    def _compile(self, name: str) -> Template:
+        path = os.path.join(self.root, name)
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        return Template(name, self.assets.rewrite(self.bundler.page(text)), os.path.getmtime(path))
+
+    def _check(self, name: str) -> None:
+        path = os.path.join(self.root, name)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            self.templates.pop(name, None)
+            return
+        template = self.templates.get(name)
+        if template is None or template.mtime != mtime:
+            with self._lock:
+                self.templates[name] = self._compile(name)
+
+    def get(self, name: str):
+        if self.reload:
+            # Assets first: a changed css/js gets a new fingerprint that the
+            # recompiled template must point at
+            if self.assets.refresh():
+                with self._lock:
+                    self.templates.clear()
+            self._check(name)
+        return self.templates.get(name)
+
+    def render(self, name: str, **context):
+        template = self.get(name)
+        if template is None:
+            return None
+        return template.render(**context)
+
+    def response(self, name: str, **context):
+        body = self.render(name, **context)
+        if body is None:
+            return None
+        return Response(body, mimetype='text/html')
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_renderer() -> PageRenderer:
+    global _renderer
+
+    if _renderer is None:
+        with _renderer_lock:
+            if _renderer is None:
+                _renderer = PageRenderer(reload=reload_enabled())
+    return _renderer
@@ -0,0 +1,211 @@
+import re
+import select
+import socket
+import threading
+
+
+LINE_BREAKS = re.compile(rb'[\r\n]+')
+DEFAULT_READ_BYTES = 16384
+
+
+def normalize_frames(data: bytes) -> bytes:
+    # Same framing as the former iter_lines() relay: every non-empty line
+    # becomes one `line\n\n` event. Upstreams that already send `\n\n`
+    # separated frames (the usual case) are forwarded as-is, without a copy
+    if (not data.startswith(b'\n')
+            and b'\r' not in data
+            and b'\n\n\n' not in data
+            and data.count(b'\n') == 2 * data.count(b'\n\n')):
+        return data
+    return LINE_BREAKS.sub(b'\n\n', data.lstrip(b'\r\n'))
+
+
+class FrameSplitter:
+    # Cuts a byte stream at the last line break: complete frames go out
+    # together, the partial line waits for the next read
+    def __init__(self) -> None:
+        self.pending = b''
+
+    def feed(self, data: bytes) -> bytes:
+        if self.pending:
+            data = self.pending + data
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            self.pending = data
+            return b''
+        if end == len(data):
+            self.pending = b''
+        else:
+            self.pending, data = data[end:], data[:end]
+        return normalize_frames(data)
+
+    def flush(self) -> bytes:
+        data, self.pending = self.pending, b''
+        if not data.strip(b'\r\n'):
+            return b''
+        return normalize_frames(data + b'\n')
+
+
+class StreamCancelled(Exception):
+    # Raised from the upstream frames once nobody reads the answer anymore
+    pass
+
+
+def client_socket(environ: dict):
+    # Set by gunicorn and by the werkzeug dev server; None on Vercel
+    return environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+
+
+def _readable(sock) -> bool:
+    if hasattr(select, 'poll'):
+        poller = select.poll()
+        poller.register(sock, select.POLLIN)
+        return bool(poller.poll(0))
+    return bool(select.select([sock], [], [], 0)[0])
+
+
+class ClientWatch:
+    # The client socket of a WSGI stream, looked at while the stream waits
+    # for upstream data: a failed write is only seen at the next event, a
+    # closed socket is seen within `interval` seconds
+    def __init__(self, sock=None, interval: float = 0.25, on_gone=None) -> None:
+        self.sock = sock
+        self.interval = interval
+        self.on_gone = on_gone
+        self._gone = False
+
+    @classmethod
+    def from_environ(cls, environ: dict, interval: float = 0.25, on_gone=None) -> 'ClientWatch':
+        return cls(client_socket(environ), interval, on_gone)
+
+    def gone(self) -> bool:
+        if self._gone or self.sock is None:
+            return self._gone
+        try:
+            # Readable with nothing to read: the client closed its end
+            gone = _readable(self.sock) and self.sock.recv(1, socket.MSG_PEEK) == b''
+        except (BlockingIOError, InterruptedError):
+            return False
+        except ValueError:
+            # TLS sockets refuse MSG_PEEK: nothing to learn from this one
+            self.sock = None
+            return False
+        except OSError:
+            gone = True
+        if gone:
+            self._gone = True
+            if self.on_gone is not None:
+                self.on_gone()
+        return gone
+
+
+class UpstreamAbort:
+    # Cuts the upstream response of a stream nobody reads anymore. abort()
+    # comes from another thread than the one reading the response, so it
+    # only shuts the socket down: the blocked read returns at once, and the
+    # reader closes the response, which gives its slot back to the pool
+    def __init__(self) -> None:
+        self.aborted = False
+        self._socks = []
+        self._lock = threading.Lock()
+
+    def bind(self, response) -> None:
+        # Every response read for the stream: a hedged request has two
+        connection = getattr(getattr(response, 'raw', None), 'connection', None)
+        sock = getattr(connection, 'sock', None)
+        with self._lock:
+            if sock is not None and sock not in self._socks:
+                self._socks.append(sock)
+            aborted = self.aborted
+        if aborted:
+            self._shutdown(sock)
+
+    def abort(self) -> None:
+        with self._lock:
+            if self.aborted:
+                return
+            self.aborted = True
+            socks = list(self._socks)
+        for sock in socks:
+            self._shutdown(sock)
+
+    @staticmethod
+    def _shutdown(sock) -> None:
+        if sock is None:
+            return
+        try:
+            # The plain socket call, leaving the TLS state to the reader
+            socket.socket.shutdown(sock, socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def frames(self, frames):
+        # Whatever the cut read produced (EOF or a read error) ends as
+        # StreamCancelled, not as an upstream failure
+        try:
+            for chunk in frames:
+                if self.aborted:
+                    break
+                yield chunk
+        except Exception:
+            if not self.aborted:
+                raise
+        if self.aborted:
+            raise StreamCancelled('No client is reading this stream')
+
+
+def _read_raw(raw, read_bytes: int):
+    # Chunked answers are read one HTTP chunk at a time; otherwise read1()
+    # returns as soon as some bytes are there. Either way the first event is
+    # not held back waiting for a full buffer
+    if raw.chunked and raw.supports_chunked_reads():
+        yield from raw.read_chunked(decode_content=True)
+        return
+    while True:
+        data = raw.read1(read_bytes, decode_content=True)
+        if not data:
+            return
+        yield data
+
+
+def iter_frames(response, read_bytes: int = DEFAULT_READ_BYTES):
+    splitter = FrameSplitter()
+    for data in _read_raw(response.raw, read_bytes):
+        frames = splitter.feed(data)
+        if frames:
+            yield frames
+    frames = splitter.flush()
+    if frames:
+        yield frames
+
+
+async def aiter_frames(response):
+    splitter = FrameSplitter()
+    async for data in response.aiter_bytes():
+        frames = splitter.feed(data)
+        if frames:
+            yield frames
+    frames = splitter.flush()
+    if frames:
+        yield frames
+
+
+class FlushPolicy:
+    # Writes to the client are coalesced: a batch goes out `max_delay`
+    # seconds after the previous write, or right away once `max_bytes` are
+    # pending. The first write of a stream is never delayed
+    def __init__(self, max_bytes: int = 16384, max_delay: float = 0.02) -> None:
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'FlushPolicy':
+        section = config.get('relay', {})
+        return cls(
+            max_bytes=section.get('flush_bytes', 16384),
+            max_delay=section.get('flush_ms', 20) / 1000,
+        )
+
+    @property
+    def enable(self) -> bool:
+        return self.max_delay > 0
@@ -0,0 +1,524 @@
+import asyncio
+import queue
+import random
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from server.config import load_config
+from server.relay import StreamCancelled
+
+
+# Answers that carry no body yet and are worth asking again
+RETRY_STATUSES = (502, 503, 504)
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, retry_after: float) -> None:
+        super().__init__('Upstream circuit open')
+        self.retry_after = retry_after
+
+
+def is_connect_error(exc: BaseException) -> bool:
+    # Failures before the request reached the upstream: safe to send again.
+    # Neither client is imported from here: only the one in use is loaded
+    requests = sys.modules.get('requests')
+    if requests is not None:
+        if isinstance(exc, requests.exceptions.ConnectTimeout):
+            return True
+        if isinstance(exc, requests.exceptions.ConnectionError):
+            # Only a connection that never opened (refused, unresolvable
+            # host); an aborted or dropped one may have carried the request
+            reason = exc.args[0] if exc.args else None
+            reason = getattr(reason, 'reason', reason)
+            urllib3 = sys.modules.get('urllib3')
+            return urllib3 is not None and isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+    httpx = sys.modules.get('httpx')
+    if httpx is not None:
+        return isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+    return False
+
+
+class CircuitBreaker:
+    # Opens after `failures` consecutive failures; after `reset_timeout`
+    # seconds one probe request is let through (half-open) and its outcome
+    # closes or re-opens the circuit
+    def __init__(self, failures: int = 5, reset_timeout: float = 30.0) -> None:
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.consecutive = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.opens = 0
+        self.rejected = 0
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def available(self) -> bool:
+        # Read-only check, for callers that want to answer 503 up front
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                return self.retry_after() == 0
+            return not self.probing
+
+    def allow(self) -> None:
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and self.retry_after() == 0:
+                self.state = HALF_OPEN
+                self.probing = False
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True
+                return
+            self.rejected += 1
+            raise CircuitOpenError(self.retry_after() or self.reset_timeout)
+
+    def success(self) -> None:
+        with self._lock:
+            self.consecutive = 0
+            self.state = CLOSED
+            self.probing = False
+
+    def abandon(self) -> None:
+        # A probe that ended without a verdict (client gone before the
+        # first byte): the next request may probe instead
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.probing = False
+
+    def failure(self) -> None:
+        with self._lock:
+            self.consecutive += 1
+            if self.state == HALF_OPEN or self.consecutive >= self.failures:
+                if self.state != OPEN:
+                    self.opens += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive,
+                'opens': self.opens,
+                'rejected': self.rejected,
+                'retry_after': round(self.retry_after(), 3) if self.state == OPEN else 0,
+            }
+
+
+class LatencyWindow:
+    # Time to the first upstream frame over the last `size` streams, for
+    # the hedging threshold
+    def __init__(self, size: int = 200) -> None:
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=size)
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float, min_samples: int):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            values = sorted(self._samples)
+        return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class _Opened:
+    # The upstream answer that won, with the frame it may already have read
+    def __init__(self, response, frames, first=None) -> None:
+        self.response = response
+        self.status_code = response.status_code
+        self._frames = frames
+        self._first = first
+        # Called once, with the first frame read (see Resilience._verdict)
+        self.on_first = None
+
+    def _got_first(self) -> None:
+        on_first, self.on_first = self.on_first, None
+        if on_first is not None:
+            on_first()
+
+    def frames(self):
+        if self._first:
+            yield self._first
+        for frames in self._frames:
+            if frames:
+                self._got_first()
+            yield frames
+
+    async def aframes(self):
+        if self._first:
+            yield self._first
+        async for frames in self._frames:
+            if frames:
+                self._got_first()
+            yield frames
+
+
+class Resilience:
+    def __init__(self,
+                 enable: bool = True,
+                 retries: int = 2,
+                 backoff_base: float = 0.1,
+                 backoff_max: float = 1.0,
+                 hedge: bool = False,
+                 hedge_percentile: float = 95,
+                 hedge_min_delay: float = 1.0,
+                 hedge_min_samples: int = 20,
+                 breaker_failures: int = 5,
+                 breaker_reset: float = 30.0
+                 ) -> None:
+        self.enable = enable
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = CircuitBreaker(breaker_failures, breaker_reset)
+        self.latency = LatencyWindow()
+        self._lock = threading.Lock()
+        self.retried = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'Resilience':
+        section = config.get('resilience', {})
+        return cls(
+            enable=section.get('enable', True),
+            retries=section.get('retries', 2),
+            backoff_base=section.get('backoff_base', 0.1),
+            backoff_max=section.get('backoff_max', 1.0),
+            hedge=section.get('hedge', False),
+            hedge_percentile=section.get('hedge_percentile', 95),
+            hedge_min_delay=section.get('hedge_min_delay', 1.0),
+            hedge_min_samples=section.get('hedge_min_samples', 20),
+            breaker_failures=section.get('breaker_failures', 5),
+            breaker_reset=section.get('breaker_reset', 30.0),
+        )
+
+    def _incr(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def backoff(self, attempt: int) -> float:
+        # Full jitter: retries from many workers do not land together
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def hedge_delay(self):
+        if not self.hedge or self.breaker.state != CLOSED:
+            return None
+        threshold = self.latency.percentile(self.hedge_percentile, self.hedge_min_samples)
+        return None if threshold is None else max(threshold, self.hedge_min_delay)
+
+    def available(self) -> bool:
+        return not self.enable or self.breaker.available()
+
+    # ---- blocking clients (requests) ----
+
+    def _send(self, send):
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                response = send()
+            except Exception as e:
+                if last or not is_connect_error(e):
+                    raise
+            else:
+                if last or response.status_code not in RETRY_STATUSES:
+                    return response
+                response.close()
+            self._incr('retried')
+            time.sleep(self.backoff(attempt))
+
+    def _attempt(self, send, frames, started: float, abort=None):
+        response = self._send(send)
+        try:
+            # The first frame is read here, in the hedging thread: under
+            # `abort` so that the client leaving cuts this read too, and a
+            # cut read ends as StreamCancelled rather than as a failure
+            iterator = frames(response)
+            if abort is not None:
+                abort.bind(response)
+                iterator = abort.frames(iterator)
+            first = next(iterator, b'') if response.status_code < 400 else b''
+        except BaseException:
+            response.close()
+            raise
+        if first:
+            self.latency.observe(time.perf_counter() - started)
+        return _Opened(response, iterator, first)
+
+    def _open(self, send, frames, abort=None) -> _Opened:
+        started = time.perf_counter()
+        delay = self.hedge_delay()
+        if delay is None:
+            response = self._send(send)
+            if abort is not None:
+                abort.bind(response)
+            return _Opened(response, self._timed(frames(response), started))
+
+        # Hedging: if the first frame is later than the usual p95, a second
+        # request is sent and whichever answers first is relayed
+        results = queue.Queue()
+        lock = threading.Lock()
+        state = {'winner': None, 'pending': 1}
+
+        def run(hedge: bool):
+            try:
+                outcome = (hedge, self._attempt(send, frames, time.perf_counter(), abort), None)
+            except Exception as e:
+                outcome = (hedge, None, e)
+            with lock:
+                state['pending'] -= 1
+                if state['winner'] is None and (outcome[1] is not None or state['pending'] == 0):
+                    state['winner'] = outcome
+                    results.put(outcome)
+                    return
+            if outcome[1] is not None:
+                outcome[1].response.close()
+
+        threading.Thread(target=run, args=(False,), daemon=True).start()
+        try:
+            hedge, opened, error = results.get(timeout=delay)
+        except queue.Empty:
+            with lock:
+                if state['winner'] is None:
+                    state['pending'] += 1
+                    self._incr('hedged')
+                    threading.Thread(target=run, args=(True,), daemon=True).start()
+            hedge, opened, error = results.get()
+        if error is not None:
+            raise error
+        if hedge:
+            self._incr('hedge_wins')
+        return opened
+
+    def _timed(self, frames, started: float):
+        first = True
+        for chunk in frames:
+            if first and chunk:
+                self.latency.observe(time.perf_counter() - started)
+                first = False
+            yield chunk
+
+    def _verdict(self, opened) -> dict:
+        # The breaker hears about each stream once: a 5xx or an error before
+        # the first byte is a failure, the first byte (or a 4xx) a success.
+        # What happens later in the body (client gone, reset mid-answer)
+        # says nothing about whether the upstream is up
+        judged = {'done': False}
+
+        def judge(ok: bool) -> None:
+            if judged['done']:
+                return
+            judged['done'] = True
+            if ok:
+                self.breaker.success()
+            else:
+                self.breaker.failure()
+
+        if opened is not None:
+            if opened.status_code >= 500:
+                judge(False)
+            elif opened.status_code >= 400 or opened._first:
+                judge(True)
+            else:
+                opened.on_first = lambda: judge(True)
+        return judged, judge
+
+    @contextmanager
+    def stream(self, send, frames, abort=None):
+        # `send()` opens one upstream response, `frames(response)` iterates
+        # it. Yields an object with `status_code` and `frames()`. `abort`
+        # (UpstreamAbort) is bound to every response opened for the stream
+        if not self.enable:
+            response = send()
+            if abort is not None:
+                abort.bind(response)
+            try:
+                yield _Opened(response, frames(response))
+            finally:
+                response.close()
+            return
+
+        self.breaker.allow()
+        opened = None
+        judged, judge = self._verdict(None)
+        try:
+            opened = self._open(send, frames, abort)
+            judged, judge = self._verdict(opened)
+            yield opened
+        except StreamCancelled:
+            # Cut by us because the client left, not an upstream failure
+            raise
+        except Exception:
+            judge(False)
+            raise
+        finally:
+            if not judged['done']:
+                self.breaker.abandon()
+            if opened is not None:
+                opened.response.close()
+
+    # ---- asyncio clients (httpx) ----
+
+    async def _asend(self, send):
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                response = await send()
+            except Exception as e:
+                if last or not is_connect_error(e):
+                    raise
+            else:
+                if last or response.status_code not in RETRY_STATUSES:
+                    return response
+                await response.aclose()
+            self._incr('retried')
+            await asyncio.sleep(self.backoff(attempt))
+
+    async def _aattempt(self, send, frames, started: float):
+        response = await self._asend(send)
+        try:
+            iterator = frames(response).__aiter__()
+            first = b''
+            if response.status_code < 400:
+                try:
+                    first = await iterator.__anext__()
+                except StopAsyncIteration:
+                    pass
+        except BaseException:
+            await response.aclose()
+            raise
+        if first:
+            self.latency.observe(time.perf_counter() - started)
+        return _Opened(response, iterator, first)
+
+    async def _aopen(self, send, frames) -> _Opened:
+        delay = self.hedge_delay()
+        if delay is None:
+            response = await self._asend(send)
+            return _Opened(response, self._atimed(frames(response), time.perf_counter()))
+
+        tasks = {asyncio.ensure_future(self._aattempt(send, frames, time.perf_counter())): False}
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            self._incr('hedged')
+            tasks[asyncio.ensure_future(self._aattempt(send, frames, time.perf_counter()))] = True
+
+        winner, error = None, None
+        pending = set(tasks)
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = error or task.exception()
+                elif winner is None:
+                    winner = task
+                else:
+                    await task.result().response.aclose()
+        for task in pending:
+            task.cancel()
+            try:
+                await task
+            except BaseException:
+                pass
+            else:
+                await task.result().response.aclose()
+
+        if winner is None:
+            raise error
+        if tasks[winner]:
+            self._incr('hedge_wins')
+        return winner.result()
+
+    async def _atimed(self, frames, started: float):
+        first = True
+        async for chunk in frames:
+            if first and chunk:
+                self.latency.observe(time.perf_counter() - started)
+                first = False
+            yield chunk
+
+    @asynccontextmanager
+    async def astream(self, send, frames):
+        if not self.enable:
+            response = await send()
+            try:
+                yield _Opened(response, frames(response))
+            finally:
+                await response.aclose()
+            return
+
+        self.breaker.allow()
+        opened = None
+        judged, judge = self._verdict(None)
+        try:
+            opened = await self._aopen(send, frames)
+            judged, judge = self._verdict(opened)
+            yield opened
+        except StreamCancelled:
+            raise
+        except Exception:
+            judge(False)
+            raise
+        finally:
+            if not judged['done']:
+                self.breaker.abandon()
+            if opened is not None:
+                await opened.response.aclose()
+
+    def stats(self) -> dict:
+        breaker = self.breaker.snapshot()
+        with self._lock:
+            return {
+                'enable': self.enable,
+                'breaker': breaker,
+                'retries': self.retried,
+                'hedges': self.hedged,
+                'hedge_wins': self.hedge_wins,
+            }
+
+    def metrics(self) -> dict:
+        # Flat numbers for the /metrics collector
+        stats = self.stats()
+        breaker = stats.pop('breaker')
+        return {
+            **stats,
+            'breaker_state': STATE_CODES[breaker['state']],
+            'breaker_opens': breaker['opens'],
+            'breaker_rejected': breaker['rejected'],
+            'breaker_consecutive_failures': breaker['consecutive_failures'],
+        }
+
+
+_resilience = None
+_resilience_lock = threading.Lock()
+
+
+def get_resilience() -> Resilience:
+    global _resilience
+
+    if _resilience is None:
+        with _resilience_lock:
+            if _resilience is None:
+                _resilience = Resilience.from_config(load_config())
+    return _resilience
@@ -0,0 +1,323 @@
+import asyncio
+import threading
+import time
+from itertools import islice
+
+from server.config import load_config
+from server.relay import FlushPolicy
+
+
+class _Buffer:
+    # Events of one upstream stream, shared by every subscriber. The whole
+    # answer is kept while it fits in `max_bytes` so late joiners can replay
+    # it; past that the flight is sealed and the consumed prefix is dropped
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.events = []
+        self.base = 0
+        self.size = 0
+        self.done = False
+        self.sealed = False
+        self.cursors = {}
+        self.subscribed = 0
+        # Stops the upstream stream when the last subscriber leaves
+        self.abort = None
+
+    @property
+    def end(self) -> int:
+        return self.base + len(self.events)
+
+    def joinable(self) -> bool:
+        return not (self.done or self.sealed or self.abandoned())
+
+    def attach(self, token) -> None:
+        self.cursors[token] = self.base
+        self.subscribed += 1
+
+    def detach(self, token) -> None:
+        self.cursors.pop(token, None)
+        self._trim()
+
+    def abandoned(self) -> bool:
+        return self.subscribed > 0 and not self.cursors
+
+    def append(self, event) -> None:
+        self.events.append(event)
+        self.size += len(event)
+        if self.size > self.max_bytes:
+            self.sealed = True
+            self._trim()
+
+    def take(self, token) -> list:
+        batch = self.events[self.cursors[token] - self.base:]
+        self.cursors[token] = self.end
+        self._trim()
+        return batch
+
+    def pending(self, token) -> bool:
+        return self.cursors[token] < self.end
+
+    def pending_bytes(self, token) -> int:
+        return sum(len(e) for e in islice(self.events, self.cursors[token] - self.base, None))
+
+    def _trim(self) -> None:
+        if not self.sealed:
+            return
+        low = min(self.cursors.values(), default=self.end)
+        dropped = self.events[:low - self.base]
+        if dropped:
+            del self.events[:low - self.base]
+            self.base = low
+            self.size -= sum(len(e) for e in dropped)
+
+
+def _join(batch: list) -> bytes:
+    return batch[0] if len(batch) == 1 else b''.join(batch)
+
+
+class SingleFlight:
+    def __init__(self,
+                 enable: bool = True,
+                 max_buffer_bytes: int = 1024 * 1024,
+                 policy: FlushPolicy = None
+                 ) -> None:
+        self.enable = enable
+        self.max_buffer_bytes = max_buffer_bytes
+        self.policy = policy or FlushPolicy()
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.leaders = 0
+        self.followers = 0
+        self.aborted = 0
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'SingleFlight':
+        section = config.get('single_flight', {})
+        return cls(
+            enable=section.get('enable', True),
+            max_buffer_bytes=section.get('max_buffer_bytes', 1024 * 1024),
+            policy=FlushPolicy.from_config(config),
+        )
+
+    def stream(self, key: str, source, abort=None, watch=None):
+        # Returns (events, role). `source` is only consumed when this request
+        # leads the flight; followers drop it before it ever starts. `abort`
+        # (UpstreamAbort) cuts `source` once every subscriber has left;
+        # `watch` (ClientWatch) ends this subscriber when its client is gone
+        if not self.enable and not self.policy.enable:
+            return source, 'off'
+
+        token = object()
+        with self._lock:
+            flight = self._flights.get(key)
+            role = None
+            if not self.enable:
+                # Not shared, only relayed through a buffer so that writes
+                # to the client can be coalesced
+                flight = _Flight(0)
+                role = 'off'
+            elif flight is not None:
+                # Checked with the attach so a flight cannot be joined
+                # between its last subscriber leaving and its abort
+                with flight.cond:
+                    if flight.joinable():
+                        flight.attach(token)
+                        self.followers += 1
+                        role = 'follower'
+            if role is None:
+                flight = _Flight(self.max_buffer_bytes)
+                self._flights[key] = flight
+                self.leaders += 1
+                role = 'leader'
+            if role != 'follower':
+                flight.abort = abort
+                with flight.cond:
+                    flight.attach(token)
+
+        if role == 'follower':
+            source.close()
+        else:
+            threading.Thread(target=self._pump, args=(key, flight, source), daemon=True).start()
+        return self._subscribe(flight, token, watch), role
+
+    def _pump(self, key: str, flight, source) -> None:
+        try:
+            for event in source:
+                with flight.cond:
+                    flight.append(event)
+                    flight.cond.notify_all()
+                    if flight.abandoned():
+                        break
+        finally:
+            # Closing the source closes the upstream response when every
+            # subscriber is gone before the end of the answer
+            source.close()
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+
+    def _subscribe(self, flight, token, watch=None):
+        # Everything pending is written at once; after a write, the next one
+        # waits `policy.max_delay` unless `policy.max_bytes` are already there
+        policy = self.policy
+        interval = watch.interval if watch is not None and watch.sock is not None and watch.interval > 0 else None
+        written = None
+        try:
+            while True:
+                if written is not None and policy.enable:
+                    # Sleeping instead of waiting on the condition spares a
+                    # wake-up per event while the batch fills up
+                    remaining = written + policy.max_delay - time.monotonic()
+                    if remaining > 0:
+                        with flight.cond:
+                            full = flight.done or flight.pending_bytes(token) >= policy.max_bytes
+                        if not full:
+                            time.sleep(remaining)
+                with flight.cond:
+                    while not flight.pending(token) and not flight.done:
+                        # Silent upstream: look at the client in the meantime
+                        if not flight.cond.wait(interval) and watch.gone():
+                            return
+                    batch = flight.take(token)
+                    finished = flight.done and not flight.pending(token)
+                if batch:
+                    yield _join(batch)
+                    written = time.monotonic()
+                if finished:
+                    return
+        finally:
+            with flight.cond:
+                flight.detach(token)
+                abandoned = flight.abandoned() and not flight.done
+            if abandoned and flight.abort is not None:
+                # Last reader gone: cut the upstream now, not at its next event
+                with self._lock:
+                    self.aborted += 1
+                flight.abort.abort()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'enable': self.enable,
+                'in_flight': len(self._flights),
+                'leaders': self.leaders,
+                'followers': self.followers,
+                'aborted': self.aborted,
+            }
+
+
+class _Flight(_Buffer):
+    def __init__(self, max_bytes: int) -> None:
+        super().__init__(max_bytes)
+        self.cond = threading.Condition()
+
+
+class _AsyncFlight(_Buffer):
+    def __init__(self, max_bytes: int) -> None:
+        super().__init__(max_bytes)
+        self.changed = asyncio.Event()
+
+    def notify(self) -> None:
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class AsyncSingleFlight(SingleFlight):
+    # Same coalescing for the ASGI mode: everything runs on one event loop,
+    # so the buffer needs no lock, only a wake-up for waiting subscribers
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._tasks = set()
+
+    def stream(self, key: str, source):
+        if not self.enable and not self.policy.enable:
+            return source, 'off'
+
+        flight = self._flights.get(key)
+        if not self.enable:
+            flight = _AsyncFlight(0)
+            role = 'off'
+        elif flight is not None and flight.joinable():
+            self.followers += 1
+            role = 'follower'
+        else:
+            flight = self._flights[key] = _AsyncFlight(self.max_buffer_bytes)
+            self.leaders += 1
+            role = 'leader'
+        token = object()
+        flight.attach(token)
+
+        if role != 'follower':
+            task = asyncio.ensure_future(self._pump(key, flight, source))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            # Cancelling the pump cancels the upstream read it waits on
+            flight.abort = task
+        return self._subscribe(flight, token), role
+
+    async def _pump(self, key: str, flight, source) -> None:
+        try:
+            async for event in source:
+                flight.append(event)
+                flight.notify()
+                if flight.abandoned():
+                    break
+        finally:
+            await source.aclose()
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.done = True
+            flight.notify()
+
+    async def _subscribe(self, flight, token):
+        policy = self.policy
+        written = None
+        try:
+            while True:
+                if written is not None and policy.enable:
+                    remaining = written + policy.max_delay - time.monotonic()
+                    full = flight.done or flight.pending_bytes(token) >= policy.max_bytes
+                    if remaining > 0 and not full:
+                        await asyncio.sleep(remaining)
+                    written = None
+                if not flight.pending(token) and not flight.done:
+                    await flight.changed.wait()
+                    continue
+                batch = flight.take(token)
+                finished = flight.done and not flight.pending(token)
+                if batch:
+                    yield _join(batch)
+                    written = time.monotonic()
+                if finished:
+                    return
+        finally:
+            flight.detach(token)
+            if flight.abandoned() and not flight.done and flight.abort is not None:
+                self.aborted += 1
+                flight.abort.cancel()
+
+
+_flights = None
+_async_flights = None
+_flights_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    global _flights
+
+    if _flights is None:
+        with _flights_lock:
+            if _flights is None:
+                _flights = SingleFlight.from_config(load_config())
+    return _flights
+
+
+def get_async_single_flight() -> AsyncSingleFlight:
+    global _async_flights
+
+    if _async_flights is None:
+        _async_flights = AsyncSingleFlight.from_config(load_config())
+    return _async_flights
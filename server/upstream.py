@@ -0,0 +1,260 @@
+import os
+import threading
+import time
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.poolmanager import PoolManager
+
+from server.balancer import UpstreamRegistry, get_registry, proxy_settings
+from server.config import load_config
+from server.metrics import get_metrics
+
+
+DEFAULT_HEADERS = {
+    "Content-Type": "application/json",
+    'cache-control': 'no-cache',
+    'Connection': 'keep-alive'
+}
+
+
+class PoolStats:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.checkouts = 0
+        self.new_connections = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def incr(self, name: str, value=1) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'hits': max(self.checkouts - self.new_connections, 0),
+                'new_connections': self.new_connections,
+                'waits': self.waits,
+                'wait_seconds': round(self.wait_seconds, 6),
+            }
+
+
+class _TimedConnectionMixin:
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        get_metrics().observe_connect(time.perf_counter() - started)
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _StatsPoolMixin:
+    stats = None
+
+    def _get_conn(self, timeout=None):
+        # The queue is pre-filled with `maxsize` slots: an empty queue means
+        # every socket is checked out and this request has to wait for one
+        if self.stats is None:
+            return super()._get_conn(timeout=timeout)
+
+        self.stats.incr('checkouts')
+        if self.pool is not None and self.pool.empty():
+            started = time.perf_counter()
+            self.stats.incr('waits')
+            try:
+                return super()._get_conn(timeout=timeout)
+            finally:
+                self.stats.incr('wait_seconds', time.perf_counter() - started)
+        return super()._get_conn(timeout=timeout)
+
+    def _new_conn(self):
+        if self.stats is not None:
+            self.stats.incr('new_connections')
+        return super()._new_conn()
+
+
+class _StatsHTTPConnectionPool(_StatsPoolMixin, HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _StatsHTTPSConnectionPool(_StatsPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _StatsPoolManager(PoolManager):
+    def __init__(self, *args, stats=None, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.stats = stats
+        self.pool_classes_by_scheme = {
+            'http': _StatsHTTPConnectionPool,
+            'https': _StatsHTTPSConnectionPool,
+        }
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        pool = super()._new_pool(scheme, host, port, request_context=request_context)
+        pool.stats = self.stats
+        return pool
+
+
+class PooledAdapter(HTTPAdapter):
+    def __init__(self, stats: PoolStats, **kwargs) -> None:
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = _StatsPoolManager(
+            num_pools=connections,
+            maxsize=maxsize,
+            block=block,
+            stats=self.stats,
+            **pool_kwargs,
+        )
+
+
+class UpstreamClient:
+    def __init__(self,
+                 registry: UpstreamRegistry,
+                 pool_connections: int = 4,
+                 pool_maxsize: int = 32,
+                 pool_block: bool = True,
+                 connect_timeout: float = 5.0,
+                 read_timeout: float = 30.0,
+                 warmup_connections: int = 0,
+                 health_path: str = '/',
+                 proxies: dict = None
+                 ) -> None:
+        self.registry = registry
+        self.timeout = (connect_timeout, read_timeout)
+        self.warmup_connections = warmup_connections
+        self.health_path = health_path
+        self.proxies = proxies
+        self.stats = PoolStats()
+
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        if proxies:
+            self.session.proxies.update(proxies)
+        adapter = PooledAdapter(
+            self.stats,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'UpstreamClient':
+        section = config.get('upstream', {})
+        registry = get_registry()
+        return cls(
+            registry=registry,
+            # One connection pool per backend host
+            pool_connections=max(section.get('pool_connections', 4), len(registry.backends)),
+            pool_maxsize=section.get('pool_maxsize', 32),
+            pool_block=section.get('pool_block', True),
+            connect_timeout=section.get('connect_timeout', 5.0),
+            read_timeout=section.get('read_timeout', 30.0),
+            warmup_connections=section.get('warmup_connections', 0),
+            health_path=section.get('health_path', '/'),
+            proxies=proxy_settings(config),
+        )
+
+    def stream(self, payload: dict, timeout=None) -> requests.Response:
+        # Each call (first try, retry or hedge) goes to the backend the
+        # registry picks; the backend's stream count drops when the
+        # response is closed
+        self.stats.incr('requests')
+        lease = self.registry.acquire()
+        try:
+            response = self.session.post(
+                lease.url,
+                json=payload,
+                stream=True,
+                timeout=timeout or self.timeout,
+            )
+        except Exception:
+            lease.fail()
+            raise
+        lease.headers(response.status_code)
+        return lease.wrap(response)
+
+    def warm_up(self, connections: int = None, background: bool = True):
+        # Open TCP+TLS sockets ahead of time so the first question does not
+        # pay for the handshake. The stream endpoint only takes POST: the
+        # HEAD goes to `health_path` on the same host, its answer is irrelevant
+        count = self.warmup_connections if connections is None else connections
+        if count <= 0:
+            return []
+
+        def _open(url):
+            try:
+                self.session.head(url, timeout=(self.timeout[0], self.timeout[0])).close()
+            except requests.exceptions.RequestException as e:
+                print(f"Upstream warm-up failed ({url}): {e}")
+
+        # `count` sockets to every backend
+        threads = [
+            threading.Thread(target=_open, args=(urljoin(url, self.health_path),), daemon=True)
+            for url in self.registry.urls for _ in range(count)
+        ]
+        for thread in threads:
+            thread.start()
+        if not background:
+            for thread in threads:
+                thread.join()
+        return threads
+
+    def pool_stats(self) -> dict:
+        return {
+            'backends': self.registry.snapshot(),
+            'proxy': bool(self.proxies),
+            'connect_timeout': self.timeout[0],
+            'read_timeout': self.timeout[1],
+            **self.stats.snapshot(),
+        }
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> UpstreamClient:
+    # One pool per process: sockets inherited across a fork cannot be
+    # shared, so the client is rebuilt in the child
+    global _client, _client_pid
+
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            _client = UpstreamClient.from_config(load_config())
+            _client_pid = pid
+    return _client
+
+
+def warm_up() -> None:
+    # Run off the startup path (app factory, gunicorn post_fork): builds
+    # this process's client and opens its sockets before the first question
+    get_client().warm_up(background=False)
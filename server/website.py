@@ -1,14 +1,28 @@
-from flask import render_template, send_file, redirect
-from time import time
-from os import urandom
+import os
+import sys
+from importlib.metadata import version
+
+from flask import redirect, request
+
+from server.assets import get_asset_store
+from server.bundles import get_bundler
+from server.config import CLIENT_DIR, ROOT_DIR
+from server.pages import get_renderer, new_chat_id
 
 
 class Website:
     def __init__(self, app) -> None:
         self.app = app
+        self.assets = get_asset_store()
+        self.bundles = get_bundler()
+        self.pages = get_renderer()
         self.routes = {
             '/': {
-                'function': lambda: redirect('/chat'),
+                'function': self._index,
+                'methods': ['GET', 'POST']
+            },
+            '/chat': {
+                'function': self._index,
                 'methods': ['GET', 'POST']
             },
             '/chat/': {
@@ -19,14 +33,22 @@ class Website:
                 'function': self._chat,
                 'methods': ['GET', 'POST']
             },
-            '/assets/<folder>/<file>': {
+            '/assets/<folder>/<path:file>': {
                 'function': self._assets,
                 'methods': ['GET', 'POST']
             },
+            '/onboarding': {
+                'function': self._onboarding,
+                'methods': ['GET']
+            },
             '/onboarding/': {
                 'function': self._onboarding,
                 'methods': ['GET']
             },
+            '/workspace': {
+                'function': self._workspace,
+                'methods': ['GET']
+            },
             '/workspace/': {
                 'function': self._workspace,
                 'methods': ['GET']
@@ -35,38 +57,136 @@ class Website:
                 'function': self._links,
                 'methods': ['GET']
             },
+            '/links': {
+                'function': self._links_page,
+                'methods': ['GET']
+            },
+            '/links/': {
+                'function': self._links_page,
+                'methods': ['GET']
+            },
+            '/links/<path:subpath>': {
+                'function': self._links_page,
+                'methods': ['GET']
+            },
+            '/test': {
+                'function': self._test,
+                'methods': ['GET']
+            },
+            '/debug': {
+                'function': self._debug,
+                'methods': ['GET']
+            },
         }
 
+    def _page(self, name: str, **context):
+        response = self.pages.response(name, **context)
+        if response is None:
+            return f"Page template not found: {name}", 404
+        return response
+
     def _chat(self, conversation_id):
         if not '-' in conversation_id:
             return redirect(f'/chat')
 
-        return render_template('index.html', chat_id=conversation_id)
+        return self._page('index.html', chat_id=conversation_id)
 
     def _index(self):
-        return render_template('index.html', chat_id=f'{urandom(4).hex()}-{urandom(2).hex()}-{urandom(2).hex()}-{urandom(2).hex()}-{hex(int(time() * 1000))[2:]}')
+        return self._page('index.html', chat_id=new_chat_id())
 
     def _assets(self, folder: str, file: str):
-        try:
-            return send_file(f"./../client/{folder}/{file}", as_attachment=False)
-        except:
-            return "File not found", 404
+        if folder == 'bundles':
+            response = self.bundles.serve(file, request.headers)
+        elif folder == 'img':
+            # Pillow is imported by the first image request, not at startup
+            from server.images import get_image_variants
+
+            response = get_image_variants().serve(file, request.headers, request.args.get('w'))
+        else:
+            response = self.assets.serve(folder, file, request.headers)
+        if response is None:
+            return f"Asset not found: {folder}/{file}", 404
+        return response
 
     def _onboarding(self):
-        return render_template('onboarding.html')
-    
+        return self._page('onboarding.html')
+
     def _workspace(self):
-        return render_template('workspace.html', chat_id=f'{urandom(4).hex()}-{urandom(2).hex()}-{urandom(2).hex()}-{urandom(2).hex()}-{hex(int(time() * 1000))[2:]}')
-    
-    def _links(self, 
-               conversation_id, 
+        return self._page('workspace.html', chat_id=new_chat_id())
+
+    def _links(self,
+               conversation_id,
                scrolly,
                video_ids_concat,
                titles_concat
                ):
-        return render_template('links.html',
-                               chat_id=conversation_id,
-                               scrolly=scrolly,
-                               video_ids_concat=video_ids_concat,
-                               titles_concat=titles_concat
-                               )
+        return self._page('links.html',
+                          chat_id=conversation_id,
+                          scrolly=scrolly,
+                          video_ids_concat=video_ids_concat,
+                          titles_concat=titles_concat
+                          )
+
+    def _links_page(self, subpath=None):
+        return self._page('links.html')
+
+    def _test(self):
+        return f"""
+    <h1>Test Route Working!</h1>
+    <p>✅ Flask {version('flask')} is running correctly</p>
+    <p><a href="/">← Back to Home</a> | <a href="/debug">Debug Info →</a></p>
+    """
+
+    def _debug(self):
+        def listdir(path):
+            try:
+                return sorted(os.listdir(path))
+            except OSError as e:
+                return [f"Error: {e}"]
+
+        folders = ''.join(
+            f"<p><strong>{folder}:</strong> {listdir(os.path.join(CLIENT_DIR, folder))}</p>"
+            for folder in ('html', 'css', 'js', 'img')
+        )
+        startup = self.app.extensions.get('nog_startup', {})
+        return f"""
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <title>Debug Info</title>
+            <style>
+                body {{ font-family: Arial, sans-serif; margin: 20px; }}
+                .section {{ margin: 20px 0; padding: 10px; border: 1px solid #ccc; }}
+                .files {{ background: #f5f5f5; padding: 10px; }}
+            </style>
+        </head>
+        <body>
+            <h1>🔍 Debug Information</h1>
+
+            <div class="section">
+                <h2>System Info</h2>
+                <p><strong>Root Directory:</strong> {ROOT_DIR}</p>
+                <p><strong>Python Version:</strong> {sys.version}</p>
+                <p><strong>Flask Version:</strong> {version('flask')}</p>
+                <p><strong>Cold Start:</strong> {startup.get('seconds', 0) * 1000:.1f} ms</p>
+                <p><strong>Request Method:</strong> {request.method}</p>
+                <p><strong>Request Path:</strong> {request.path}</p>
+            </div>
+
+            <div class="section">
+                <h2>File Structure</h2>
+                <div class="files">
+                    <p><strong>Root files:</strong> {listdir(ROOT_DIR)}</p>
+                    <p><strong>Client files:</strong> {listdir(CLIENT_DIR)}</p>
+                </div>
+                <h3>Client Subdirectories:</h3>
+                <div class="files">{folders}</div>
+            </div>
+
+            <div class="section">
+                <h2>Navigation</h2>
+                <p><a href="/">← Home</a> | <a href="/test">Test Route</a></p>
+            </div>
+        </body>
+        </html>
+        """
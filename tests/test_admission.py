@@ -0,0 +1,93 @@
+import threading
+
+import pytest
+
+from server.admission import AdmissionController, AdmissionError, RateLimiter
+
+
+def test_slot_is_released_when_the_stream_ends():
+    controller = AdmissionController(max_concurrent=1)
+    ticket = controller.admit()
+    events = controller.guard(iter([b'a', b'b']), ticket)
+    assert controller.stats()['active'] == 1
+
+    assert next(events).startswith(b'data: {"admission"')
+    assert list(events) == [b'a', b'b']
+    assert controller.stats()['active'] == 0
+
+
+def test_slot_is_released_when_the_stream_fails():
+    def failing():
+        yield b'a'
+        raise RuntimeError('upstream gone')
+
+    controller = AdmissionController(max_concurrent=1)
+    events = controller.guard(failing(), controller.admit())
+    with pytest.raises(RuntimeError):
+        list(events)
+    assert controller.stats()['active'] == 0
+
+
+def test_slot_is_released_when_closed_before_iteration():
+    # What a WSGI server does when the client left before the first write
+    controller = AdmissionController(max_concurrent=1)
+    events = controller.guard(iter([b'a']), controller.admit())
+    events.close()
+    assert controller.stats()['active'] == 0
+
+
+def test_release_is_idempotent():
+    controller = AdmissionController(max_concurrent=2)
+    ticket = controller.admit()
+    controller.admit()
+    ticket.release()
+    ticket.release()
+    assert controller.stats()['active'] == 1
+
+
+def test_full_queue_and_timeout_are_503():
+    controller = AdmissionController(max_concurrent=1, max_queue=0)
+    controller.admit()
+    with pytest.raises(AdmissionError) as e:
+        controller.admit()
+    assert e.value.status == 503
+
+    controller = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=0.05)
+    controller.admit()
+    with pytest.raises(AdmissionError):
+        controller.admit()
+    stats = controller.stats()
+    assert stats['timeouts'] == 1 and stats['waiting'] == 0
+
+
+def test_released_slot_goes_to_the_waiter():
+    controller = AdmissionController(max_concurrent=1, queue_timeout=5)
+    ticket = controller.admit()
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(controller.admit()))
+    waiter.start()
+    while controller.stats()['waiting'] == 0:
+        threading.Event().wait(0.01)
+
+    ticket.release()
+    waiter.join(5)
+    assert admitted and admitted[0].queued > 0
+    assert controller.stats()['active'] == 1
+
+
+def test_rate_limit_is_per_client():
+    controller = AdmissionController(limiter=RateLimiter(rate=0.01, burst=2))
+    controller.check_rate('a')
+    controller.check_rate('a')
+    with pytest.raises(AdmissionError) as e:
+        controller.check_rate('a')
+    assert e.value.status == 429 and int(e.value.headers()['Retry-After']) > 1
+    controller.check_rate('b')
+
+
+def test_forwarded_for_is_only_trusted_from_proxies():
+    controller = AdmissionController(trusted_proxies=['127.0.0.1', '10.0.0.0/8'])
+    assert controller.client_key({'X-Forwarded-For': '6.6.6.6'}, '203.0.113.7') == '203.0.113.7'
+    forwarded = {'X-Forwarded-For': '6.6.6.6, 198.51.100.2, 10.1.1.1'}
+    assert controller.client_key(forwarded, '127.0.0.1') == '198.51.100.2'
+    assert controller.client_key({}, '127.0.0.1') == '127.0.0.1'
@@ -0,0 +1,64 @@
+import time
+
+from server.cache import AnswerCache, wants_bypass
+
+ANSWER = [b'data: {"content": "Bonjour"}\n\n', b'data: [DONE]\n\n']
+
+
+def test_key_ignores_case_punctuation_and_spacing():
+    cache = AnswerCache(enable=False)
+    assert cache.key('Quel est le délai ?') == cache.key('  quel EST le   délai')
+    assert cache.key('Quel est le délai ?') != cache.key('Quel est le préavis ?')
+
+
+def test_key_depends_on_context():
+    cache = AnswerCache(enable=False)
+    assert cache.key('Et ensuite ?', 'a') != cache.key('Et ensuite ?', 'b')
+    assert cache.key('Et ensuite ?', '') == cache.key('Et ensuite ?')
+
+
+def test_entry_expires_after_ttl():
+    cache = AnswerCache(ttl=0.05)
+    cache.put('k', 'q', ANSWER)
+    assert cache.get('k') == ANSWER
+    time.sleep(0.1)
+    assert cache.get('k') is None
+
+
+def test_disk_entry_keeps_its_expiry(tmp_path):
+    path = str(tmp_path / 'answers.db')
+    AnswerCache(ttl=0.2, path=path).put('k', 'q', ANSWER)
+
+    # A fresh process with a longer TTL reads the entry back from disk: it
+    # must still expire when the disk row does, not a full TTL later
+    cache = AnswerCache(ttl=3600, path=path)
+    assert cache.get('k') == ANSWER
+    time.sleep(0.3)
+    assert cache.get('k') is None
+
+
+def test_only_complete_answers_are_stored():
+    cache = AnswerCache()
+    list(cache.record('done', 'q', iter(ANSWER)))
+    list(cache.record('cut', 'q', iter(ANSWER[:1])))
+    list(cache.record('error', 'q', iter([b'data: {"error": "boom"}\n\n', b'data: [DONE]\n\n'])))
+    assert cache.get('done') == ANSWER
+    assert cache.get('cut') is None
+    assert cache.get('error') is None
+
+
+def test_stream_replays_a_hit():
+    cache = AnswerCache()
+    events, status = cache.stream('Question', {}, lambda: iter(ANSWER))
+    assert status == 'MISS' and list(events) == ANSWER
+
+    events, status = cache.stream('question', {}, lambda: iter(()))
+    assert status == 'HIT' and list(events) == ANSWER
+
+
+def test_bypass_header():
+    assert wants_bypass({'X-Cache-Bypass': '1'})
+    assert wants_bypass({'X-Cache-Bypass': 'true'})
+    for value in ('', '0', 'false', 'No', 'off'):
+        assert not wants_bypass({'X-Cache-Bypass': value})
+    assert not wants_bypass({})
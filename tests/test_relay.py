@@ -0,0 +1,32 @@
+from server.relay import FrameSplitter
+
+
+def test_frames_are_cut_at_the_last_line_break():
+    splitter = FrameSplitter()
+    assert splitter.feed(b'data: a\n\ndata: b') == b'data: a\n\n'
+    assert splitter.feed(b'c\n\n') == b'data: bc\n\n'
+    assert splitter.flush() == b''
+
+
+def test_partial_line_waits():
+    splitter = FrameSplitter()
+    assert splitter.feed(b'data: ') == b''
+    assert splitter.feed(b'a') == b''
+    assert splitter.feed(b'\n\n') == b'data: a\n\n'
+
+
+def test_single_line_breaks_become_frames():
+    splitter = FrameSplitter()
+    assert splitter.feed(b'data: a\ndata: b\r\n') == b'data: a\n\ndata: b\n\n'
+
+
+def test_well_formed_frames_are_not_copied():
+    data = b'data: a\n\ndata: b\n\n'
+    assert FrameSplitter().feed(data) is data
+
+
+def test_flush_emits_the_last_line():
+    splitter = FrameSplitter()
+    splitter.feed(b'data: [DONE]')
+    assert splitter.flush() == b'data: [DONE]\n\n'
+    assert splitter.flush() == b''
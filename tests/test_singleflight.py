@@ -0,0 +1,74 @@
+import threading
+
+from server.relay import FlushPolicy
+from server.singleflight import SingleFlight
+
+
+class Source:
+    # Yields `events`, holding the last one until `release` is set
+    def __init__(self, events) -> None:
+        self.events = events
+        self.release = threading.Event()
+        self.started = False
+        self.closed = False
+
+    def __iter__(self):
+        self.started = True
+        for event in self.events[:-1]:
+            yield event
+        self.release.wait(5)
+        yield self.events[-1]
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def flights() -> SingleFlight:
+    return SingleFlight(policy=FlushPolicy(max_delay=0))
+
+
+def test_follower_replays_the_leader_stream():
+    single_flight = flights()
+    leader_source = Source([b'a', b'b', b'[DONE]'])
+    leader, role = single_flight.stream('k', iter(leader_source))
+    assert role == 'leader'
+    assert next(leader) == b'a'
+
+    follower_source = Source([b'x'])
+    follower, role = single_flight.stream('k', follower_source)
+    assert role == 'follower'
+    # A follower never starts its own upstream request
+    assert follower_source.closed and not follower_source.started
+
+    leader_source.release.set()
+    assert b''.join(leader) == b'b[DONE]'
+    assert b''.join(follower) == b'ab[DONE]'
+    assert single_flight.stats()['in_flight'] == 0
+
+
+def test_finished_flight_is_not_joined():
+    single_flight = flights()
+    events, _ = single_flight.stream('k', iter([b'a']))
+    assert list(events) == [b'a']
+    _, role = single_flight.stream('k', iter([b'b']))
+    assert role == 'leader'
+
+
+def test_upstream_is_aborted_when_every_reader_leaves():
+    class Abort:
+        aborted = False
+
+        def abort(self):
+            self.aborted = True
+
+    single_flight = flights()
+    source, abort = Source([b'a', b'b']), Abort()
+    leader, _ = single_flight.stream('k', iter(source), abort)
+    follower, _ = single_flight.stream('k', Source([b'x']))
+    assert next(leader) == b'a' and next(follower) == b'a'
+
+    leader.close()
+    assert not abort.aborted
+    follower.close()
+    assert abort.aborted
+    source.release.set()